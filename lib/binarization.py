@@ -0,0 +1,244 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''NumPy implementations of binarization methods'''
+
+# The results are exactly the same as those of the Gamera plugins
+# with the same names (including their quirks).
+# The input image is a (height, width) array of bytes.
+# The result is a boolean array, in which foreground (black) pixels are true.
+
+from . import layers
+
+# Number of rows processed at once by the local methods;
+# this bounds the size of temporary arrays.
+_strip_height = 256
+
+def _integral_image(data):
+    numpy = layers.numpy
+    [height, width] = data.shape
+    result = numpy.zeros((height + 1, width + 1), dtype=numpy.int64)
+    numpy.cumsum(data, axis=0, dtype=numpy.int64, out=result[1:, 1:])
+    numpy.cumsum(result[1:, 1:], axis=1, out=result[1:, 1:])
+    return result
+
+def _get_windows(size, half_region_size):
+    '''
+    Return the start and end (exclusive) indices of windows,
+    clipped to the image boundaries.
+    '''
+    numpy = layers.numpy
+    indices = numpy.arange(size)
+    starts = numpy.maximum(indices - half_region_size, 0)
+    ends = numpy.minimum(indices + half_region_size, size - 1) + 1
+    return starts, ends
+
+def _check_region_size(name, data, region_size):
+    if not (1 <= region_size <= min(data.shape)):
+        raise ValueError('{0}: region_size out of range'.format(name))
+
+def _local_mean_deviation(data, region_size):
+    '''
+    Compute the mean and the standard deviation of each pixel's neighbourhood,
+    one strip of rows at a time, using integral images,
+    so that the cost doesn't depend on the region size.
+    Generate (y0, y1, means, deviations) tuples.
+    '''
+    # The neighbourhood is a (region_size // 2 * 2 + 1)-pixel square
+    # centred at the pixel, clipped to the image boundaries;
+    # just like in Gamera's mean_filter() and variance_filter().
+    numpy = layers.numpy
+    [height, width] = data.shape
+    half_region_size = region_size // 2
+    sums = _integral_image(data)
+    squares = data.astype(numpy.int64)
+    squares *= squares
+    square_sums = _integral_image(squares)
+    del squares
+    [ys0, ys1] = _get_windows(height, half_region_size)
+    [xs0, xs1] = _get_windows(width, half_region_size)
+    areas_x = (xs1 - xs0).astype(numpy.float64)
+    for y0 in xrange(0, height, _strip_height):
+        y1 = min(y0 + _strip_height, height)
+        wy0 = ys0[y0:y1, None]
+        wy1 = ys1[y0:y1, None]
+        areas = (wy1 - wy0) * areas_x
+        def window_sum(sat):
+            return (
+                sat[wy1, xs1] - sat[wy0, xs1] -
+                sat[wy1, xs0] + sat[wy0, xs0]
+            )
+        # The sums are exact, so the floating-point results are
+        # bit-for-bit identical to Gamera's:
+        means = window_sum(sums) / areas
+        variances = window_sum(square_sums) / areas - means * means
+        # Rounding errors can make variances slightly negative;
+        # the deviations are NaN then, as in Gamera.
+        with numpy.errstate(invalid='ignore'):
+            deviations = numpy.sqrt(variances)
+        yield y0, y1, means, deviations
+
+def _local_threshold(data, region_size, lower_bound, upper_bound, get_threshold):
+    numpy = layers.numpy
+    result = numpy.empty(data.shape, dtype=bool)
+    for y0, y1, means, deviations in _local_mean_deviation(data, region_size):
+        strip = data[y0:y1]
+        threshold = get_threshold(means, deviations)
+        black = ~(strip > threshold)
+        black &= ~(strip >= upper_bound)
+        black |= strip < lower_bound
+        result[y0:y1] = black
+    return result
+
+def niblack(data, region_size=15, sensitivity=-0.2, lower_bound=20, upper_bound=150):
+    _check_region_size('niblack_threshold', data, region_size)
+    def get_threshold(means, deviations):
+        return means + sensitivity * deviations
+    return _local_threshold(data, region_size, lower_bound, upper_bound, get_threshold)
+
+def sauvola(data, region_size=15, sensitivity=0.5, dynamic_range=128, lower_bound=20, upper_bound=150):
+    _check_region_size('sauvola_threshold', data, region_size)
+    def get_threshold(means, deviations):
+        # Sauvola's paper multiplies the mean by this factor, but Gamera adds it.
+        adjusted_deviations = 1.0 - deviations / float(dynamic_range)
+        return means + (1.0 - sensitivity * adjusted_deviations)
+    return _local_threshold(data, region_size, lower_bound, upper_bound, get_threshold)
+
+def _running_extreme(data, length, ufunc):
+    '''
+    Compute ufunc (numpy.minimum or numpy.maximum)
+    over each length-row window of the array.
+
+    This is the van Herk/Gil-Werman algorithm:
+    the cost per row doesn't depend on the window length.
+    '''
+    numpy = layers.numpy
+    size = len(data)
+    nblocks = -(-size // length)
+    padded = numpy.empty((nblocks * length,) + data.shape[1:], dtype=data.dtype)
+    padded[:size] = data
+    padded[size:] = data[-1]
+    blocks = padded.reshape((nblocks, length) + data.shape[1:])
+    prefixes = ufunc.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffixes = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    return ufunc(suffixes[:size - length + 1], prefixes[length - 1:size])
+
+def _bernsen_extreme(data, half_region_size, ufunc):
+    '''
+    Compute ufunc (numpy.minimum or numpy.maximum)
+    over each row's neighbourhood, as defined by Gamera's bernsen_threshold().
+    '''
+    # The neighbourhood of row y is [y - half, y + half),
+    # with out-of-range rows mirrored around y.
+    # Near the top this amounts to [0, y + half];
+    # near the bottom, to [y - half, size).
+    numpy = layers.numpy
+    size = len(data)
+    half = half_region_size
+    result = numpy.empty_like(data)
+    head = ufunc.accumulate(data[:2 * half], axis=0)
+    result[:half] = head[half:]
+    result[half:size - half + 1] = _running_extreme(data, 2 * half, ufunc)
+    tail = ufunc.accumulate(data[size - 2 * half + 1:][::-1], axis=0)[::-1]
+    result[size - half + 1:] = tail[:half - 1]
+    return result
+
+def bernsen(data, region_size=11, contrast_limit=80, doubt_to_black=False):
+    numpy = layers.numpy
+    if not (0 <= contrast_limit <= 255):
+        raise ValueError('bernsen_threshold: contrast_limit out of range')
+    _check_region_size('bernsen_threshold', data, region_size)
+    half_region_size = region_size // 2
+    if half_region_size == 0:
+        # Gamera looks at an empty neighbourhood then,
+        # so minimum = 255 and maximum = 0;
+        # and the contrast wraps around to 1.
+        contrast = numpy.ones_like(data)
+        threshold = 127
+    else:
+        def extreme(ufunc):
+            result = _bernsen_extreme(data, half_region_size, ufunc)
+            return _bernsen_extreme(result.T, half_region_size, ufunc).T
+        minima = extreme(numpy.minimum)
+        maxima = extreme(numpy.maximum)
+        contrast = maxima - minima
+        threshold = (maxima.astype(numpy.int16) + minima) // 2
+        del minima, maxima
+    black = data < threshold
+    black[contrast < contrast_limit] = doubt_to_black
+    return black
+
+def global_(data, threshold):
+    return data <= threshold
+
+def otsu_find_threshold(data):
+    '''
+    Find the threshold using Otsu's method.
+    '''
+    numpy = layers.numpy
+    histogram = numpy.bincount(data.ravel(), minlength=256).astype(numpy.float64)
+    histogram /= data.size
+    # The computations are done in the same order as in Gamera,
+    # so that rounding errors (and divisions by zero) are the same.
+    p = [numpy.float64(x) for x in histogram]
+    mu_t = numpy.float64(0.0)
+    for i in xrange(256):
+        mu_t += i * p[i]
+    sigma_t = numpy.float64(0.0)
+    for i in xrange(256):
+        sigma_t += (i - mu_t) * (i - mu_t) * p[i]
+    k_low = 0
+    while p[k_low] == 0 and k_low < 255:
+        k_low += 1
+    k_high = 255
+    while p[k_high] == 0 and k_high > 0:
+        k_high -= 1
+    criterion = 0.0
+    threshold = 127
+    omega_k = numpy.float64(0.0)
+    mu_k = numpy.float64(0.0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for k in xrange(k_low, k_high + 1):
+            omega_k += p[k]
+            mu_k += k * p[k]
+            expr = mu_t * omega_k - mu_k
+            sigma_b_k = expr * expr / (omega_k * (1 - omega_k))
+            if criterion < sigma_b_k / sigma_t:
+                criterion = sigma_b_k / sigma_t
+                threshold = k
+    return threshold
+
+def otsu(data):
+    return data <= otsu_find_threshold(data)
+
+methods = {
+    'bernsen': bernsen,
+    'global': global_,
+    'niblack': niblack,
+    'otsu': otsu,
+    'sauvola': sauvola,
+}
+
+__all__ = [
+    'bernsen',
+    'global_',
+    'methods',
+    'niblack',
+    'otsu',
+    'otsu_find_threshold',
+    'sauvola',
+]
+
+# vim:ts=4 sts=4 sw=4 et
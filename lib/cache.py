@@ -0,0 +1,102 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''persistent mask cache'''
+
+import errno
+import hashlib
+import os
+
+from . import rle
+from . import temporary
+
+# Bump this whenever masks generated for the same input could change:
+FORMAT_VERSION = 1
+
+def hash_file(path):
+    '''
+    Return SHA-1 hash of the file contents.
+    '''
+    hash = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(1 << 16)
+            if not chunk:
+                break
+            hash.update(chunk)
+    return hash.hexdigest()
+
+class MaskCache(object):
+
+    '''
+    Directory of masks (stored in the PBM format),
+    keyed by hash of the image file, binarization method and its parameters.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_key(self, image_filename, method, params):
+        hash = hashlib.sha1()
+        hash.update('didjvu-mask-{0}\0'.format(FORMAT_VERSION))
+        hash.update(hash_file(image_filename) + '\0')
+        hash.update(method.name + '\0')
+        for pname, pvalue in sorted(params.iteritems()):
+            hash.update('{0}={1!r}\0'.format(pname, pvalue))
+        return hash.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pbm')
+
+    def get(self, key):
+        '''
+        Return the cached mask (as a run-length encoded bitmap),
+        or None if there's no such mask in the cache.
+        '''
+        try:
+            return rle.Bitmap.load(self._get_path(key))
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                return
+            raise
+
+    def put(self, key, mask):
+        '''
+        Store the mask (a run-length encoded bitmap) in the cache.
+        '''
+        path = self._get_path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        # Write to a temporary file first,
+        # so that concurrent readers never see a partial mask:
+        file = temporary.file(dir=directory, suffix='.pbm', delete=False)
+        try:
+            with file:
+                file.write(mask.to_pbm())
+            os.rename(file.name, path)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+
+__all__ = [
+    'MaskCache',
+    'hash_file',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -20,7 +20,10 @@ didjvu's command-line interface
 import argparse
 import functools
 
+from . import dictionaries
 from . import djvu_support as djvu
+from . import preview
+from . import rle
 from . import version
 from . import xmp
 
@@ -37,6 +40,31 @@ dpi_type = range_int(djvu.DPI_MIN, djvu.DPI_MAX, 'dpi')
 losslevel_type = range_int(djvu.LOSS_LEVEL_MIN, djvu.LOSS_LEVEL_MAX, 'loss level')
 subsample_type = range_int(djvu.SUBSAMPLE_MIN, djvu.SUBSAMPLE_MAX, 'subsample')
 
+def scale_type(value):
+    value = float(value)
+    if not (0 < value <= 1):
+        raise ValueError
+    return value
+scale_type.__name__ = 'scale'
+
+def jobs_type(value):
+    jobs = [int(n) for n in value.split(',')]
+    if len(jobs) == 1:
+        jobs *= 3
+    if len(jobs) != 3:
+        raise ValueError
+    if min(jobs) < 1:
+        raise ValueError
+    return tuple(jobs)
+jobs_type.__name__ = 'jobs'
+
+def pages_per_dict_type(value):
+    if value == dictionaries.AUTO:
+        return value
+    return int(value)
+
+pages_per_dict_type.__name__ = 'pages-per-dict'
+
 def slice_type(max_slices=djvu.IW44_N_SLICES_MAX):
 
     def slices(value):
@@ -75,6 +103,43 @@ def get_slice_repr(lst):
     plus_lst = functools.reduce(fold, lst[1:], lst[:1])
     return str.join('+', map(str, plus_lst))
 
+def parse_params(method, params):
+    '''
+    Parse NAME[=VALUE] strings into a dictionary of the method parameters.
+    Raise ValueError if they are not valid for the method.
+    '''
+    result = {}
+    for param in params:
+        if '=' not in param:
+            if param.isdigit() and len(method.args) == 1:
+                [pname] = method.args
+                pvalue = param
+            else:
+                pname = param
+                pvalue = True
+        else:
+            [pname, pvalue] = param.split('=', 1)
+        pname = replace_underscores(pname)
+        try:
+            arg = method.args[pname]
+        except KeyError:
+            raise ValueError('invalid parameter name {0!r}'.format(pname))
+        try:
+            if (pvalue is True) and (arg.type is not bool):
+                raise ValueError
+            pvalue = arg.type(pvalue)
+        except ValueError:
+            raise ValueError('invalid parameter {0} value: {1!r}'.format(pname, pvalue))
+        if (arg.min is not None) and pvalue < arg.min:
+            raise ValueError('parameter {0} must be >= {1}'.format(pname, arg.min))
+        if (arg.max is not None) and pvalue > arg.max:
+            raise ValueError('parameter {0} must be <= {1}'.format(pname, arg.max))
+        result[arg.name] = pvalue
+    for arg in method.args.itervalues():
+        if (not arg.has_default) and (arg.name not in result):
+            raise ValueError('parameter {0} is not set'.format(arg.name))
+    return result
+
 class intact(object):
 
     def __init__(self, x):
@@ -149,9 +214,10 @@ class ArgumentParser(argparse.ArgumentParser):
         p_separate = self.add_subparser('separate', help='generate masks for images')
         p_encode = self.add_subparser('encode', help='convert images to single-page DjVu documents')
         p_bundle = self.add_subparser('bundle', help='convert images to bundled multi-page DjVu document')
+        p_tune = self.add_subparser('tune', help='find good layer encoding settings for sample images')
         epilog = []
         default = self.defaults
-        for p in p_separate, p_encode, p_bundle:
+        for p in p_separate, p_encode, p_bundle, p_tune:
             epilog += ['{prog} --help'.format(prog=p.prog)]
             p.add_argument('-o', '--output', metavar='FILE', help='output filename')
             if p is p_bundle:
@@ -163,7 +229,7 @@ class ArgumentParser(argparse.ArgumentParser):
                     '--pageid-template', dest='page_id_template', metavar='TEMPLATE',
                     help=argparse.SUPPRESS
                 )  # obsolete alias
-            else:
+            elif p is not p_tune:
                 if p is p_separate:
                     template = 'sep.{base-ext}.png'
                 else:
@@ -172,6 +238,19 @@ class ArgumentParser(argparse.ArgumentParser):
                     '--output-template', metavar='TEMPLATE',
                     help='naming scheme for output files (e.g. "{template}")'.format(template=template)
                 )
+            if p is p_separate:
+                p.add_argument(
+                    '--format', choices=rle.FORMATS,
+                    help='mask format (default: based on the file extension, or png)'
+                )
+                p.add_argument(
+                    '--preview', metavar='SCALE', type=scale_type,
+                    help='downscale images by SCALE, and render masks for a number of methods side by side'
+                )
+                p.add_argument(
+                    '--try', dest='preview_variants', action='append', metavar='METHOD[,NAME=VALUE...]',
+                    help='binarization method and parameters to preview (can be given more than once)'
+                )
             p.add_argument('--losslevel', dest='loss_level', type=losslevel_type, help=argparse.SUPPRESS)
             p.add_argument(
                 '--loss-level', dest='loss_level', type=losslevel_type, metavar='N',
@@ -223,8 +302,8 @@ class ArgumentParser(argparse.ArgumentParser):
                 )
             if p is p_bundle:
                 p.add_argument(
-                    '-p', '--pages-per-dict', type=int, metavar='N',
-                    help='how many pages to compress in one pass (default: {n})'.format(n=default.pages_per_dict)
+                    '-p', '--pages-per-dict', type=pages_per_dict_type, metavar='N',
+                    help='how many pages to compress in one pass, or "auto" (default: {n})'.format(n=default.pages_per_dict)
                 )
             p.add_argument(
                 '-m', '--method', choices=methods, metavar='METHOD', type=replace_underscores, default=default_method,
@@ -234,8 +313,38 @@ class ArgumentParser(argparse.ArgumentParser):
                 '-x', '--param', action='append', dest='params', metavar='NAME[=VALUE]',
                 help='binarization method parameter (can be given more than once)'
             )
+            p.add_argument(
+                '--mask-cache', metavar='DIRECTORY',
+                help='reuse masks generated by previous runs, and store new ones, in DIRECTORY'
+            )
+            if p is p_encode:
+                p.add_argument(
+                    '-j', '--jobs', type=jobs_type, metavar='N[,N,N]',
+                    help='process pages in parallel, with N workers for each stage (decoding, binarization, encoding)'
+                )
             if p is p_encode or p is p_bundle:
                 p.add_argument('--xmp', action='store_true', help='create sidecar XMP metadata (experimental!)')
+                p.add_argument(
+                    '--stats-json', metavar='FILE',
+                    help='append per-page statistics to FILE, in the JSON Lines format'
+                )
+            if p is p_tune:
+                p.add_argument(
+                    '--layer', choices=('fg', 'bg'), default='bg',
+                    help='layer to tune (default: bg)'
+                )
+                p.add_argument(
+                    '--slices', type=slice_type(), action='append', metavar='N+...+N',
+                    help='candidate number of slices (can be given more than once)'
+                )
+                p.add_argument(
+                    '--crcb', choices=map(str, djvu.CRCB.values), action='append',
+                    help='candidate chrominance encoding (can be given more than once)'
+                )
+                p.add_argument(
+                    '--subsample', type=subsample_type, action='append', metavar='N',
+                    help='candidate subsample ratio (can be given more than once)'
+                )
             p.add_argument(
                 '-v', '--verbose', dest='verbosity', action='append_const', const=None,
                 help='more informational messages'
@@ -244,7 +353,14 @@ class ArgumentParser(argparse.ArgumentParser):
                 '-q', '--quiet', dest='verbosity', action='store_const', const=[],
                 help='no informational messages'
             )
-            p.add_argument('input', metavar='IMAGE', nargs='+')
+            if p is p_encode or p is p_bundle:
+                p.add_argument(
+                    '--manifest', metavar='FILE',
+                    help='read the list of input images (and per-page settings) from FILE'
+                )
+                p.add_argument('input', metavar='IMAGE', nargs='*')
+            else:
+                p.add_argument('input', metavar='IMAGE', nargs='+')
             p.set_defaults(
                 masks=[],
                 fg_bg_defaults=None,
@@ -259,6 +375,10 @@ class ArgumentParser(argparse.ArgumentParser):
                 bg_subsample=intact(default.bg_subsample),
                 verbosity=[None],
                 xmp=False,
+                stats_json=None,
+                mask_cache=None,
+                manifest=None,
+                jobs=None,
             )
             p.epilog = _get_method_params_help(methods)
         self.epilog = 'more help:\n  ' + str.join('\n  ', epilog)
@@ -269,44 +389,33 @@ class ArgumentParser(argparse.ArgumentParser):
             self.__subparsers
         except AttributeError:
             self.__subparsers = self.add_subparsers(parser_class=argparse.ArgumentParser)
+            self.__subparsers_by_name = {}
         kwargs.setdefault('formatter_class', argparse.RawDescriptionHelpFormatter)
         p = self.__subparsers.add_parser(name, **kwargs)
         p.set_defaults(_action_=name)
+        self.__subparsers_by_name[name] = p
         return p
 
     def _parse_params(self, options):
         o = options
-        result = {}
-        for param in o.params or ():
-            if '=' not in param:
-                if param.isdigit() and len(o.method.args) == 1:
-                    [pname] = o.method.args
-                    pvalue = param
-                else:
-                    pname = param
-                    pvalue = True
-            else:
-                [pname, pvalue] = param.split('=', 1)
-            pname = replace_underscores(pname)
-            try:
-                arg = o.method.args[pname]
-            except KeyError:
-                self.error('invalid parameter name {0!r}'.format(pname))
-            try:
-                if (pvalue is True) and (arg.type is not bool):
-                    raise ValueError
-                pvalue = arg.type(pvalue)
-            except ValueError:
-                self.error('invalid parameter {0} value: {1!r}'.format(pname, pvalue))
-            if (arg.min is not None) and pvalue < arg.min:
-                self.error('parameter {0} must be >= {1}'.format(pname, arg.min))
-            if (arg.max is not None) and pvalue > arg.max:
-                self.error('parameter {0} must be <= {1}'.format(pname, arg.max))
-            result[arg.name] = pvalue
-        for arg in o.method.args.itervalues():
-            if (not arg.has_default) and (arg.name not in result):
-                self.error('parameter {0} is not set'.format(arg.name))
-        return result
+        try:
+            return parse_params(o.method, o.params or ())
+        except ValueError as exc:
+            self.error(str(exc))
+
+    def _parse_variant(self, subparser, spec):
+        params = spec.split(',')
+        method_name = params.pop(0)
+        method_name = replace_underscores(method_name)
+        try:
+            method = self.__methods[method_name]
+        except KeyError:
+            subparser.error('invalid method: {0!r}'.format(method_name))
+        try:
+            params = parse_params(method, params)
+        except ValueError as exc:
+            subparser.error(str(exc))
+        return preview.Variant(method, params)
 
     def parse_args(self, actions):
         o = argparse.ArgumentParser.parse_args(self)
@@ -327,17 +436,36 @@ class ArgumentParser(argparse.ArgumentParser):
                     namespace.crcb = getattr(djvu.CRCB, namespace.crcb)
         if o.fg_bg_defaults is not False:
             o.fg_bg_defaults = True
+        if getattr(o, 'crcb', None) is not None:
+            o.crcb = [getattr(djvu.CRCB, crcb) for crcb in o.crcb]
         o.verbosity = len(o.verbosity)
-        if o.pages_per_dict <= 1:
+        if o.pages_per_dict != dictionaries.AUTO and o.pages_per_dict <= 1:
             o.pages_per_dict = 1
-        action = getattr(actions, vars(o).pop('_action_'))
+        action_name = vars(o).pop('_action_')
+        subparser = self.__subparsers_by_name[action_name]
+        if o.manifest is None:
+            if not o.input:
+                subparser.error('too few arguments')
+        else:
+            if o.input:
+                subparser.error('--manifest cannot be used together with IMAGE arguments')
+            if o.masks:
+                subparser.error('--manifest cannot be used together with --masks')
         o.method = self.__methods[o.method]
         o.params = self._parse_params(o)
+        if getattr(o, 'preview_variants', None) is not None:
+            if o.preview is None:
+                subparser.error('--try requires --preview')
+            o.preview_variants = [
+                self._parse_variant(subparser, spec)
+                for spec in o.preview_variants
+            ]
         try:
             if o.xmp and not xmp.backend:
                 raise xmp.import_error  # pylint: disable=raising-bad-type
         except AttributeError:
             pass
+        action = getattr(actions, action_name)
         return action(o)
 
 def dump_options(o, multipage=False):
@@ -0,0 +1,142 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''planning of shared dictionaries'''
+
+from . import rle
+
+AUTO = 'auto'
+
+# Components smaller than this (in pixels) are likely to be noise:
+SYMBOL_MIN_PIXELS = 4
+
+# Maximum number of symbols sampled from each page:
+SYMBOL_SAMPLE_SIZE = 1000
+
+# Finding connected components in pure Python is slow,
+# so only this many evenly spaced bands of rows, of this height,
+# are looked at:
+SYMBOL_SAMPLE_BANDS = 8
+SYMBOL_SAMPLE_BAND_HEIGHT = 256
+
+# In the automatic mode, a page starts a new window,
+# if less than this fraction of its symbols are shared with the window:
+AUTO_MIN_OVERLAP = 0.5
+
+# In the automatic mode, windows are capped to keep minidjvu time and memory
+# under control:
+AUTO_MAX_PAGES = 64
+AUTO_MAX_SYMBOLS = 200000
+
+def _get_sample_bands(height):
+    n = SYMBOL_SAMPLE_BANDS
+    band_height = SYMBOL_SAMPLE_BAND_HEIGHT
+    if n * band_height >= height:
+        return [(0, height)]
+    return [
+        (y0, y0 + band_height)
+        for i in xrange(n)
+        for y0 in [(height - band_height) * i // max(n - 1, 1)]
+    ]
+
+def get_symbol_shapes(mask):
+    '''
+    Return the (estimated) number of symbols in the mask
+    (a run-length encoded bitmap),
+    and the set of (approximate) shapes of a sample of these symbols.
+    '''
+    n_symbols = 0
+    n_rows = 0
+    components = []
+    for y0, y1 in _get_sample_bands(mask.height):
+        band = rle.Bitmap(mask.width, y1 - y0, mask.rows[y0:y1])
+        n_rows += y1 - y0
+        for cx0, cy0, cx1, cy1, n in band.connected_components():
+            if n < SYMBOL_MIN_PIXELS:
+                continue
+            if cy0 == 0 and y0 > 0:
+                # The symbol starts above the band;
+                # each symbol is counted only in the band it starts in.
+                continue
+            n_symbols += 1
+            if cy1 == y1 - y0 and y1 < mask.height:
+                # The symbol continues below the band,
+                # so its shape is not known.
+                continue
+            components += [(cx1 - cx0, cy1 - cy0, n)]
+    if n_rows < mask.height:
+        n_symbols = n_symbols * mask.height // n_rows
+    step = max(1, len(components) // SYMBOL_SAMPLE_SIZE)
+    shapes = set()
+    for width, height, n in components[::step]:
+        density = (8 * n) // (width * height)
+        shapes.add((width // 2, height // 2, density))
+    return n_symbols, shapes
+
+class Splitter(object):
+
+    '''
+    Split the sequence of pages into windows; each window will get its own
+    shared dictionary.
+    '''
+
+    def __init__(self, pages_per_dict):
+        self.pages_per_dict = pages_per_dict
+        self._n_pages = 0
+        self._n_symbols = 0
+        self._shapes = set()
+
+    @property
+    def auto(self):
+        return self.pages_per_dict == AUTO
+
+    def split_before(self, n_symbols=0, shapes=frozenset()):
+        '''
+        Add the next page; return True if it should start a new window.
+        In the automatic mode,
+        the page's symbol statistics (as returned by get_symbol_shapes())
+        must be provided.
+        '''
+        if self._n_pages == 0:
+            split = False
+        elif not self.auto:
+            split = self._n_pages >= self.pages_per_dict
+        elif self._n_pages >= AUTO_MAX_PAGES:
+            split = True
+        elif self._n_symbols + n_symbols > AUTO_MAX_SYMBOLS:
+            split = True
+        elif shapes:
+            overlap = 1.0 * len(shapes & self._shapes) / len(shapes)
+            split = overlap < AUTO_MIN_OVERLAP
+        else:
+            # No symbols, so nothing to share; but nothing to lose either.
+            split = False
+        if split:
+            self._n_pages = 0
+            self._n_symbols = 0
+            self._shapes = set()
+        self._n_pages += 1
+        if self.auto:
+            self._n_symbols += n_symbols
+            self._shapes |= shapes
+        return split
+
+__all__ = [
+    'AUTO',
+    'Splitter',
+    'get_symbol_shapes',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -19,19 +19,31 @@ didjvu core
 
 from __future__ import print_function
 
-import itertools
+import collections
+import contextlib
 import logging
+import multiprocessing
+import multiprocessing.pool
 import os
 import sys
 
+from . import cache
 from . import cli
+from . import dictionaries
 from . import djvu_support as djvu
 from . import filetype
 from . import fs
 from . import gamera_support as gamera
 from . import ipc
+from . import layers
+from . import manifest
+from . import pipeline
+from . import preview
+from . import rle
+from . import stats
 from . import templates
 from . import temporary
+from . import tuning
 from . import utils
 from . import xmp
 
@@ -46,15 +58,19 @@ def setup_logging():
     def nosy(msg, *args, **kwargs):
         logger.log(logging.NOSY, msg, *args, **kwargs)
     logger.nosy = nosy
+    # With --jobs, messages are prefixed with the name of the image
+    # that is being processed:
     # Main handler:
     handler = logging.StreamHandler()
-    formatter = logging.Formatter('%(message)s')
+    formatter = logging.Formatter('%(label)s%(message)s')
     handler.setFormatter(formatter)
+    handler.addFilter(pipeline.LabelFilter())
     logger.addHandler(handler)
     # IPC handler:
     handler = logging.StreamHandler()
-    formatter = logging.Formatter('+ %(message)s')
+    formatter = logging.Formatter('+ %(label)s%(message)s')
     handler.setFormatter(formatter)
+    handler.addFilter(pipeline.LabelFilter())
     ipc_logger.addHandler(handler)
 
 def error(message, *args, **kwargs):
@@ -63,84 +79,111 @@ def error(message, *args, **kwargs):
     print('didjvu: error: {msg}'.format(msg=message), file=sys.stderr)
     sys.exit(1)
 
+def make_sink(output):
+    if output is None:
+        return
+    if isinstance(output, basestring):
+        return fs.FileSink(output)
+    return fs.StreamSink(output)
+
+def read_manifest(path, default_method):
+    '''
+    Read the manifest file lazily.
+    Generate manifest.Page objects.
+    '''
+    try:
+        for page in manifest.read_file(path, gamera.methods, default_method):
+            yield page
+    except (IOError, ValueError) as exc:
+        error(exc)
+
+def expand_output_template(pages, template, xmp):
+    '''
+    Set output filenames of the pages, according to the template.
+    '''
+    memo = {}
+    for n, page in enumerate(pages):
+        output = templates.expand(template, page.image, n, memo)
+        page.output = make_sink(output)
+        page.xmp_output = make_sink(output + '.xmp' if xmp else None)
+        yield page
+
+def get_page_id(o, page, pageno, memo):
+    page_id = page.page_id
+    if page_id is None:
+        page_id = templates.expand(o.page_id_template, page.image, pageno, memo)
+    elif page_id in memo:
+        error('duplicate page identifier: {0!r}', page_id)
+    else:
+        memo[page_id] = 1
+    try:
+        djvu.validate_page_id(page_id)
+    except ValueError as exc:
+        error(exc)
+    return page_id
+
 def parallel_for(o, f, *iterables):
-    for args in zip(*iterables):
-        f(o, *args)
+    return [f(o, *args) for args in zip(*iterables)]
 
 def check_tty():
     if sys.stdout.isatty():
         error('refusing to write binary data to a terminal')
 
-def get_subsampled_dim(image, subsample):
-    width = (image.ncols + subsample - 1) // subsample
-    height = (image.nrows + subsample - 1) // subsample
-    return gamera.Dim(width, height)
+def subsample_fg(image, mask, options, data=None):
+    if data is None:
+        data = gamera.to_rgb_buffer(image)
+    return layers.subsample_fg(data, image.ncols, image.nrows, mask, options.subsample)
 
-def subsample_fg(image, mask, options):
-    # TODO: Optimize, perhaps using Cython.
+def subsample_bg(image, mask, options, data=None):
     ratio = options.subsample
-    subsampled_size = get_subsampled_dim(mask, ratio)
-    mask = mask.to_greyscale()
-    mask = mask.threshold(254)
-    mask = mask.erode()
-    subsampled_image = gamera.Image((0, 0), subsampled_size, pixel_type=gamera.RGB)
-    subsampled_mask = gamera.Image((0, 0), subsampled_size, pixel_type=gamera.ONEBIT)
-    y0 = 0
-    width, height = image.ncols, image.nrows
-    image = image.to_rgb()
-    image_get = image.get
-    mask_get = mask.get
-    subsampled_image_set = subsampled_image.set
-    subsampled_mask_set = subsampled_mask.set
-    for sy in xrange(0, subsampled_image.nrows):
-        x0 = 0
-        for sx in xrange(0, subsampled_image.ncols):
-            n = r = g = b = 0
-            y = y0
-            for dy in xrange(ratio):
-                if y >= height:
-                    break
-                x = x0
-                for dx in xrange(ratio):
-                    if x >= width:
-                        break
-                    pt = gamera.Point(x, y)
-                    if mask_get(pt):
-                        n += 1
-                        pixel = image_get(pt)
-                        r += pixel.red
-                        g += pixel.green
-                        b += pixel.blue
-                    x += 1
-                y += 1
-            pt = gamera.Point(sx, sy)
-            if n > 0:
-                r = (r + n // 2) // n
-                g = (g + n // 2) // n
-                b = (b + n // 2) // n
-                subsampled_image_set(pt, gamera.RGBPixel(r, g, b))
-            else:
-                subsampled_mask_set(pt, 1)
-            x0 += ratio
-        y0 += ratio
-    return subsampled_image, subsampled_mask
-
-def subsample_bg(image, mask, options):
-    dim = get_subsampled_dim(mask, options.subsample)
-    mask = mask.to_greyscale()
-    mask = mask.resize(dim, 0)
-    mask = mask.dilate().dilate()
-    mask = mask.threshold(254)
-    image = image.resize(dim, 1)
-    return image, mask
-
-def make_layer(image, mask, subsampler, options):
-    image, mask = subsampler(image, mask, options)
+    mask = layers.subsample_bg_mask(mask, ratio)
+    simage = layers.subsample_bg_image(gamera.to_pil_rgb(image, data), ratio)
+    if simage is None:
+        dim = gamera.Dim(mask.width, mask.height)
+        simage = gamera.to_pil_rgb(image.resize(dim, 1))
+    return simage, mask
+
+def make_layer(image, mask, options):
     return djvu.photo_to_djvu(
-        image=gamera.to_pil_rgb(image), mask_image=gamera.to_pil_1bpp(mask),
+        image=image, mask_image=mask,
         slices=options.slices, crcb=options.crcb
     )
 
+def encode_fg(image, mask, options, data=None):
+    '''
+    Encode the foreground layer.
+    The data, if not None, is the image converted with gamera.to_rgb_buffer().
+    Return a dictionary of chunks.
+    '''
+    fg_image, fg_mask = subsample_fg(image, mask, options, data)
+    color = layers.uniform_color(fg_image, fg_mask.to_pil(), default=layers.BLACK)
+    if color is None:
+        fg_djvu = make_layer(fg_image, fg_mask, options)
+        return dict(fg44=djvu.djvu_to_iw44(fg_djvu))
+    elif not layers.colors_close(color, layers.BLACK):
+        logger.nosy('- uniform foreground: {color}'.format(color=layers.color_to_html(color)))
+        return dict(fgbz=layers.color_to_html(color))
+    else:
+        # Black is the default foreground color.
+        logger.nosy('- black foreground')
+        return {}
+
+def encode_bg(image, mask, options, data=None):
+    '''
+    Encode the background layer.
+    The data, if not None, is the image converted with gamera.to_rgb_buffer().
+    Return a dictionary of chunks.
+    '''
+    bg_image, bg_mask = subsample_bg(image, mask, options, data)
+    color = layers.uniform_color(bg_image, bg_mask.to_pil(), default=layers.WHITE)
+    if (color is None) or not layers.colors_close(color, layers.WHITE):
+        bg_djvu = make_layer(bg_image, bg_mask, options)
+        return dict(bg44=djvu.djvu_to_iw44(bg_djvu))
+    else:
+        # White is the default background color.
+        logger.nosy('- white background')
+        return {}
+
 def image_dpi(image, options):
     dpi = options.dpi
     if dpi is None:
@@ -151,50 +194,90 @@ def image_dpi(image, options):
     dpi = min(dpi, djvu.DPI_MAX)
     return dpi
 
-def image_to_djvu(width, height, image, mask, options):
+def image_to_djvu(width, height, image, mask, options, encode_mask=True):
+    '''
+    Convert the image to DjVu.
+    The mask is a run-length encoded bitmap.
+    If encode_mask is false, the Sjbz chunk is not created;
+    it must be provided later by the caller.
+    '''
     dpi = image_dpi(image, options)
-    loss_level = options.loss_level
-    if options.pages_per_dict > 1:
-        # XXX This should probably go the other way round: we run minidjvu
-        # first, and then reuse its masks.
-        loss_level = 0
-    sjbz = djvu.bitonal_to_djvu(gamera.to_pil_1bpp(mask), loss_level=loss_level)
+    chunks = {}
+    if encode_mask:
+        chunks.update(sjbz=djvu.bitonal_to_djvu(mask, loss_level=options.loss_level))
+    if gamera.is_bitonal(image, mask):
+        # The foreground is black and the background is white,
+        # so there's no need to encode them.
+        return djvu.Multichunk(width, height, dpi, **chunks)
     if options.fg_bg_defaults:
         image = gamera.to_pil_rgb(image)
-        return djvu.Multichunk(width, height, dpi, image=image, sjbz=sjbz)
+        return djvu.Multichunk(width, height, dpi, image=image, **chunks)
     else:
-        chunks = dict(sjbz=sjbz)
-        if options.fg_options.slices != [0]:
-            fg_djvu = make_layer(image, mask, subsample_fg, options.fg_options)
-            chunks.update(fg44=djvu.djvu_to_iw44(fg_djvu))
-        if options.bg_options.slices != [0]:
-            bg_djvu = make_layer(image, mask, subsample_bg, options.bg_options)
-            chunks.update(bg44=djvu.djvu_to_iw44(bg_djvu))
+        fg = options.fg_options.slices != [0]
+        bg = options.bg_options.slices != [0]
+        # Both layers are subsampled from the same RGB copy of the image:
+        data = gamera.to_rgb_buffer(image) if fg or bg else None
+        if fg:
+            chunks.update(encode_fg(image, mask, options.fg_options, data))
+        if bg:
+            chunks.update(encode_bg(image, mask, options.bg_options, data))
         return djvu.Multichunk(width, height, dpi, **chunks)
 
-def generate_mask(filename, image, method, params):
+def _binarize_shared(label, shared_image, method_name, params):
+    with pipeline.labelled(label):
+        image = gamera.from_shared(shared_image)
+        mask = binarize(image, gamera.methods[method_name], params)
+        return mask.to_shared()
+
+def binarize(image, method, params, pool=None):
     '''
-    Generate mask using the provided method (if filename is not None);
+    Binarize the image using the provided method.
+    If pool is not None, do it in one of the pool's processes,
+    passing the image and the mask through shared memory.
+    Return the mask as a run-length encoded bitmap.
+    '''
+    if pool is not None:
+        shared_image = gamera.to_shared(image)
+        try:
+            shared_mask = pipeline.apply(pool, _binarize_shared,
+                (pipeline.get_label(), shared_image, method.name, params)
+            )
+        finally:
+            shared_image.release()
+        return rle.Bitmap.from_shared(shared_mask)
+    if isinstance(method, gamera.AutoMethod):
+        method = method.choose(image, **params)
+        logger.info('- binarization method: {0}'.format(method.name))
+        params = {}
+    return method.binarize(image, **params)
+
+def generate_mask(filename, image, method, params, mask_cache=None, image_filename=None, pool=None):
+    '''
+    Generate mask using the provided method (if filename is None);
     or simply load it from file (if filename is not None).
+    Bitonal images are their own masks.
+    Generated masks are looked up in (and stored in) the mask cache,
+    if it's provided.
+    The pool is passed to binarize().
+    Return the mask as a run-length encoded bitmap.
     '''
-    if filename is None:
-        return method(image, **params)
-    else:
-        return gamera.load_image(filename)
-
-def format_compression_info(bytes_in, bytes_out, bits_per_pixel):
-    ratio = 1.0 * bytes_in / bytes_out
-    percent_saved = (1.0 * bytes_in - bytes_out) * 100 / bytes_in
-    msg = (
-        '{bits_per_pixel:.3f} bits/pixel; '
-        '{ratio:.3f}:1, {percent_saved:.2f}% saved, '
-        '{bytes_in} bytes in, {bytes_out} bytes out'
-    ).format(
-        bits_per_pixel=bits_per_pixel,
-        ratio=ratio, percent_saved=percent_saved,
-        bytes_in=bytes_in, bytes_out=bytes_out,
-    )
-    return msg
+    if filename is not None:
+        if rle.guess_format(filename, default=None) == 'pbm':
+            # Gamera can't read PBM files.
+            return rle.Bitmap.load(filename)
+        return gamera.to_bitmap(gamera.load_image(filename))
+    if image.data.pixel_type == gamera.ONEBIT:
+        return gamera.to_bitmap(image)
+    if mask_cache is None:
+        return binarize(image, method, params, pool=pool)
+    key = mask_cache.get_key(image_filename, method, params)
+    mask = mask_cache.get(key)
+    if mask is not None:
+        logger.nosy('- using cached mask')
+        return mask
+    mask = binarize(image, method, params, pool=pool)
+    mask_cache.put(key, mask)
+    return mask
 
 class main(object):
 
@@ -203,13 +286,17 @@ class main(object):
         parser.parse_args(actions=self)
 
     def check_common(self, o):
-        if len(o.masks) == 0:
-            o.masks = [None for x in o.input]
+        if o.manifest is not None:
+            o.pages = read_manifest(o.manifest, o.method)
+        elif len(o.masks) == 0:
+            o.pages = [manifest.Page(image) for image in o.input]
         elif len(o.masks) != len(o.input):
             error('the number of input images ({0}) does not match the number of masks ({1})',
                 len(o.input),
                 len(o.masks)
             )
+        else:
+            o.pages = [manifest.Page(image, mask) for image, mask in zip(o.input, o.masks)]
         setup_logging()
         ipc_logger = logging.getLogger('didjvu.ipc')
         assert logger is not None
@@ -222,38 +309,29 @@ class main(object):
         ipc_logger.setLevel(log_level)
         djvu.require_cli()
         gamera.init()
+        if o.mask_cache is not None:
+            o.mask_cache = cache.MaskCache(o.mask_cache)
 
     def check_multi_output(self, o):
         self.check_common(o)
-        page_id_memo = {}
-        if o.output is None:
-            if o.output_template is not None:
-                o.output = [
-                    templates.expand(o.output_template, f, n, page_id_memo)
-                    for n, f in enumerate(o.input)
-                ]
-                o.xmp_output = [s + '.xmp' if o.xmp else None for s in o.output]
-            elif len(o.input) == 1:
-                o.output = [sys.stdout]
-                o.xmp_output = [None]
-                check_tty()
-            else:
+        if o.output_template is not None and o.output is None:
+            o.pages = expand_output_template(o.pages, o.output_template, o.xmp)
+            return
+        if o.manifest is not None:
+            error('--manifest requires --output-template')
+        if len(o.input) > 1:
+            if o.output is None:
                 error('cannot output multiple files to stdout')
-        else:
-            if len(o.input) == 1:
-                o.xmp_output = [o.output + '.xmp'] if o.xmp else [None]
-                o.output = [o.output]
             else:
                 error('cannot output multiple files to a single file')
-        assert len(o.masks) == len(o.output) == len(o.input)
-        o.output = (
-            open(f, 'wb') if isinstance(f, basestring) else f
-            for f in o.output
-        )
-        o.xmp_output = (
-            open(f, 'wb') if isinstance(f, basestring) else f
-            for f in o.xmp_output
-        )
+        [page] = o.pages
+        if o.output is None:
+            page.output = make_sink(sys.stdout)
+            page.xmp_output = None
+            check_tty()
+        else:
+            page.output = make_sink(o.output)
+            page.xmp_output = make_sink(o.output + '.xmp' if o.xmp else None)
 
     def check_single_output(self, o):
         self.check_common(o)
@@ -263,59 +341,189 @@ class main(object):
             check_tty()
         else:
             filename = o.output
-            o.output = [open(filename, 'wb')]
-            o.xmp_output = [open(filename + '.xmp', 'wb')] if o.xmp else [None]
+            o.output = [filename]
+            o.xmp_output = [filename + '.xmp'] if o.xmp else [None]
+        o.output = [make_sink(f) for f in o.output]
+        o.xmp_output = [make_sink(f) for f in o.xmp_output]
         assert len(o.output) == len(o.xmp_output) == 1
 
+    @contextlib.contextmanager
+    def open_stats(self, o):
+        '''
+        Return a context manager that yields a function
+        that writes statistics of a page, if requested;
+        or does nothing otherwise.
+        The statistics are appended to the file as soon as each page is done,
+        so that they can be monitored while the pages are being processed.
+        '''
+        if o.stats_json is None:
+            yield lambda page_stats: None
+            return
+        with open(o.stats_json, 'ab') as file:
+            yield stats.JsonWriter(file).write
+
     def encode(self, o):
         self.check_multi_output(o)
-        parallel_for(o, self.encode_one, o.input, o.masks, o.output, o.xmp_output)
+        if o.jobs is None:
+            # With a manifest, pages are read (and encoded) lazily:
+            page_stats = (
+                self.encode_one(page.get_options(o), page.image, page.mask, page.output, page.xmp_output)
+                for page in o.pages
+            )
+        else:
+            page_stats = self.encode_pipelined(o)
+        with self.open_stats(o) as write_page_stats:
+            for one_page_stats in page_stats:
+                write_page_stats(one_page_stats)
+
+    def encode_pipelined(self, o):
+        '''
+        Encode the pages in a pipeline of stages (decoding, binarization,
+        encoding), each with its own workers, so that they can overlap.
+        The pages are written in order, as soon as they are ready.
+        Generate page statistics.
+        '''
+        [n_decode, n_binarize, n_encode] = o.jobs
+        # Gamera doesn't release the GIL, so binarization is done
+        # in separate processes. The pool is created before any threads
+        # are started.
+        pool = multiprocessing.Pool(n_binarize)
+        try:
+            def decode_page(page):
+                return self._encode_read(page.get_options(o), page.image, page.mask, page.output, page.xmp_output)
+            def binarize_page(job):
+                self._encode_binarize(job, pool=pool)
+                return job
+            def encode_page(job):
+                self._encode_layers(job)
+                return job
+            stages = [
+                pipeline.Stage('decode', decode_page, n_decode),
+                pipeline.Stage('binarize', binarize_page, n_binarize),
+                pipeline.Stage('encode', encode_page, n_encode),
+            ]
+            jobs = pipeline.run(o.pages, stages, label=lambda page: page.image)
+            try:
+                for job in jobs:
+                    with pipeline.labelled(job.image_filename):
+                        yield self._encode_write(job)
+            finally:
+                # Stop the pipeline threads while the pool is still alive;
+                # binarization might be waiting for it.
+                jobs.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        for stage in stages:
+            logger.nosy('pipeline: ' + stage.format_metrics())
 
     def encode_one(self, o, image_filename, mask_filename, output, xmp_output):
-        bytes_in = os.path.getsize(image_filename)
-        logger.info(image_filename + ':')
+        job = self._encode_read(o, image_filename, mask_filename, output, xmp_output)
+        self._encode_binarize(job)
+        self._encode_layers(job)
+        return self._encode_write(job)
+
+    def _encode_read(self, o, image_filename, mask_filename, output, xmp_output):
+        '''
+        Read the image (the first stage of encode_one()).
+        Return the job object that is passed to the next stages.
+        '''
+        job = utils.namespace()
+        job.options = o
+        job.image_filename = image_filename
+        job.mask_filename = mask_filename
+        job.output = output
+        job.xmp_output = xmp_output
+        job.image = job.mask = job.djvu_file = None
+        job.stats = page_stats = stats.PageStats(image_filename, os.path.getsize(image_filename))
+        if pipeline.get_label() is None:
+            logger.info(image_filename + ':')
         ftype = filetype.check(image_filename)
         if ftype.like(filetype.djvu):
             if ftype.like(filetype.djvu_single):
                 logger.info('- copying DjVu as is')
-                with open(image_filename, 'rb') as djvu_file:
-                    fs.copy_file(djvu_file, output)
+                page_info = djvu.get_page_info(image_filename)
+                page_stats.width = page_info.width
+                page_stats.height = page_info.height
+                page_stats.chunks.update(page_info.chunks)
             else:
                 # TODO: Figure out how many pages the multi-page document
                 # consist of. If it's only one, continue.
                 error('multi-page DjVu documents are not supported as input files')
-            return
+            return job
         logger.info('- reading image')
-        image = gamera.load_image(image_filename)
+        with page_stats.timing('read'):
+            job.image = image = gamera.load_image(image_filename)
         width, height = image.ncols, image.nrows
+        page_stats.width = width
+        page_stats.height = height
         logger.nosy('- image size: {w} x {h}'.format(w=width, h=height))
-        mask = generate_mask(mask_filename, image, o.method, o.params)
-        if xmp_output:
-            n_connected_components = len(mask.cc_analysis())
+        return job
+
+    def _encode_binarize(self, job, pool=None):
+        if job.image is None:
+            return
+        o = job.options
+        page_stats = job.stats
+        if job.mask_filename is None:
+            page_stats.method = o.method.name
+            page_stats.params = o.params
+        with page_stats.timing('binarize'):
+            job.mask = generate_mask(job.mask_filename, job.image, o.method, o.params, o.mask_cache, job.image_filename, pool=pool)
+        if job.xmp_output:
+            job.n_connected_components = job.mask.count_connected_components()
+
+    def _encode_layers(self, job):
+        if job.image is None:
+            return
+        image = job.image
+        page_stats = job.stats
         logger.info('- converting to DjVu')
-        djvu_doc = image_to_djvu(width, height, image, mask, options=o)
-        djvu_file = djvu_doc.save()
+        with page_stats.timing('encode'):
+            djvu_doc = image_to_djvu(image.ncols, image.nrows, image, job.mask, options=job.options)
+            job.djvu_file = djvu_doc.save()
+        page_stats.chunks.update(djvu.get_page_info(job.djvu_file.name).chunks)
+        # Pages may wait for the writer for a while;
+        # don't keep their images in memory:
+        job.image = job.mask = None
+
+    def _encode_write(self, job):
+        page_stats = job.stats
+        if job.djvu_file is None:
+            # DjVu input, which is copied as is:
+            with page_stats.timing('write'):
+                with open(job.image_filename, 'rb') as djvu_file:
+                    with job.output.open() as file:
+                        page_stats.bytes_out = fs.copy_file(djvu_file, file)
+            return page_stats
+        djvu_file = job.djvu_file
         try:
-            bytes_out = fs.copy_file(djvu_file, output)
+            with page_stats.timing('write'):
+                page_stats.bytes_out = job.output.write_file(djvu_file)
         finally:
             djvu_file.close()
-        bits_per_pixel = 8.0 * bytes_out / (width * height)
-        compression_info = format_compression_info(bytes_in, bytes_out, bits_per_pixel)
+        compression_info = stats.format_compression_info(page_stats)
         logger.info('- ' + compression_info)
-        if xmp_output:
+        if job.xmp_output:
             logger.info('- saving XMP metadata')
             metadata = xmp.metadata()
-            metadata.import_(image_filename)
-            internal_properties = list(cli.dump_options(o)) + [
-                ('n-connected-components', str(n_connected_components))
+            metadata.import_(job.image_filename)
+            internal_properties = list(cli.dump_options(job.options)) + [
+                ('n-connected-components', str(job.n_connected_components))
             ]
             metadata.update(
                 media_type='image/vnd.djvu',
                 internal_properties=internal_properties,
             )
-            metadata.write(xmp_output)
+            with job.xmp_output.open() as file:
+                metadata.write(file)
+        return page_stats
 
-    def separate_one(self, o, image_filename, output):
+    def _separate_page(self, o, image_filename):
         logger.info(image_filename + ':')
         ftype = filetype.check(image_filename)
         if ftype.like(filetype.djvu):
@@ -327,32 +535,109 @@ class main(object):
         width, height = image.ncols, image.nrows
         logger.nosy('- image size: {w} x {h}'.format(w=width, h=height))
         logger.info('- thresholding')
-        mask = generate_mask(None, image, o.method, o.params)
+        return generate_mask(None, image, o.method, o.params, o.mask_cache, image_filename)
+
+    def separate_one(self, o, image_filename, output):
+        mask = self._separate_page(o, image_filename)
+        format = o.format
+        if format is None:
+            format = rle.guess_format(output.name)
+        logger.info('- saving')
+        with output.open() as file:
+            mask.write(file, format)
+
+    def preview_one(self, o, image_filename, output, variants, pool):
+        logger.info(image_filename + ':')
+        ftype = filetype.check(image_filename)
+        if ftype.like(filetype.djvu):
+            error('DjVu documents are not supported as input files')
+        logger.info('- reading image')
+        image = gamera.load_image(image_filename, scale=o.preview)
+        width, height = image.ncols, image.nrows
+        logger.nosy('- preview size: {w} x {h}'.format(w=width, h=height))
+        logger.info('- thresholding')
+        # Gamera doesn't release the GIL, so the variants are binarized
+        # in separate processes. The image is decoded only once,
+        # and then passed to all of them through shared memory.
+        shared_image = gamera.to_shared(image)
+        try:
+            results = [
+                pool.apply_async(_binarize_shared,
+                    (None, shared_image, variant.method.name, variant.params)
+                )
+                for variant in variants
+            ]
+            try:
+                shared_masks = [result.get() for result in results]
+            except BaseException:
+                for result in results:
+                    result.wait()
+                    if result.successful():
+                        result.get().release()
+                raise
+        finally:
+            shared_image.release()
+        masks = [rle.Bitmap.from_shared(shared_mask) for shared_mask in shared_masks]
         logger.info('- saving')
-        if output is not sys.stdout:
-            # A real file
-            mask.save_PNG(output.name)
+        sheet = preview.contact_sheet(masks, [variant.label for variant in variants])
+        with output.open() as file:
+            sheet.save(file, 'PNG')
+
+    def separate_preview(self, o):
+        self.check_multi_output(o)
+        variants = o.preview_variants
+        if variants is None:
+            variants = preview.get_default_variants(gamera.methods)
+        pool = multiprocessing.Pool(min(len(variants), multiprocessing.cpu_count()))
+        try:
+            for page in o.pages:
+                self.preview_one(o, page.image, page.output, variants, pool)
+        except BaseException:
+            pool.terminate()
+            raise
         else:
-            tmp_output = temporary.file(suffix='.png')
-            try:
-                mask.save_PNG(tmp_output.name)
-                fs.copy_file(tmp_output, output)
-            finally:
-                tmp_output.close()
+            pool.close()
+        finally:
+            pool.join()
+
+    def separate_multipage(self, o):
+        self.check_single_output(o)
+        [output] = o.output
+        format = o.format
+        if format is None:
+            format = rle.guess_format(output.name, default=None)
+        if format not in rle.MULTIPAGE_FORMATS:
+            error('cannot output multiple masks to a single file, unless its format is {formats}',
+                formats=str.join(' or ', rle.MULTIPAGE_FORMATS)
+            )
+        with output.open() as file, rle.MultipageWriter(file, format) as writer:
+            for page in o.pages:
+                mask = self._separate_page(o, page.image)
+                logger.info('- saving')
+                writer.add(mask)
 
     def separate(self, o):
-        self.check_multi_output(o)
         for mask in o.masks:
             assert mask is None
-        parallel_for(o, self.separate_one, o.input, o.output)
+        if o.preview is not None:
+            self.separate_preview(o)
+            return
+        if len(o.input) > 1 and o.output_template is None:
+            self.separate_multipage(o)
+            return
+        self.check_multi_output(o)
+        for page in o.pages:
+            self.separate_one(o, page.image, page.output)
 
     def bundle(self, o):
         self.check_single_output(o)
-        if (o.pages_per_dict <= 1) or (len(o.input) <= 1):
-            self.bundle_simple(o)
-        else:
-            ipc.require('minidjvu')
-            self.bundle_complex(o)
+        o.pages = list(o.pages)
+        with self.open_stats(o) as write_page_stats:
+            if (o.pages_per_dict == 1) or (len(o.pages) <= 1):
+                self.bundle_simple(o, write_page_stats)
+            else:
+                ipc.require('minidjvu')
+                self.bundle_complex(o, write_page_stats)
         [xmp_output] = o.xmp_output
         if xmp_output:
             logger.info('saving XMP metadata')
@@ -362,122 +647,288 @@ class main(object):
                 media_type='image/vnd.djvu',
                 internal_properties=internal_properties,
             )
-            metadata.write(xmp_output)
+            with xmp_output.open() as file:
+                metadata.write(file)
 
-    def _bundle_simple_page(self, o, input, mask, component_name):
-        with open(component_name, 'wb') as component:
-            self.encode_one(o, input, mask, component, None)
+    def _tune_page(self, o, pool, candidates, image_filename, mask_filename):
+        logger.info(image_filename + ':')
+        ftype = filetype.check(image_filename)
+        if ftype.like(filetype.djvu):
+            error('DjVu documents are not supported as input files')
+        logger.info('- reading image')
+        image = gamera.load_image(image_filename)
+        width, height = image.ncols, image.nrows
+        dpi = image_dpi(image, o)
+        logger.nosy('- image size: {w} x {h}'.format(w=width, h=height))
+        mask = generate_mask(mask_filename, image, o.method, o.params, o.mask_cache, image_filename)
+        # Everything but the layer being tuned is encoded only once:
+        chunks = dict(sjbz=djvu.bitonal_to_djvu(mask, loss_level=o.loss_level))
+        data = gamera.to_rgb_buffer(image)
+        if o.layer == 'bg':
+            subsample = subsample_bg
+            if o.fg_options.slices != [0]:
+                chunks.update(encode_fg(image, mask, o.fg_options, data))
+        else:
+            subsample = subsample_fg
+            if o.bg_options.slices != [0]:
+                chunks.update(encode_bg(image, mask, o.bg_options, data))
+        # Wait for the encoders now; otherwise the worker threads
+        # would all wait for them (see utils.Proxy) at the same time:
+        for chunk in chunks.itervalues():
+            utils.wait(chunk)
+        # Likewise, the layer is subsampled only once for each ratio:
+        subsampled = {}
+        for candidate in candidates:
+            ratio = candidate.subsample
+            if ratio not in subsampled:
+                layer_options = utils.namespace()
+                layer_options.subsample = ratio
+                subsampled[ratio] = subsample(image, mask, layer_options, data)
+        reference = gamera.to_pil_rgb(image, data)
+        image = None
+        def try_candidate(candidate):
+            [layer_image, layer_mask] = subsampled[candidate.subsample]
+            layer_djvu = make_layer(layer_image, layer_mask, candidate)
+            page_chunks = dict(chunks)
+            page_chunks[o.layer + '44'] = djvu.djvu_to_iw44(layer_djvu)
+            djvu_file = djvu.Multichunk(width, height, dpi, **page_chunks).save()
+            try:
+                bytes_out = os.path.getsize(djvu_file.name)
+                image = tuning.render(djvu_file)
+            finally:
+                djvu_file.close()
+            return (bytes_out,) + tuning.get_squared_error(reference, image)
+        logger.info('- trying {n} combinations of settings'.format(n=len(candidates)))
+        results = pool.map(try_candidate, candidates)
+        for candidate, result in zip(candidates, results):
+            candidate.add_result(*result)
 
-    def bundle_simple(self, o):
+    def tune(self, o):
+        self.check_common(o)
+        ipc.require('ddjvu')
+        candidates = tuning.get_candidates(o.layer,
+            slices=o.slices,
+            crcb=o.crcb,
+            subsample=o.subsample,
+        )
+        if o.layer == 'fg':
+            for candidate in candidates:
+                if len(candidate.slices) > 1:
+                    error('foreground layer cannot have more than one slice')
+        output = make_sink(sys.stdout if o.output is None else o.output)
+        # The trials spend most of their time in external programs,
+        # so threads are good enough:
+        pool = multiprocessing.pool.ThreadPool(multiprocessing.cpu_count())
+        try:
+            for page in o.pages:
+                self._tune_page(o, pool, candidates, page.image, page.mask)
+        finally:
+            pool.close()
+            pool.join()
+        with output.open() as file:
+            for candidate in tuning.pareto_front(candidates):
+                print(tuning.format_candidate(candidate, o.layer), file=file)
+
+    def _bundle_simple_page(self, o, page, component_name):
+        component = fs.FileSink(component_name)
+        return self.encode_one(page.get_options(o), page.image, page.mask, component, None)
+
+    def _bundle_simple_write(self, o, file, component_ids, component_filenames, write_page_stats):
+        '''
+        Encode the pages, and append them to the bundled document
+        one by one, as soon as each of them is ready.
+        '''
+        writer = djvu.BundleWriter(file, component_ids)
+        page_stats = []
+        for page, component_filename in zip(o.pages, component_filenames):
+            page_stats += [self._bundle_simple_page(o, page, component_filename)]
+            write_page_stats(page_stats[-1])
+            with open(component_filename, 'rb') as component_file:
+                writer.add(component_file)
+            os.unlink(component_filename)
+        logger.info('bundling')
+        bytes_out = writer.close()
+        return page_stats, bytes_out
+
+    def bundle_simple(self, o, write_page_stats):
         [output] = o.output
         with temporary.directory() as tmpdir:
-            bytes_in = 0
+            component_ids = []
             component_filenames = []
             page_id_memo = {}
-            for page, (input, mask) in enumerate(zip(o.input, o.masks)):
-                bytes_in += os.path.getsize(input)
-                page_id = templates.expand(o.page_id_template, input, page, page_id_memo)
-                try:
-                    djvu.validate_page_id(page_id)
-                except ValueError as exc:
-                    error(exc)
+            for pageno, page in enumerate(o.pages):
+                page_id = get_page_id(o, page, pageno, page_id_memo)
+                component_ids += [page_id]
                 component_filenames += [os.path.join(tmpdir, page_id)]
-            parallel_for(o, self._bundle_simple_page, o.input, o.masks, component_filenames)
-            logger.info('bundling')
-            djvu_file = djvu.bundle_djvu(*component_filenames)
-            try:
-                bytes_out = fs.copy_file(djvu_file, output)
-            finally:
-                djvu_file.close()
-        bits_per_pixel = float('nan')  # FIXME!
-        compression_info = format_compression_info(bytes_in, bytes_out, bits_per_pixel)
+            if output.seekable:
+                # The pages are written straight into the output file,
+                # so that they show up there as soon as they are ready:
+                with output.open(atomic=False) as file:
+                    [page_stats, bytes_out] = self._bundle_simple_write(o, file, component_ids, component_filenames, write_page_stats)
+            else:
+                # The directory is written last,
+                # so the document has to be put together elsewhere:
+                with temporary.file(suffix='.djvu') as djvu_file:
+                    [page_stats, bytes_out] = self._bundle_simple_write(o, djvu_file, component_ids, component_filenames, write_page_stats)
+                    djvu_file.seek(0)
+                    with output.open() as file:
+                        fs.copy_file(djvu_file, file)
+        document_stats = stats.DocumentStats(page_stats, bytes_out=bytes_out)
+        compression_info = stats.format_compression_info(document_stats)
         logger.nosy(compression_info)
+        return document_stats
 
-    def _bundle_complex_page(self, o, page, minidjvu_in_dir, image_filename, mask_filename, pixels):
+    def _bundle_complex_page(self, o, page):
+        o = page.options
+        image_filename = page.image_filename
+        page.stats = page_stats = stats.PageStats(image_filename, os.path.getsize(image_filename))
         logger.info(image_filename + ':')
         ftype = filetype.check(image_filename)
         if ftype.like(filetype.djvu):
             # TODO: Allow merging existing documents (even multi-page ones).
             error('DjVu documents are not supported as input files')
         logger.info('- reading image')
-        image = gamera.load_image(image_filename)
-        dpi = image_dpi(image, o)
+        with page_stats.timing('read'):
+            image = gamera.load_image(image_filename)
         width, height = image.ncols, image.nrows
-        pixels[0] += width * height
+        page_stats.width = width
+        page_stats.height = height
         logger.nosy('- image size: {w} x {h}'.format(w=width, h=height))
-        mask = generate_mask(mask_filename, image, o.method, o.params)
+        if page.mask_filename is None:
+            page_stats.method = o.method.name
+            page_stats.params = o.params
+        with page_stats.timing('binarize'):
+            mask = generate_mask(page.mask_filename, image, o.method, o.params, o.mask_cache, image_filename)
         logger.info('- converting to DjVu')
-        page.djvu = image_to_djvu(width, height, image, mask, options=o)
+        # The mask will be encoded later, by minidjvu:
+        with page_stats.timing('encode'):
+            page.djvu = image_to_djvu(width, height, image, mask, options=o, encode_mask=False)
+        page.mask = mask
         image = mask = None
-        page.sjbz = djvu.Multichunk(width, height, dpi, sjbz=page.djvu['sjbz'])
-        page.sjbz_symlink = os.path.join(minidjvu_in_dir, page.page_id)
-        os.symlink(page.sjbz.save().name, page.sjbz_symlink)
-
-    def bundle_complex(self, o):
+        return page_stats
+
+    def _start_minidjvu(self, o, pages, minidjvu_in_dir, minidjvu_out_dir):
+        '''
+        Start creating a shared dictionary for the pages;
+        return the minidjvu subprocess.
+        '''
+        logger.info('creating shared dictionary for {n} pages'.format(n=len(pages)))
+        def chdir():
+            os.chdir(minidjvu_out_dir)
+        arguments = ['minidjvu',
+            '--indirect',
+            '--pages-per-dict', str(len(pages)),
+        ]
+        if o.loss_level > 0:
+            arguments += ['--aggression', str(o.loss_level)]
+        assert len(pages) > 1  # minidjvu won't create single-page indirect documents
+        for page in pages:
+            pbm_filename = os.path.join(minidjvu_in_dir, fs.replace_ext(page.page_id, 'pbm'))
+            page.mask.save(pbm_filename)
+            page.mask = None
+            arguments += [pbm_filename]
+        index_filename = temporary.name(prefix='__index__.', suffix='.djvu', dir=minidjvu_out_dir)
+        index_filename = os.path.basename(index_filename)  # FIXME: Name conflicts are still possible!
+        arguments += [index_filename]
+        minidjvu = ipc.Subprocess(arguments, preexec_fn=chdir)
+        minidjvu.index_filename = os.path.join(minidjvu_out_dir, index_filename)
+        return minidjvu
+
+    def _finish_minidjvu(self, o, pages, minidjvu, minidjvu_out_dir):
+        '''
+        Wait for minidjvu to finish;
+        then combine its output with the foreground/background layers.
+        Return the component filenames.
+        '''
+        if minidjvu is not None:
+            minidjvu.wait()
+            os.remove(minidjvu.index_filename)
+            iff_name = fs.replace_ext(pages[0].page_id, 'iff')
+            iff_name = os.path.join(minidjvu_out_dir, iff_name)
+            component_filenames = [iff_name]
+        else:
+            # A single page doesn't need a shared dictionary.
+            [page] = pages
+            page.djvu['sjbz'] = djvu.bitonal_to_djvu(page.mask, loss_level=o.loss_level)
+            page.mask = None
+            component_filenames = []
+        for page in pages:
+            page.djvu_symlink = os.path.join(minidjvu_out_dir, page.page_id)
+            if minidjvu is not None:
+                page.djvu['sjbz'] = page.djvu_symlink
+                page.djvu['incl'] = iff_name
+                page.djvu = page.djvu.save()
+                os.unlink(page.djvu_symlink)
+            else:
+                page.djvu = page.djvu.save()
+            os.symlink(page.djvu.name, page.djvu_symlink)
+            component_filenames += [page.djvu_symlink]
+            page_info = djvu.get_page_info(page.djvu.name)
+            page.stats.chunks.update(page_info.chunks)
+            page.stats.bytes_out = os.path.getsize(page.djvu.name)
+        return component_filenames
+
+    def bundle_complex(self, o, write_page_stats):
         [output] = o.output
         with temporary.directory() as minidjvu_in_dir:
-            bytes_in = 0
-            pixels = [0]
             page_info = []
             page_id_memo = {}
-            for pageno, (image_filename, mask_filename) in enumerate(zip(o.input, o.masks)):
+            for pageno, input_page in enumerate(o.pages):
                 page = utils.namespace()
                 page_info += [page]
-                bytes_in += os.path.getsize(image_filename)
-                page.page_id = templates.expand(o.page_id_template, image_filename, pageno, page_id_memo)
-                try:
-                    djvu.validate_page_id(page.page_id)
-                except ValueError as exc:
-                    error(exc)
+                page.image_filename = input_page.image
+                page.mask_filename = input_page.mask
+                page.options = input_page.get_options(o)
+                page.page_id = get_page_id(o, input_page, pageno, page_id_memo)
             del page  # quieten pyflakes
-            parallel_for(o, self._bundle_complex_page,
-                page_info,
-                itertools.repeat(minidjvu_in_dir),
-                o.input,
-                o.masks,
-                itertools.repeat(pixels)
-            )
-            [pixels] = pixels
-            with temporary.directory() as minidjvu_out_dir:
-                logger.info('creating shared dictionaries')
-                def chdir():
-                    os.chdir(minidjvu_out_dir)
-                arguments = ['minidjvu',
-                    '--indirect',
-                    '--pages-per-dict', str(o.pages_per_dict),
-                ]
-                if o.loss_level > 0:
-                    arguments += ['--aggression', str(o.loss_level)]
-                assert len(page_info) > 1  # minidjvu won't create single-page indirect documents
-                arguments += [page.sjbz_symlink for page in page_info]
-                index_filename = temporary.name(prefix='__index__.', suffix='.djvu', dir=minidjvu_out_dir)
-                index_filename = os.path.basename(index_filename)  # FIXME: Name conflicts are still possible!
-                arguments += [index_filename]
-                ipc.Subprocess(arguments, preexec_fn=chdir).wait()
-                os.remove(os.path.join(minidjvu_out_dir, index_filename))
+            with temporary.directory() as minidjvu_out_root:
+                # Each dictionary window is processed by a separate minidjvu,
+                # which runs in the background while the next pages are being
+                # converted.
+                max_running = multiprocessing.cpu_count()
+                jobs = []
+                running = collections.deque()
+                splitter = dictionaries.Splitter(o.pages_per_dict)
+                def flush(window):
+                    minidjvu_out_dir = os.path.join(minidjvu_out_root, str(len(jobs)))
+                    os.mkdir(minidjvu_out_dir)
+                    if len(window) > 1:
+                        while len(running) >= max_running:
+                            running.popleft().wait()
+                        minidjvu = self._start_minidjvu(o, window, minidjvu_in_dir, minidjvu_out_dir)
+                        running.append(minidjvu)
+                    else:
+                        minidjvu = None
+                    jobs.append((window, minidjvu, minidjvu_out_dir))
+                window = []
+                def add_page(o, page):
+                    page_stats = self._bundle_complex_page(o, page)
+                    if splitter.auto:
+                        split = splitter.split_before(*dictionaries.get_symbol_shapes(page.mask))
+                    else:
+                        split = splitter.split_before()
+                    if split:
+                        flush(window[:])
+                        del window[:]
+                    window.append(page)
+                    return page_stats
+                page_stats = parallel_for(o, add_page, page_info)
+                flush(window)
                 component_filenames = []
-                for pageno, page in enumerate(page_info):
-                    if pageno % o.pages_per_dict == 0:
-                        iff_name = fs.replace_ext(page_info[pageno].page_id, 'iff')
-                        iff_name = os.path.join(minidjvu_out_dir, iff_name)
-                        component_filenames += [iff_name]
-                    sjbz_name = os.path.join(minidjvu_out_dir, page.page_id)
-                    component_filenames += [sjbz_name]
-                    page.djvu['sjbz'] = sjbz_name
-                    page.djvu['incl'] = iff_name
-                    page.djvu = page.djvu.save()
-                    page.djvu_symlink = os.path.join(minidjvu_out_dir, page.page_id)
-                    os.unlink(page.djvu_symlink)
-                    os.symlink(page.djvu.name, page.djvu_symlink)
+                for pages, minidjvu, minidjvu_out_dir in jobs:
+                    component_filenames += self._finish_minidjvu(o, pages, minidjvu, minidjvu_out_dir)
+                    for page in pages:
+                        write_page_stats(page.stats)
                 logger.info('bundling')
                 djvu_file = djvu.bundle_djvu(*component_filenames)
                 try:
-                    bytes_out = fs.copy_file(djvu_file, output)
+                    bytes_out = output.write_file(djvu_file)
                 finally:
                     djvu_file.close()
-        bits_per_pixel = 8.0 * bytes_out / pixels
-        compression_info = format_compression_info(bytes_in, bytes_out, bits_per_pixel)
+        document_stats = stats.DocumentStats(page_stats, bytes_out=bytes_out)
+        compression_info = stats.format_compression_info(document_stats)
         logger.nosy(compression_info)
+        return document_stats
 
 __all__ = ['main']
 
@@ -15,10 +15,12 @@
 
 '''wrappers for the DjVuLibre utilities'''
 
+import collections
 import os
 import re
 import struct
 
+from . import fs
 from . import ipc
 from . import temporary
 from . import utils
@@ -266,6 +268,34 @@ class Multichunk(object):
             self._pristine = True
             return self._file
 
+def get_page_info(path):
+    '''
+    Return dimensions and chunk sizes of a single-page DjVu document.
+    Only the chunk headers (and the INFO chunk) are read.
+    '''
+    info = utils.namespace()
+    info.width = info.height = None
+    info.chunks = collections.OrderedDict()
+    with open(path, 'rb') as file:
+        header = file.read(16)
+        if header[:8] != 'AT&TFORM' or header[12:] != 'DJVU':
+            raise ValueError('not a single-page DjVu document')
+        [form_size] = struct.unpack('>I', header[8:12])
+        end = 12 + form_size
+        offset = 16
+        while offset + 8 <= end:
+            file.seek(offset)
+            chunk_header = file.read(8)
+            if len(chunk_header) < 8:
+                break
+            chunk_id = chunk_header[:4]
+            [chunk_size] = struct.unpack('>I', chunk_header[4:])
+            if chunk_id == 'INFO':
+                info.width, info.height = struct.unpack('>HH', file.read(4))
+            info.chunks[chunk_id] = info.chunks.get(chunk_id, 0) + chunk_size
+            offset += 8 + chunk_size + (chunk_size & 1)
+    return info
+
 _djvu_header = 'AT&TFORM\0\0\0\0DJVMDIRM\0\0\0\0\1'
 
 def bundle_djvu_via_indirect(*component_filenames):
@@ -322,6 +352,131 @@ def bundle_djvu(*component_filenames):
         args += component_filenames
         return utils.Proxy(djvu_file, ipc.Subprocess(args).wait, None)
 
+_djvm_header = 'AT&TFORM\0\0\0\0DJVMDIRM'
+
+def _bzz_encode(data):
+    bzz = ipc.Subprocess(['bzz', '-e', '-', '-'], stdin=ipc.PIPE, stdout=ipc.PIPE)
+    [stdout, stderr] = bzz.communicate(data)
+    return stdout
+
+class BundleWriter(object):
+
+    '''
+    Write a bundled multi-page document, one component after another,
+    as soon as they are available.
+
+    The directory (the DIRM chunk) at the beginning of the document
+    must contain offsets and sizes of the components,
+    which are not known until they are written.
+    So space for the directory is reserved first,
+    and the directory is filled in by close().
+    The file must be seekable.
+    '''
+
+    def __init__(self, file, component_ids):
+        component_ids = list(component_ids)
+        if not component_ids:
+            raise ValueError('no components')
+        if len(component_ids) > 0xFFFF:
+            raise ValueError('too many components')
+        self.file = file
+        self.component_ids = component_ids
+        self._offsets = []
+        self._sizes = []
+        self._start = file.tell()
+        self._dirm_size = self._get_dirm_size(self._reserve())
+        file.write(_djvm_header)
+        file.write(struct.pack('>I', self._dirm_size))
+        file.write('\0' * self._dirm_size)
+
+    def _encode_directory(self, sizes):
+        data = []
+        for size in sizes:
+            if size >= 1 << 24:
+                # Would overflow; but 0 is fine, too.
+                size = 0
+            data += [struct.pack('>I', size)[1:]]
+        for component_id in self.component_ids:
+            data += [struct.pack('B', not component_id.endswith('.iff'))]
+        for component_id in self.component_ids:
+            data += [component_id, '\0']
+        return _bzz_encode(str.join('', data))
+
+    def _reserve(self):
+        # Only the component sizes (3 bytes each) are not known yet.
+        # Compress the directory without them,
+        # and leave room for them as if they were incompressible,
+        # plus a few bytes for the BZZ block overhead:
+        n = len(self.component_ids)
+        return len(self._encode_directory([0] * n)) + 3 * n + 16
+
+    def _get_dirm_size(self, compressed_size):
+        size = 3 + 4 * len(self.component_ids) + compressed_size
+        # Chunks start at even offsets:
+        return size + (size & 1)
+
+    def _tell(self):
+        return self.file.tell() - self._start
+
+    def add(self, file):
+        '''
+        Append the next component, read from the file object.
+        '''
+        if len(self._offsets) >= len(self.component_ids):
+            raise ValueError('too many components')
+        if file.read(4) != 'AT&T':
+            raise ValueError('not a DjVu file')
+        if self._tell() & 1:
+            self.file.write('\0')
+        self._offsets += [self._tell()]
+        self._sizes += [fs.copy_file(file, self.file)]
+
+    def _move_components(self, delta):
+        '''
+        Move the components delta bytes forward,
+        to make more room for the directory.
+        '''
+        start = self._start + self._offsets[0]
+        end = self._start + self._tell()
+        position = end
+        while position > start:
+            block_size = min(position - start, fs._block_size)
+            position -= block_size
+            self.file.seek(position)
+            block = self.file.read(block_size)
+            self.file.seek(position + delta)
+            self.file.write(block)
+        self._offsets = [offset + delta for offset in self._offsets]
+        self.file.seek(end + delta)
+
+    def close(self):
+        '''
+        Fill in the directory.
+        Return the size of the document.
+        '''
+        if len(self._offsets) != len(self.component_ids):
+            raise ValueError('missing components')
+        compressed = self._encode_directory(self._sizes)
+        dirm_size = self._get_dirm_size(len(compressed))
+        if dirm_size > self._dirm_size:
+            self._move_components(dirm_size - self._dirm_size)
+            self._dirm_size = dirm_size
+        size = self._tell()
+        self.file.seek(self._start + 8)
+        self.file.write(struct.pack('>I', size - 12))
+        self.file.seek(self._start + len(_djvm_header))
+        self.file.write(struct.pack('>I', self._dirm_size))
+        self.file.write(struct.pack('>BH', 0x81, len(self.component_ids)))
+        for offset in self._offsets:
+            self.file.write(struct.pack('>I', offset))
+        self.file.write(compressed)
+        # The decoder may read a few bytes past the end of BZZ data.
+        # At the end of the chunk, it would read 0xFF bytes;
+        # so pad with these.
+        self.file.write('\xFF' * (self._dirm_size - 3 - 4 * len(self._offsets) - len(compressed)))
+        self.file.seek(self._start + size)
+        return size
+
 def require_cli():
     ipc.require(
         'cjb2',
@@ -351,6 +506,8 @@ def validate_page_id(page_id):
 __all__ = [
     'bitonal_to_djvu', 'photo_to_djvu', 'djvu_to_iw44',
     'bundle_djvu',
+    'BundleWriter',
+    'get_page_info',
     'require_cli',
     'validate_page_id',
     'Multichunk',
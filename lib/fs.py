@@ -15,11 +15,82 @@
 
 '''filesystem functions'''
 
+import contextlib
+import ctypes
+import errno
 import os
+import stat
+import sys
+
+from . import temporary
 
 _block_size = 1 << 20  # 1 MiB
 
+def _get_sendfile():
+    # The signature of sendfile() is different on other systems.
+    if not sys.platform.startswith('linux'):
+        return  # no coverage
+    libc = ctypes.CDLL(None, use_errno=True)
+    try:
+        sendfile = libc.sendfile64
+    except AttributeError:  # no coverage
+        return
+    sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    sendfile.restype = ctypes.c_ssize_t
+    return sendfile
+
+_sendfile = _get_sendfile()
+
+def _send_file(input_file, output_file):
+    '''
+    Copy the rest of the input file to the output file with sendfile(2),
+    without passing the data through user space.
+    Return the number of bytes copied;
+    or None if sendfile(2) cannot be used for these files.
+    '''
+    if _sendfile is None:
+        return  # no coverage
+    try:
+        input_fd = input_file.fileno()
+        output_fd = output_file.fileno()
+    except (AttributeError, IOError, ValueError):
+        # not a real file (e.g. io.BytesIO)
+        return
+    output_file.flush()
+    try:
+        position = output_file.tell()
+    except IOError:
+        # not seekable (e.g. a pipe)
+        position = None
+    offset = ctypes.c_int64(input_file.tell())
+    length = 0
+    while True:
+        n = _sendfile(output_fd, input_fd, ctypes.byref(offset), 1 << 30)
+        if n < 0:
+            exc = ctypes.get_errno()
+            if exc == errno.EINTR:
+                continue  # no coverage
+            if length == 0 and exc in {errno.EINVAL, errno.ENOSYS}:
+                # E.g. the output file was opened in append mode.
+                return
+            raise OSError(exc, os.strerror(exc))
+        if n == 0:
+            break
+        length += n
+    input_file.seek(offset.value)
+    if position is not None:
+        # The file object doesn't know that the file position has changed:
+        output_file.seek(position + length)
+    return length
+
 def copy_file(input_file, output_file):
+    '''
+    Copy the rest of the input file to the output file.
+    Return the number of bytes copied.
+    '''
+    length = _send_file(input_file, output_file)
+    if length is not None:
+        return length
     length = 0
     while True:
         block = input_file.read(_block_size)
@@ -35,8 +106,144 @@ def replace_ext(filename, ext):
         ext
     )
 
+def get_umask():
+    # There's no way to get the umask without setting it;
+    # so set it temporarily to the most restrictive sensible value.
+    umask = os.umask(0o077)
+    os.umask(umask)
+    return umask
+
+class FileSink(object):
+
+    '''
+    Output file that is created only when it's opened,
+    and moved into place atomically, once writing to it is complete.
+
+    Only regular files are replaced that way;
+    other existing files (such as symlinks, FIFOs or devices)
+    are written to directly.
+    '''
+
+    def __init__(self, path):
+        self.name = path
+
+    def _stat(self, stat_fn):
+        try:
+            return stat_fn(self.name)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return
+
+    def _is_replaceable(self):
+        st = self._stat(os.lstat)
+        return st is None or stat.S_ISREG(st.st_mode)
+
+    @property
+    def seekable(self):
+        st = self._stat(os.stat)
+        return st is None or stat.S_ISREG(st.st_mode)
+
+    @contextlib.contextmanager
+    def open(self, atomic=True):
+        '''
+        Return a context manager that yields a new file object,
+        open for reading and writing if the target is seekable.
+        The data is written to a temporary file in the same directory,
+        which replaces the target file when the context is exited normally,
+        or which is removed otherwise.
+
+        If atomic is false, the target file is written to directly,
+        so that the data can be seen there while it's being written;
+        it's removed if the context is exited with an exception.
+        '''
+        if not self._is_replaceable():
+            with open(self.name, 'w+b' if self.seekable else 'wb') as file:
+                yield file
+            return
+        if not atomic:
+            try:
+                with open(self.name, 'w+b') as file:
+                    yield file
+            except BaseException:
+                os.unlink(self.name)
+                raise
+            return
+        directory = os.path.dirname(self.name) or os.curdir
+        tmp_path = temporary.name(prefix='.didjvu.', suffix='.tmp', dir=directory)
+        # Unlike tempfile.NamedTemporaryFile(), this respects umask:
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, 'w+b') as file:
+                yield file
+            os.rename(tmp_path, self.name)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def write_file(self, file):
+        '''
+        Write the whole contents of the (named, regular) file to the target.
+        If possible, the file is hard-linked into place, rather than copied;
+        it must not be modified afterwards.
+        Return the number of bytes written.
+        '''
+        if not self._is_replaceable():
+            with self.open() as output_file:
+                file.seek(0)
+                return copy_file(file, output_file)
+        directory = os.path.dirname(self.name) or os.curdir
+        tmp_path = temporary.name(prefix='.didjvu.', suffix='.tmp', dir=directory)
+        try:
+            os.link(file.name, tmp_path)
+        except OSError as exc:
+            # E.g. the file is on a different filesystem:
+            if exc.errno not in {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP}:
+                raise
+            with self.open() as output_file:
+                file.seek(0)
+                return copy_file(file, output_file)
+        try:
+            os.chmod(tmp_path, 0o666 & ~get_umask())
+            length = os.path.getsize(tmp_path)
+            os.rename(tmp_path, self.name)
+        except BaseException:  # no coverage
+            os.unlink(tmp_path)
+            raise
+        return length
+
+class StreamSink(object):
+
+    '''
+    Output to an already open file object, such as stdout.
+    '''
+
+    seekable = False
+
+    def __init__(self, file):
+        self.file = file
+        self.name = file.name
+
+    @contextlib.contextmanager
+    def open(self, atomic=True):
+        # The stream is always written to directly.
+        yield self.file
+        self.file.flush()
+
+    def write_file(self, file):
+        '''
+        Write the whole contents of the file to the output.
+        Return the number of bytes written.
+        '''
+        with self.open() as output_file:
+            file.seek(0)
+            return copy_file(file, output_file)
+
 __all__ = [
+    'FileSink',
+    'StreamSink',
     'copy_file',
+    'get_umask',
     'replace_ext',
 ]
 
@@ -18,9 +18,18 @@
 import collections
 import ctypes
 import math
+import multiprocessing
+import os
 import re
 import sys
+import threading
+import time
 
+from . import binarization
+from . import djvu_support as djvu
+from . import layers
+from . import rle
+from . import shm
 from . import utils
 
 try:
@@ -54,8 +63,44 @@ import gamera.args
 def has_version(*req_version):
     return tuple(map(int, version.split('.'))) >= req_version
 
-def load_image(filename):
-    pil_image = PIL.Image.open(filename)
+def from_pil(pil_image):
+    try:
+        # Gamera < 3.4.3 uses tostring(), which was deprecated,
+        # and finally removed in Pillow 3.0.0.
+        # https://pillow.readthedocs.io/en/3.0.x/releasenotes/3.0.0.html#deprecated-methods
+        pil_image.tostring = pil_image.tobytes
+    except AttributeError:  # no coverage
+        pass
+    return _from_pil(pil_image)
+
+def _convert_pil_image(pil_image):
+    # Gamera supports importing only 8-bit and RGB from PIL:
+    if pil_image.mode[:2] in {'1', '1;', 'I', 'I;', 'L;'}:
+        pil_image = pil_image.convert('L')
+    elif pil_image.mode not in {'RGB', 'L'}:
+        pil_image = pil_image.convert('RGB')
+    assert pil_image.mode in {'RGB', 'L'}
+    return pil_image
+
+def _downscale_pil_image(pil_image, scale):
+    [width, height] = pil_image.size
+    size = (
+        max(1, int(round(width * scale))),
+        max(1, int(round(height * scale))),
+    )
+    # For JPEG, this lets the decoder do most of the work,
+    # by decoding at 1/2, 1/4 or 1/8 of the full resolution:
+    pil_image.draft(pil_image.mode, size)
+    pil_image = _convert_pil_image(pil_image)
+    return pil_image.resize(size, PIL.Image.ANTIALIAS)
+
+def load_image(filename, scale=None):
+    '''
+    Load the image from the file.
+    If scale is not None, downscale the image by this factor,
+    without decoding it at full resolution if possible.
+    '''
+    pil_image = orig_pil_image = PIL.Image.open(filename)
     [xdpi, ydpi] = pil_image.info.get('dpi', (0, 0))
     if xdpi <= 1 or ydpi <= 1:
         # not reliable
@@ -65,8 +110,15 @@ def load_image(filename):
             math.hypot(xdpi, ydpi) /
             math.hypot(1, 1)
         ))
+    if scale is not None:
+        pil_image = _downscale_pil_image(pil_image, scale)
+        if dpi is not None:
+            dpi = max(1, int(round(dpi * scale)))
     try:
-        if pil_image.format == 'TIFF':
+        if pil_image is not orig_pil_image:
+            # The image was downscaled in memory.
+            gamera_modes = []
+        elif pil_image.format == 'TIFF':
             # Gamera handles only a few TIFF color modes correctly.
             # https://bugs.debian.org/784374
             gamera_modes = ['1', 'I;16', 'L', 'RGB']
@@ -82,21 +134,10 @@ def load_image(filename):
         # https://mail.python.org/pipermail/image-sig/2003-July/002354.html
         image = _load_image(filename)
     except IOError:
-        # Gamera supports importing only 8-bit and RGB from PIL:
-        if pil_image.mode[:2] in {'1', '1;', 'I', 'I;', 'L;'}:
-            pil_image = pil_image.convert('L')
-        elif pil_image.mode not in {'RGB', 'L'}:
-            pil_image = pil_image.convert('RGB')
-        assert pil_image.mode in {'RGB', 'L'}
-        try:
-            # Gamera < 3.4.3 uses tostring(), which was deprecated,
-            # and finally removed in Pillow 3.0.0.
-            # https://pillow.readthedocs.io/en/3.0.x/releasenotes/3.0.0.html#deprecated-methods
-            pil_image.tostring = pil_image.tobytes
-        except AttributeError:  # no coverage
-            pass
-        image = _from_pil(pil_image)
+        pil_image = _convert_pil_image(pil_image)
+        image = from_pil(pil_image)
     pil_image.close()
+    orig_pil_image.close()
     image.dpi = dpi
     return image
 
@@ -173,6 +214,229 @@ class Plugin(object):
             self._method = self._plugin()
         return self._method(image, **kwargs)
 
+    def binarize(self, image, **kwargs):
+        '''
+        Binarize the image.
+        Return the mask as a run-length encoded bitmap.
+        '''
+        return to_bitmap(self(image, **kwargs))
+
+class NumpyPlugin(Plugin):
+
+    '''
+    Gamera plugin, with an alternative NumPy implementation
+    (from the binarization module).
+    The arguments, and the results, are the same as the Gamera ones.
+
+    The NumPy implementation is used only if it's faster.
+    For each set of arguments, both implementations are timed
+    on a part of the first image that is big enough.
+    '''
+
+    # Size of the part of the image on which the implementations are timed:
+    benchmark_size = 512
+
+    def __init__(self, plugin, name, function):
+        Plugin.__init__(self, plugin, name)
+        self._function = function
+        self._numpy_faster = {}
+
+    def _get_params(self, kwargs):
+        params = {
+            arg.name.replace('-', '_'): arg.default
+            for arg in self.args.itervalues()
+            if arg.has_default
+        }
+        params.update(
+            (key.replace('-', '_'), value)
+            for key, value
+            in kwargs.iteritems()
+        )
+        return params
+
+    def binarize_numpy(self, image, **kwargs):
+        '''
+        Binarize the image using the NumPy implementation.
+        Return a boolean array, in which black pixels are true.
+        '''
+        params = self._get_params(kwargs)
+        if image.data.pixel_type != GREYSCALE:
+            image = image.to_greyscale()
+        return self._function(to_numpy(image), **params)
+
+    def _use_numpy(self, image, kwargs):
+        if image.data.pixel_type not in {GREYSCALE, RGB, ONEBIT}:
+            return False
+        if not layers.import_numpy():  # no coverage
+            return False
+        params = self._get_params(kwargs)
+        key = tuple(sorted(params.iteritems()))
+        try:
+            return self._numpy_faster[key]
+        except KeyError:
+            pass
+        size = max(self.benchmark_size, 2 * params.get('region_size', 0))
+        if image.ncols <= size or image.nrows <= size:
+            # Small images are binarized quickly either way.
+            return True
+        sample = image.subimage(
+            Point((image.ncols - size) // 2, (image.nrows - size) // 2),
+            Dim(size, size)
+        )
+        # Conversion to a run-length encoded bitmap is timed, too;
+        # for simple methods, it takes longer than binarization itself.
+        start = time.time()
+        layers.bitmap_from_numpy(self.binarize_numpy(sample, **kwargs))
+        numpy_time = time.time() - start
+        start = time.time()
+        to_bitmap(Plugin.__call__(self, sample, **kwargs))
+        gamera_time = time.time() - start
+        result = self._numpy_faster[key] = numpy_time <= gamera_time
+        return result
+
+    def __call__(self, image, **kwargs):
+        if self._use_numpy(image, kwargs):
+            return from_numpy_mask(self.binarize_numpy(image, **kwargs))
+        return Plugin.__call__(self, image, **kwargs)
+
+    def binarize(self, image, **kwargs):
+        if self._use_numpy(image, kwargs):
+            return layers.bitmap_from_numpy(self.binarize_numpy(image, **kwargs))
+        return Plugin.binarize(self, image, **kwargs)
+
+class AutoArgument(object):
+
+    def __init__(self, name, type, default, min=None, max=None):
+        self.name = name
+        self.type = type
+        self.min = min
+        self.max = max
+        self.has_default = True
+        self.default = default
+
+class AutoMethod(object):
+
+    '''
+    Pseudo-method that tries a few binarization methods
+    on a downscaled copy of the image,
+    and then applies the best one at full resolution.
+    '''
+
+    candidates = ('djvu', 'otsu', 'sauvola', 'bernsen', 'brink')
+
+    # Masks with fewer or more black pixels than this are assumed to be broken:
+    min_black_ratio = 0.001
+    max_black_ratio = 0.5
+
+    def __init__(self, methods, name='auto'):
+        self.name = name
+        self.methods = [methods[candidate] for candidate in self.candidates]
+        self.args = collections.OrderedDict()
+        for arg in [
+            AutoArgument('scale', float, 0.25, 0.01, 1.0),
+            AutoArgument('cjb2', bool, False),
+        ]:
+            self.args[arg.name] = arg
+
+    def _start_scoring(self, mask, cjb2):
+        '''
+        Start scoring the mask (see score()).
+        Return a function that returns the score.
+        '''
+        black_ratio = 1.0 * mask.n_black() / max(mask.width * mask.height, 1)
+        if not (self.min_black_ratio <= black_ratio <= self.max_black_ratio):
+            return lambda: (1, 0)
+        if cjb2:
+            # cjb2 runs in the background until the file is used
+            # (see djvu.bitonal_to_djvu()):
+            djvu_file = djvu.bitonal_to_djvu(mask.to_pil())
+            def get_score():
+                try:
+                    return (0, os.fstat(djvu_file.fileno()).st_size)
+                finally:
+                    djvu_file.close()
+            return get_score
+        n = mask.count_connected_components()
+        return lambda: (0, n)
+
+    def score(self, mask, cjb2=False):
+        '''
+        Score the (run-length encoded) mask; lower is better.
+        By default, the score is the number of connected components.
+        If cjb2 is true, it is the size of the mask encoded with cjb2.
+        '''
+        return self._start_scoring(mask, cjb2)()
+
+    def _score_sequentially(self, image, cjb2):
+        # All the cjb2 runs are started before waiting for any of them:
+        pending = [
+            self._start_scoring(method.binarize(image), cjb2)
+            for method in self.methods
+        ]
+        return [get_score() for get_score in pending]
+
+    def _score_in_pool(self, image, cjb2, processes):
+        for method in self.methods:
+            if isinstance(method, NumpyPlugin):
+                # Choose the implementation here,
+                # so that the workers inherit the choice:
+                method._use_numpy(image, {})
+        shared_image = to_shared(image)
+        try:
+            pool = multiprocessing.Pool(processes)
+            try:
+                scores = pool.map(_score_shared, [
+                    (shared_image, self.name, method.name, cjb2)
+                    for method in self.methods
+                ])
+            except BaseException:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        finally:
+            shared_image.release()
+        return scores
+
+    def choose(self, image, scale=0.25, cjb2=False):
+        '''
+        Return the method that produces the best mask for the image.
+        '''
+        if scale < 1:
+            image = image.scale(scale, 1)
+        processes = min(len(self.methods), multiprocessing.cpu_count())
+        # Gamera plugins don't release the GIL,
+        # so the candidates are tried in separate processes, if possible.
+        # But daemonic processes (such as the workers of encode -j)
+        # are not allowed to have children;
+        # and it's not safe to fork a process that runs other threads.
+        if (
+            processes > 1 and
+            not multiprocessing.current_process().daemon and
+            threading.active_count() == 1
+        ):
+            scores = self._score_in_pool(image, cjb2, processes)
+        else:
+            scores = self._score_sequentially(image, cjb2)
+        best = min(xrange(len(self.methods)), key=scores.__getitem__)
+        return self.methods[best]
+
+    def __call__(self, image, scale=0.25, cjb2=False):
+        method = self.choose(image, scale, cjb2)
+        return method(image)
+
+    def binarize(self, image, scale=0.25, cjb2=False):
+        method = self.choose(image, scale, cjb2)
+        return method.binarize(image)
+
+def _score_shared(args):
+    [shared_image, auto_name, method_name, cjb2] = args
+    image = from_shared(shared_image)
+    method = methods[method_name]
+    return methods[auto_name].score(method.binarize(image), cjb2)
+
 def _load_methods():
     replace_suffix = re.compile('_threshold$').sub
     class _methods(object):
@@ -194,23 +458,146 @@ def _load_methods():
             continue
         name = replace_suffix('', name)
         name = name.replace('_', '-')
-        method = Plugin(plugin, name)
+        try:
+            function = binarization.methods[name]
+        except KeyError:
+            method = Plugin(plugin, name)
+        else:
+            method = NumpyPlugin(plugin, name, function)
         methods[name] = method
+    methods['auto'] = AutoMethod(methods)
     return methods
 
 methods = _load_methods()
 
-def to_pil_rgb(image):
-    # About 20% faster than the standard .to_pil() method of Gamera 3.2.6.
+def to_rgb_buffer(image):
     buffer = ctypes.create_string_buffer(3 * image.ncols * image.nrows)
     image.to_buffer(buffer)
+    return buffer
+
+def to_pil_rgb(image, buffer=None):
+    '''
+    Convert the image to an RGB PIL image.
+    If buffer is not None, it must be to_rgb_buffer(image);
+    the PIL image then uses it, without copying it.
+    '''
+    # About 20% faster than the standard .to_pil() method of Gamera 3.2.6.
+    if buffer is None:
+        buffer = to_rgb_buffer(image)
     return PIL.Image.frombuffer('RGB', (image.ncols, image.nrows), buffer, 'raw', 'RGB', 0, 1)
 
+def to_numpy(image):
+    '''
+    Convert the greyscale image to a (height, width) array of bytes.
+    '''
+    assert image.data.pixel_type == GREYSCALE
+    numpy = layers.numpy
+    data = numpy.frombuffer(image._to_raw_string(), dtype=numpy.uint8)
+    return data.reshape((image.nrows, image.ncols))
+
+def from_numpy_mask(black):
+    '''
+    Convert the boolean array (in which black pixels are true)
+    to a one-bit image.
+    '''
+    numpy = layers.numpy
+    data = numpy.where(black, 0x00, 0xFF).astype(numpy.uint8)
+    image = from_pil(PIL.Image.fromarray(data, 'L'))
+    return image.threshold(0x7F)
+
+class SharedImage(object):
+
+    '''
+    Image stored in a shared-memory buffer (see to_shared()).
+    Unlike the image itself, it's cheap to pickle.
+    '''
+
+    def __init__(self, mode, width, height, buffer, dpi=None):
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.buffer = buffer
+        self.dpi = dpi
+
+    def release(self):
+        '''
+        Release the buffer, without reading it.
+        '''
+        shm.release(self.buffer)
+
+def to_shared(image):
+    '''
+    Copy the image into a shared-memory buffer.
+    Return a SharedImage.
+    '''
+    dpi = getattr(image, 'dpi', None)
+    pixel_type = image.data.pixel_type
+    if pixel_type == ONEBIT:
+        mode = '1'
+        image = image.to_greyscale()
+    elif pixel_type == GREYSCALE:
+        mode = 'L'
+    else:
+        mode = 'RGB'
+    width, height = image.ncols, image.nrows
+    if mode == 'RGB':
+        size = 3 * width * height
+        buffer = shm.Buffer.create(size)
+        with buffer:
+            # Let Gamera write the pixels directly into the shared memory:
+            ctypes_buffer = (ctypes.c_char * size).from_buffer(buffer.data)
+            image.to_buffer(ctypes_buffer)
+            del ctypes_buffer
+    else:
+        data = image._to_raw_string()
+        buffer = shm.Buffer.create(len(data))
+        with buffer:
+            buffer.data.write(data)
+        del data
+    return SharedImage(mode, width, height, buffer.handle, dpi=dpi)
+
+def from_shared(shared):
+    '''
+    Create an image from a SharedImage.
+    The shared-memory buffer is not released,
+    so that other processes can read the same image;
+    the process that created it should release it.
+    '''
+    mode = 'L' if shared.mode == '1' else shared.mode
+    with shm.Buffer.attach(shared.buffer) as buffer:
+        pil_image = PIL.Image.frombuffer(mode, (shared.width, shared.height), buffer.data, 'raw', mode, 0, 1)
+        image = from_pil(pil_image)
+        del pil_image
+    if shared.mode == '1':
+        image = image.threshold(0x7F)
+    image.dpi = shared.dpi
+    return image
+
 def to_pil_1bpp(image):
     if image.data.pixel_type != GREYSCALE:
         image = image.to_greyscale()
     return image.to_pil()
 
+def to_bitmap(image):
+    return rle.Bitmap.from_pil(to_pil_1bpp(image))
+
+def is_bitonal(image, mask):
+    '''
+    Check if the image is bitonal (a one-bit image, or a greyscale image
+    with only black and white pixels), and the mask is the image itself.
+    '''
+    # Colour images, and greyscale images with other shades,
+    # are rejected without converting them to bitmaps:
+    pixel_type = image.data.pixel_type
+    if pixel_type == GREYSCALE:
+        if any(image.histogram()[1:255]):
+            return False
+    elif pixel_type != ONEBIT:
+        return False
+    if (image.ncols, image.nrows) != (mask.width, mask.height):
+        return False
+    return to_bitmap(image) == mask
+
 def init():
     if not has_version(3, 4):
         raise RuntimeError('Gamera >= 3.4 is required')
@@ -246,20 +633,31 @@ def init():
 
 __all__ = [
     # classes:
+    'AutoMethod',
     'Dim',
     'Image',
+    'NumpyPlugin',
     'Point',
     'RGBPixel',
+    'SharedImage',
     # pixel types:
     'ONEBIT',
     'GREYSCALE',
     'RGB',
     # functions:
+    'from_numpy_mask',
+    'from_pil',
+    'from_shared',
     'init',
+    'is_bitonal',
     'load_image',
     'methods',
+    'to_bitmap',
+    'to_numpy',
     'to_pil_1bpp',
     'to_pil_rgb',
+    'to_rgb_buffer',
+    'to_shared',
 ]
 
 # vim:ts=4 sts=4 sw=4 et
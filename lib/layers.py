@@ -0,0 +1,300 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''foreground/background layer analysis'''
+
+import itertools
+
+from . import rle
+from . import utils
+
+try:
+    import PIL.Image
+    import PIL.ImageStat
+except ImportError as ex:  # no coverage
+    utils.enhance_import_error(ex,
+        'Pillow',
+        'python-pil',
+        'https://pypi.org/project/Pillow/'
+    )
+    raise
+
+numpy = None
+
+def import_numpy():
+    '''
+    Import NumPy, if it's available; return True on success.
+
+    NumPy is not imported eagerly,
+    so that it doesn't get in the way of gamera_support.init().
+    '''
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:  # no coverage
+            return False
+    return True
+
+BLACK = (0x00, 0x00, 0x00)
+WHITE = (0xFF, 0xFF, 0xFF)
+
+# Maximum standard deviation (in each band) of a uniform layer:
+UNIFORM_STDDEV_MAX = 3.0
+
+# Maximum difference (in each band) between two colors that are considered
+# the same:
+COLOR_TOLERANCE = 3
+
+def uniform_color(image, mask, default):
+    '''
+    Return the color of the unmasked pixels of the RGB image,
+    if they are (nearly) uniform; None otherwise.
+
+    The mask is a PIL image; black pixels are masked out.
+    If all the pixels are masked out, return the default color.
+    '''
+    stat = PIL.ImageStat.Stat(image, mask)
+    if stat.count[0] == 0:
+        return default
+    if max(stat.var) > UNIFORM_STDDEV_MAX ** 2:
+        return
+    return tuple(int(round(x)) for x in stat.mean)
+
+def colors_close(color1, color2):
+    return max(abs(x - y) for x, y in zip(color1, color2)) <= COLOR_TOLERANCE
+
+def color_to_html(color):
+    return '#{0:02X}{1:02X}{2:02X}'.format(*color)
+
+def get_subsampled_size(width, height, ratio):
+    return (
+        (width + ratio - 1) // ratio,
+        (height + ratio - 1) // ratio,
+    )
+
+# Number of rows processed at once by subsample_fg();
+# this bounds the size of temporary arrays.
+_strip_height = 512
+
+def bitmap_to_numpy(bitmap):
+    '''
+    Convert the run-length encoded bitmap to a (height, width) boolean array,
+    in which black pixels are true.
+    '''
+    [width, height] = [bitmap.width, bitmap.height]
+    counts = numpy.fromiter((len(row) for row in bitmap.rows), dtype=numpy.intp, count=height)
+    runs = numpy.fromiter(
+        itertools.chain.from_iterable(itertools.chain.from_iterable(bitmap.rows)),
+        dtype=numpy.intp,
+    )
+    runs = runs.reshape((-1, 2))
+    runs += numpy.repeat(numpy.arange(0, height * width, width), counts)[:, None]
+    # Runs don't overlap, so their starts (and their ends) are all distinct:
+    edges = numpy.zeros(height * width + 1, dtype=numpy.int8)
+    edges[runs[:, 0]] += 1
+    edges[runs[:, 1]] -= 1
+    black = numpy.cumsum(edges[:-1], dtype=numpy.int8).view(bool)
+    return black.reshape((height, width))
+
+def bitmap_from_numpy(black):
+    '''
+    Convert the (height, width) boolean array,
+    in which black pixels are true,
+    to a run-length encoded bitmap.
+    '''
+    [height, width] = black.shape
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = black
+    edges = numpy.diff(padded, axis=1)
+    [ys, starts] = numpy.nonzero(edges > 0)
+    ends = numpy.nonzero(edges < 0)[1]
+    counts = numpy.bincount(ys, minlength=height).tolist()
+    starts = starts.tolist()
+    ends = ends.tolist()
+    rows = []
+    i = 0
+    for n in counts:
+        j = i + n
+        rows += [zip(starts[i:j], ends[i:j])]
+        i = j
+    return rle.Bitmap(width, height, rows)
+
+def _erode(black):
+    '''
+    Erode black pixels with a 3×3 square, just like rle.Bitmap.erode().
+    '''
+    result = black.copy()
+    result[:, 1:] &= black[:, :-1]
+    result[:, :-1] &= black[:, 1:]
+    hresult = result.copy()
+    result[1:] &= hresult[:-1]
+    result[:-1] &= hresult[1:]
+    return result
+
+def _block_sums(data, ratio):
+    '''
+    Compute sums over ratio × ratio blocks of the array
+    (the blocks at the right and bottom edges may be smaller).
+    '''
+    [height, width] = data.shape[:2]
+    [swidth, sheight] = get_subsampled_size(width, height, ratio)
+    extra_shape = data.shape[2:]
+    # Sums of a few bytes fit in 16 bits, which halves the memory traffic:
+    dtype = numpy.uint16 if ratio * 0xFF <= 0xFFFF else numpy.uint32
+    column_sums = numpy.zeros((height, swidth) + extra_shape, dtype=dtype)
+    for i in xrange(ratio):
+        part = data[:, i::ratio]
+        column_sums[:, :part.shape[1]] += part
+    sums = numpy.zeros((sheight, swidth) + extra_shape, dtype=numpy.uint32)
+    for i in xrange(ratio):
+        part = column_sums[i::ratio]
+        sums[:part.shape[0]] += part
+    return sums
+
+def _subsample_fg_numpy(data, width, height, mask, ratio):
+    [swidth, sheight] = get_subsampled_size(width, height, ratio)
+    data = numpy.frombuffer(data, dtype=numpy.uint8).reshape((height, width, 3))
+    black = _erode(bitmap_to_numpy(mask))
+    sums = numpy.empty((sheight, swidth, 3), dtype=numpy.uint32)
+    counts = numpy.empty((sheight, swidth, 1), dtype=numpy.uint32)
+    strip_height = max(_strip_height // ratio, 1) * ratio
+    for y0 in xrange(0, height, strip_height):
+        y1 = min(y0 + strip_height, height)
+        sy0 = y0 // ratio
+        sy1 = sy0 + (y1 - y0 + ratio - 1) // ratio
+        strip_black = black[y0:y1, :, None]
+        # Only the foreground pixels are taken into account:
+        sums[sy0:sy1] = _block_sums(data[y0:y1] * strip_black, ratio)
+        counts[sy0:sy1] = _block_sums(strip_black, ratio)
+    masked_out = counts == 0
+    counts[masked_out] = 1
+    subsampled_data = (sums + counts // 2) // counts
+    return (
+        PIL.Image.fromarray(subsampled_data.astype(numpy.uint8), 'RGB'),
+        bitmap_from_numpy(masked_out[:, :, 0]),
+    )
+
+def subsample_fg(data, width, height, mask, ratio):
+    '''
+    Subsample the foreground layer.
+
+    The data is the raw RGB image;
+    the mask is a run-length encoded bitmap, in which foreground pixels are black.
+
+    Return the subsampled image (as a PIL image)
+    and the subsampled mask (as a bitmap, in which black pixels are masked out).
+    '''
+    if import_numpy():
+        return _subsample_fg_numpy(data, width, height, mask, ratio)
+    data = bytearray(data)
+    [swidth, sheight] = get_subsampled_size(width, height, ratio)
+    n = [0] * (swidth * sheight)
+    r = n[:]
+    g = n[:]
+    b = n[:]
+    # Only the foreground pixels are visited:
+    for y, row in enumerate(mask.erode().rows):
+        offset = (y // ratio) * swidth
+        for start, end in row:
+            for x in xrange(start, end):
+                i = offset + x // ratio
+                j = 3 * (y * width + x)
+                n[i] += 1
+                r[i] += data[j]
+                g[i] += data[j + 1]
+                b[i] += data[j + 2]
+    subsampled_data = bytearray(3 * swidth * sheight)
+    subsampled_mask = bytearray('\xFF' * (swidth * sheight))
+    for i, k in enumerate(n):
+        if k > 0:
+            j = 3 * i
+            subsampled_data[j] = (r[i] + k // 2) // k
+            subsampled_data[j + 1] = (g[i] + k // 2) // k
+            subsampled_data[j + 2] = (b[i] + k // 2) // k
+        else:
+            subsampled_mask[i] = 0
+    return (
+        PIL.Image.frombytes('RGB', (swidth, sheight), str(subsampled_data)),
+        rle.Bitmap.from_bytes(str(subsampled_mask), swidth, sheight),
+    )
+
+def subsample_bg_mask(mask, ratio):
+    '''
+    Subsample the background layer mask.
+
+    The mask is a run-length encoded bitmap, in which foreground pixels are black.
+    Return the subsampled bitmap, in which black pixels are masked out.
+    '''
+    [swidth, sheight] = get_subsampled_size(mask.width, mask.height, ratio)
+    if not import_numpy():
+        mask = mask.resample(swidth, sheight)
+        return mask.erode().erode()
+    # Only the rows that are picked by resampling are converted:
+    ys = rle.resample_indices(mask.height, sheight)
+    xs = rle.resample_indices(mask.width, swidth)
+    rows = rle.Bitmap(mask.width, sheight, [mask.rows[y] for y in ys])
+    black = bitmap_to_numpy(rows)[:, xs]
+    return bitmap_from_numpy(_erode(_erode(black)))
+
+def subsample_bg_image(image, ratio):
+    '''
+    Subsample the background layer image, using Pillow's box filter.
+    Each pixel of the result is the average of a ratio × ratio block
+    (or of a smaller one, at the right and bottom edges).
+
+    The image is a PIL image.
+    Return the subsampled image as a PIL image;
+    or None if Pillow is too old (< 3.4) to have the box filter.
+    '''
+    if not hasattr(PIL.Image, 'BOX'):
+        return  # no coverage
+    [width, height] = image.size
+    [swidth, sheight] = get_subsampled_size(width, height, ratio)
+    if (width, height) == (swidth * ratio, sheight * ratio):
+        return image.resize((swidth, sheight), PIL.Image.BOX)
+    # Otherwise, the box filter would spread the partial blocks
+    # over the whole image. Subsample them separately:
+    simage = PIL.Image.new('RGB', (swidth, sheight))
+    xs = [0, width // ratio, swidth]
+    ys = [0, height // ratio, sheight]
+    for sx0, sx1 in zip(xs, xs[1:]):
+        for sy0, sy1 in zip(ys, ys[1:]):
+            if sx0 == sx1 or sy0 == sy1:
+                continue
+            box = (
+                sx0 * ratio, sy0 * ratio,
+                min(sx1 * ratio, width), min(sy1 * ratio, height)
+            )
+            part = image.crop(box).resize((sx1 - sx0, sy1 - sy0), PIL.Image.BOX)
+            simage.paste(part, (sx0, sy0))
+    return simage
+
+__all__ = [
+    'BLACK',
+    'WHITE',
+    'bitmap_from_numpy',
+    'bitmap_to_numpy',
+    'color_to_html',
+    'colors_close',
+    'get_subsampled_size',
+    'import_numpy',
+    'subsample_bg_image',
+    'subsample_bg_mask',
+    'subsample_fg',
+    'uniform_color',
+]
+
+# vim:ts=4 sts=4 sw=4 et
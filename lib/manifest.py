@@ -0,0 +1,158 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''page manifests'''
+
+import copy
+import json
+import sys
+
+from . import cli
+
+class Page(object):
+
+    '''
+    Input page, with optional per-page settings.
+    '''
+
+    def __init__(self, image, mask=None, page_id=None, dpi=None, method=None, params=None):
+        self.image = image
+        self.mask = mask
+        self.page_id = page_id
+        self.dpi = dpi
+        self.method = method
+        self.params = params
+
+    def get_options(self, options):
+        '''
+        Return the options with per-page settings applied.
+        '''
+        if self.dpi is None and self.method is None and self.params is None:
+            return options
+        options = copy.copy(options)
+        if self.dpi is not None:
+            options.dpi = self.dpi
+        if self.method is not None:
+            options.method = self.method
+        if self.params is not None:
+            options.params = self.params
+        return options
+
+_json_keys = {'image', 'mask', 'page-id', 'dpi', 'method', 'params'}
+
+def _encode(s):
+    if isinstance(s, unicode):
+        s = s.encode(sys.getfilesystemencoding() or 'UTF-8')
+    return s
+
+def _parse_json(line):
+    record = json.loads(line)
+    for key in record:
+        if key not in _json_keys:
+            raise ValueError('unknown key {0!r}'.format(key))
+    params = record.get('params')
+    if isinstance(params, dict):
+        params = [
+            _encode(pname) if pvalue is True else '{0}={1}'.format(_encode(pname), pvalue)
+            for pname, pvalue in sorted(params.iteritems())
+            if pvalue is not False
+        ]
+    elif isinstance(params, list):
+        params = map(_encode, params)
+    elif params is not None:
+        raise ValueError('invalid parameters: {0!r}'.format(params))
+    return (
+        _encode(record.get('image')),
+        _encode(record.get('mask')),
+        _encode(record.get('page-id')),
+        record.get('dpi'),
+        _encode(record.get('method')),
+        params,
+    )
+
+def _parse_tsv(line):
+    fields = line.rstrip('\r\n').split('\t')
+    if len(fields) > 6:
+        raise ValueError('too many fields')
+    fields += [''] * (6 - len(fields))
+    fields = [field or None for field in fields]
+    [image, mask, page_id, dpi, method, params] = fields
+    if params is not None:
+        params = params.split()
+    return image, mask, page_id, dpi, method, params
+
+def parse_line(line, methods, default_method):
+    '''
+    Parse a single manifest line: either a JSON object, or tab-separated
+    fields (image, mask, page id, DPI, method, parameters).
+    Return a Page, or None for blank and comment lines.
+    '''
+    stripped_line = line.strip()
+    if not stripped_line or stripped_line.startswith('#'):
+        return
+    if stripped_line.startswith('{'):
+        fields = _parse_json(stripped_line)
+    else:
+        fields = _parse_tsv(line)
+    [image, mask, page_id, dpi, method_name, params] = fields
+    if not image:
+        raise ValueError('missing image')
+    if dpi is not None:
+        try:
+            dpi = cli.dpi_type(dpi)
+        except (TypeError, ValueError):
+            raise ValueError('invalid DPI value: {0!r}'.format(dpi))
+    method = None
+    if method_name is not None:
+        method_name = cli.replace_underscores(method_name)
+        try:
+            method = methods[method_name]
+        except KeyError:
+            raise ValueError('invalid method: {0!r}'.format(method_name))
+    if method is not None or params is not None:
+        params = cli.parse_params(method or default_method, params or ())
+    return Page(image, mask, page_id, dpi, method, params)
+
+def read(file, methods, default_method):
+    '''
+    Read the manifest, one line at a time.
+    Generate Page objects.
+    '''
+    name = getattr(file, 'name', '<manifest>')
+    for lineno, line in enumerate(file, 1):
+        try:
+            page = parse_line(line, methods, default_method)
+        except ValueError as exc:
+            raise ValueError('{file}:{n}: {exc}'.format(file=name, n=lineno, exc=exc))
+        if page is not None:
+            yield page
+
+def read_file(path, methods, default_method):
+    '''
+    Read the manifest file lazily.
+    Generate Page objects.
+    '''
+    with open(path, 'r') as file:
+        for page in read(file, methods, default_method):
+            yield page
+
+__all__ = [
+    'Page',
+    'parse_line',
+    'read',
+    'read_file',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,268 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''staged producer/consumer pipelines'''
+
+import contextlib
+import logging
+import multiprocessing
+import Queue as queue
+import sys
+import threading
+import time
+
+context = threading.local()
+
+def get_label():
+    '''
+    Return the label of the item that is being processed in this thread,
+    or None.
+    '''
+    return getattr(context, 'label', None)
+
+@contextlib.contextmanager
+def labelled(label):
+    '''
+    Return a context manager that sets the label of the item
+    that is being processed in this thread.
+    '''
+    context.label = label
+    try:
+        yield
+    finally:
+        context.label = None
+
+class Aborted(Exception):
+    '''
+    The pipeline was aborted while the stage was waiting for something.
+    '''
+
+_poll_interval = 0.1
+
+def apply(pool, function, args=()):
+    '''
+    Call the function in one of the pool's processes, and return the result.
+
+    In a pipeline stage, don't wait for the result any longer
+    once the pipeline is aborted (the pool might be terminated then,
+    and the result might never be ready); raise Aborted instead.
+    '''
+    result = pool.apply_async(function, args)
+    aborted = getattr(context, 'aborted', None)
+    while True:
+        try:
+            return result.get(_poll_interval)
+        except multiprocessing.TimeoutError:
+            if aborted is not None and aborted.is_set():
+                raise Aborted
+
+class LabelFilter(logging.Filter):
+
+    '''
+    Logging filter that prefixes messages with the label of the item
+    that is being processed in the current thread.
+    '''
+
+    def filter(self, record):
+        label = get_label()
+        record.label = '' if label is None else label + ': '
+        return True
+
+class Stage(object):
+
+    '''
+    Pipeline stage: a function that is applied to each item
+    by a number of worker threads.
+
+    Items wait for the workers in a queue of bounded size;
+    when the queue is full, the previous stage is blocked.
+    '''
+
+    def __init__(self, name, function, workers=1, queue_size=None):
+        if workers < 1:
+            raise ValueError('number of workers must be positive')
+        if queue_size is None:
+            queue_size = 2 * workers
+        if queue_size < 1:
+            raise ValueError('queue size must be positive')
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue_size = queue_size
+        self.n_items = 0
+        self.busy_time = 0.0
+        self.max_depth = 0
+        self._depth_sum = 0
+        self._depth_samples = 0
+        self._lock = threading.Lock()
+
+    @property
+    def mean_depth(self):
+        '''
+        Mean length of the input queue, sampled whenever an item was put there.
+        '''
+        if not self._depth_samples:
+            return 0.0
+        return 1.0 * self._depth_sum / self._depth_samples
+
+    def _sample_depth(self, depth):
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+            self._depth_sum += depth
+            self._depth_samples += 1
+
+    def _add_busy_time(self, busy_time):
+        with self._lock:
+            self.n_items += 1
+            self.busy_time += busy_time
+
+    def format_metrics(self):
+        return (
+            '{name}: {workers} worker(s), {n} item(s), {busy:.2f} s busy, '
+            'queue depth: {mean:.1f} mean, {max} max (of {size})'
+        ).format(
+            name=self.name,
+            workers=self.workers,
+            n=self.n_items,
+            busy=self.busy_time,
+            mean=self.mean_depth,
+            max=self.max_depth,
+            size=self.queue_size,
+        )
+
+_end = object()
+
+def run(items, stages, label=None):
+    '''
+    Pass each item through the stages, one after another.
+    Generate the results of the last stage, in the order of items.
+
+    If label is not None, it's called on each item,
+    and the result is used as the item's label (see get_label())
+    while it's being processed by any of the stages.
+
+    If a stage raises an exception, or if iterating over items does,
+    it's re-raised by the generator in place of the result.
+    The remaining items are then discarded.
+    '''
+    if not stages:
+        raise ValueError('no stages')
+    queues = [queue.Queue(stage.queue_size) for stage in stages]
+    # Bound the number of items in flight,
+    # so that results that are ready early don't pile up:
+    max_in_flight = sum(stage.workers + stage.queue_size for stage in stages)
+    slots = threading.Semaphore(max_in_flight)
+    results = {}
+    state = dict(n_items=None)
+    done = threading.Condition()
+    aborted = threading.Event()
+    def finish(index, result):
+        with done:
+            results[index] = result
+            done.notify()
+    def put(i, entry):
+        queues[i].put(entry)
+        stages[i]._sample_depth(queues[i].qsize())
+    def feed():
+        n = 0
+        try:
+            for item in items:
+                slots.acquire()
+                if aborted.is_set():
+                    return
+                put(0, (n, None if label is None else label(item), item))
+                n += 1
+        except BaseException:
+            finish(n, (False, sys.exc_info()))
+            n += 1
+        finally:
+            for j in xrange(stages[0].workers):
+                queues[0].put(_end)
+            with done:
+                state['n_items'] = n
+                done.notify()
+    running = [stage.workers for stage in stages]
+    running_lock = threading.Lock()
+    def work(i):
+        context.aborted = aborted
+        stage = stages[i]
+        last = i == len(stages) - 1
+        while True:
+            entry = queues[i].get()
+            if entry is _end:
+                break
+            [n, item_label, item] = entry
+            if aborted.is_set():
+                continue
+            start = time.time()
+            try:
+                with labelled(item_label):
+                    item = stage.function(item)
+            except BaseException:
+                finish(n, (False, sys.exc_info()))
+                continue
+            finally:
+                stage._add_busy_time(time.time() - start)
+            if last:
+                finish(n, (True, item))
+            else:
+                put(i + 1, (n, item_label, item))
+        with running_lock:
+            running[i] -= 1
+            if running[i] == 0 and not last:
+                for j in xrange(stages[i + 1].workers):
+                    queues[i + 1].put(_end)
+    threads = [threading.Thread(target=feed)]
+    for i, stage in enumerate(stages):
+        threads += [
+            threading.Thread(target=work, args=(i,))
+            for j in xrange(stage.workers)
+        ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        n = 0
+        while True:
+            with done:
+                while n not in results:
+                    if state['n_items'] is not None and n >= state['n_items']:
+                        return
+                    done.wait(1)
+                [ok, result] = results.pop(n)
+            if not ok:
+                [exc_type, exc, tb] = result
+                raise exc_type, exc, tb
+            yield result
+            slots.release()
+            n += 1
+    finally:
+        aborted.set()
+        for j in xrange(max_in_flight):
+            slots.release()
+        for thread in threads:
+            thread.join()
+
+__all__ = [
+    'Aborted',
+    'LabelFilter',
+    'Stage',
+    'apply',
+    'get_label',
+    'labelled',
+    'run',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,93 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''previews of binarization methods'''
+
+import math
+
+from . import utils
+
+try:
+    import PIL.Image
+    import PIL.ImageDraw
+except ImportError as ex:  # no coverage
+    utils.enhance_import_error(ex,
+        'Pillow',
+        'python-pil',
+        'https://pypi.org/project/Pillow/'
+    )
+    raise
+
+class Variant(object):
+
+    '''
+    Binarization method, together with its parameters.
+    '''
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+
+    @property
+    def label(self):
+        return str.join(' ', [self.method.name] + [
+            '{0}={1}'.format(pname, pvalue)
+            for pname, pvalue in sorted(self.params.iteritems())
+        ])
+
+def get_default_variants(methods):
+    '''
+    Return variants for all the methods that can be run without parameters.
+    '''
+    return [
+        Variant(method, {})
+        for name, method in sorted(methods.iteritems())
+        if name != 'auto'
+        if all(arg.has_default for arg in method.args.itervalues())
+    ]
+
+_label_height = 14
+_padding = 4
+
+def contact_sheet(masks, labels):
+    '''
+    Tile the (run-length encoded) masks into a single labelled image.
+    Return a PIL image.
+    '''
+    if len(masks) != len(labels):
+        raise ValueError
+    if not masks:
+        raise ValueError
+    ncols = int(math.ceil(math.sqrt(len(masks))))
+    nrows = (len(masks) + ncols - 1) // ncols
+    tile_width = max(mask.width for mask in masks) + _padding
+    tile_height = max(mask.height for mask in masks) + _label_height + _padding
+    sheet = PIL.Image.new('L', (ncols * tile_width + _padding, nrows * tile_height + _padding), 0x80)
+    draw = PIL.ImageDraw.Draw(sheet)
+    for n, (mask, label) in enumerate(zip(masks, labels)):
+        x = (n % ncols) * tile_width + _padding
+        y = (n // ncols) * tile_height + _padding
+        sheet.paste(mask.to_pil(), (x, y))
+        draw.text((x, y + mask.height + 1), label, fill=0xFF)
+    del draw
+    return sheet
+
+__all__ = [
+    'Variant',
+    'contact_sheet',
+    'get_default_variants',
+]
+
+# vim:ts=4 sts=4 sw=4 et
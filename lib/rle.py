@@ -0,0 +1,486 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''run-length encoded bitmaps'''
+
+import array
+import binascii
+import bisect
+import io
+import itertools
+import os
+import re
+
+from . import fs
+from . import shm
+from . import temporary
+from . import utils
+
+try:
+    import PIL.Image
+    import PIL.TiffImagePlugin
+except ImportError as ex:  # no coverage
+    utils.enhance_import_error(ex,
+        'Pillow',
+        'python-pil',
+        'https://pypi.org/project/Pillow/'
+    )
+    raise
+
+_find_black_runs = re.compile('\0+').finditer
+
+FORMATS = ('pbm', 'png', 'tiff-g4')
+MULTIPAGE_FORMATS = ('pbm', 'tiff-g4')
+
+def guess_format(filename, default='png'):
+    '''
+    Guess the image format from the filename extension.
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+    return {
+        '.pbm': 'pbm',
+        '.png': 'png',
+        '.tif': 'tiff-g4',
+        '.tiff': 'tiff-g4',
+    }.get(ext, default)
+
+def _union(*rows):
+    result = []
+    for start, end in sorted(run for row in rows for run in row):
+        if result and start <= result[-1][1]:
+            if end > result[-1][1]:
+                result[-1] = (result[-1][0], end)
+        else:
+            result += [(start, end)]
+    return result
+
+def _intersection(row1, row2):
+    result = []
+    i = j = 0
+    while i < len(row1) and j < len(row2):
+        start = max(row1[i][0], row2[j][0])
+        end = min(row1[i][1], row2[j][1])
+        if start < end:
+            result += [(start, end)]
+        if row1[i][1] < row2[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def resample_indices(old_size, new_size):
+    '''
+    Return indices of the source pixels for nearest-neighbor resampling.
+    '''
+    # This mimics vigra's resampleImage(),
+    # which is what Gamera's resize() uses when interpolation is disabled.
+    factor = 1.0 * old_size / new_size
+    step = int(factor)
+    dx = factor - step
+    saver = dx
+    i = 0
+    result = []
+    while i < old_size - 1 and len(result) < new_size:
+        if saver >= 1.0:
+            saver -= int(saver)
+            i += 1
+        saver += dx
+        result += [i]
+        i += step
+    result += [old_size - 1] * (new_size - len(result))
+    return result
+
+class Bitmap(object):
+
+    '''
+    Bitonal image, stored as a list of rows.
+    Each row is a list of (start, end) pairs, one for each run of black
+    pixels; end is exclusive.
+    '''
+
+    def __init__(self, width, height, rows=None):
+        self.width = width
+        self.height = height
+        if rows is None:
+            rows = [[] for y in xrange(height)]
+        if len(rows) != height:
+            raise ValueError
+        self.rows = rows
+
+    @classmethod
+    def from_bytes(cls, data, width, height):
+        '''
+        Create a bitmap from raw 8-bit greyscale data,
+        in which only 0 bytes are black.
+        '''
+        if len(data) != width * height:
+            raise ValueError
+        rows = []
+        for y in xrange(height):
+            offset = y * width
+            rows += [[
+                (match.start() - offset, match.end() - offset)
+                for match in _find_black_runs(data, offset, offset + width)
+            ]]
+        return cls(width, height, rows)
+
+    @classmethod
+    def from_pil(cls, image):
+        '''
+        Create a bitmap from a PIL image.
+        '''
+        if image.mode != 'L':
+            image = image.convert('L')
+        [width, height] = image.size
+        return cls.from_bytes(image.tobytes(), width, height)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load a bitmap from an image file (e.g. PBM).
+        '''
+        image = PIL.Image.open(filename)
+        try:
+            return cls.from_pil(image)
+        finally:
+            image.close()
+
+    def __eq__(self, other):
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+        return (
+            (self.width, self.height, self.rows) ==
+            (other.width, other.height, other.rows)
+        )
+
+    def __ne__(self, other):
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+        return not self == other
+
+    def to_bytes(self):
+        '''
+        Convert the bitmap to raw 8-bit greyscale data.
+        '''
+        chunks = []
+        for row in self.rows:
+            x = 0
+            for start, end in row:
+                chunks += ['\xFF' * (start - x), '\0' * (end - start)]
+                x = end
+            chunks += ['\xFF' * (self.width - x)]
+        return str.join('', chunks)
+
+    def to_pil(self):
+        '''
+        Convert the bitmap to a PIL image (mode "1").
+        '''
+        image = PIL.Image.frombytes('L', (self.width, self.height), self.to_bytes())
+        return image.convert('1')
+
+    def _iter_pbm_rows(self):
+        '''
+        Generate rows of packed bits (1 for black),
+        each padded to a whole number of bytes.
+        '''
+        width = self.width
+        row_size = (width + 7) // 8
+        if row_size == 0:
+            return
+        padding = '0' * (8 * row_size - width)
+        for row in self.rows:
+            chunks = []
+            x = 0
+            for start, end in row:
+                chunks += ['0' * (start - x), '1' * (end - start)]
+                x = end
+            chunks += ['0' * (width - x), padding]
+            bits = str.join('', chunks)
+            # Python 2 has no int.to_bytes(), but hexadecimal works, too:
+            yield binascii.unhexlify('{0:0{1}x}'.format(int(bits, 2), 2 * row_size))
+
+    def to_pbm(self):
+        '''
+        Convert the bitmap to the (binary) PBM format.
+        '''
+        header = 'P4\n{w} {h}\n'.format(w=self.width, h=self.height)
+        return header + str.join('', self._iter_pbm_rows())
+
+    def write(self, file, format='pbm'):
+        '''
+        Write the bitmap to the file object, in the selected format:
+        pbm, png, or tiff-g4 (TIFF with CCITT Group 4 compression).
+        The file doesn't need to be seekable.
+        '''
+        if format == 'pbm':
+            file.write(self.to_pbm())
+        elif format == 'png':
+            self.to_pil().save(file, 'PNG')
+        elif format == 'tiff-g4':
+            # The TIFF writer needs to seek back,
+            # so it can't write to pipes directly.
+            buffer = io.BytesIO()
+            self.to_pil().save(buffer, 'TIFF', compression='group4')
+            file.write(buffer.getvalue())
+        else:
+            raise ValueError('unsupported format: {0!r}'.format(format))
+
+    def save(self, filename, format='pbm'):
+        '''
+        Save the bitmap in the selected format (see write()).
+        '''
+        with open(filename, 'wb') as file:
+            self.write(file, format)
+
+    def to_shared(self):
+        '''
+        Copy the bitmap into a shared-memory buffer.
+        Return a SharedBitmap.
+        '''
+        counts = array.array('i', (len(row) for row in self.rows))
+        runs = array.array('i', itertools.chain.from_iterable(
+            itertools.chain.from_iterable(self.rows)
+        ))
+        size = counts.itemsize * (len(counts) + len(runs))
+        with shm.Buffer.create(size) as buffer:
+            buffer.data.write(counts.tostring())
+            buffer.data.write(runs.tostring())
+        return SharedBitmap(self.width, self.height, buffer.handle)
+
+    @classmethod
+    def from_shared(cls, shared):
+        '''
+        Create a bitmap from a SharedBitmap,
+        and release its shared-memory buffer.
+        '''
+        with shm.Buffer.attach(shared.buffer) as buffer:
+            data = buffer.read()
+        shared.release()
+        numbers = array.array('i')
+        numbers.fromstring(data)
+        rows = []
+        offset = shared.height
+        for n in numbers[:shared.height]:
+            end = offset + 2 * n
+            rows += [zip(numbers[offset:end:2], numbers[offset + 1:end:2])]
+            offset = end
+        return cls(shared.width, shared.height, rows)
+
+    def n_black(self):
+        '''
+        Return the number of black pixels.
+        '''
+        return sum(end - start for row in self.rows for start, end in row)
+
+    def dilate(self):
+        '''
+        Dilate black pixels with a 3×3 square.
+        '''
+        width = self.width
+        hrows = [
+            _union([(max(start - 1, 0), min(end + 1, width)) for start, end in row])
+            for row in self.rows
+        ]
+        rows = [
+            _union(*hrows[max(y - 1, 0):y + 2])
+            for y in xrange(self.height)
+        ]
+        return Bitmap(self.width, self.height, rows)
+
+    def erode(self):
+        '''
+        Erode black pixels with a 3×3 square.
+        Pixels outside the bitmap are disregarded.
+        '''
+        width = self.width
+        hrows = []
+        for row in self.rows:
+            hrow = []
+            for start, end in row:
+                if start > 0:
+                    start += 1
+                if end < width:
+                    end -= 1
+                if start < end:
+                    hrow += [(start, end)]
+            hrows += [hrow]
+        rows = [
+            reduce(_intersection, hrows[max(y - 1, 0):y + 2])
+            for y in xrange(self.height)
+        ]
+        return Bitmap(self.width, self.height, rows)
+
+    def resample(self, width, height):
+        '''
+        Resize the bitmap, using nearest-neighbor resampling.
+        '''
+        xs = resample_indices(self.width, width)
+        ys = resample_indices(self.height, height)
+        rows = []
+        for y in ys:
+            row = []
+            for start, end in self.rows[y]:
+                start = bisect.bisect_left(xs, start)
+                end = bisect.bisect_left(xs, end)
+                if start < end:
+                    row += [(start, end)]
+            rows += [_union(row)]
+        return Bitmap(width, height, rows)
+
+    def connected_components(self):
+        '''
+        Find 8-connected components of black pixels.
+        Return a list of (x0, y0, x1, y1, n) tuples,
+        where (x0, y0, x1, y1) is the bounding box (x1 and y1 are exclusive),
+        and n is the number of pixels.
+        '''
+        parent = []
+        stats = []
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        prev_row = []
+        for y, row in enumerate(self.rows):
+            curr_row = []
+            j = 0
+            for start, end in row:
+                label = len(parent)
+                parent += [label]
+                x0, y0, x1, y1, n = start, y, end, y + 1, end - start
+                while j < len(prev_row) and prev_row[j][1] < start:
+                    j += 1
+                k = j
+                while k < len(prev_row) and prev_row[k][0] <= end:
+                    root = find(prev_row[k][2])
+                    if root != label:
+                        parent[root] = label
+                        rx0, ry0, rx1, ry1, rn = stats[root]
+                        stats[root] = None
+                        x0 = min(x0, rx0)
+                        y0 = min(y0, ry0)
+                        x1 = max(x1, rx1)
+                        n += rn
+                    k += 1
+                stats += [(x0, y0, x1, y1, n)]
+                curr_row += [(start, end, label)]
+            prev_row = curr_row
+        return [s for s in stats if s is not None]
+
+    def count_connected_components(self):
+        '''
+        Count 8-connected components of black pixels.
+        '''
+        # Streaming union-find over runs; only the previous row is kept.
+        parent = []
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        n = 0
+        prev_row = []
+        for row in self.rows:
+            curr_row = []
+            j = 0
+            for start, end in row:
+                label = len(parent)
+                parent += [label]
+                n += 1
+                while j < len(prev_row) and prev_row[j][1] < start:
+                    j += 1
+                k = j
+                while k < len(prev_row) and prev_row[k][0] <= end:
+                    root = find(prev_row[k][2])
+                    if root != label:
+                        parent[root] = label
+                        n -= 1
+                    k += 1
+                curr_row += [(start, end, label)]
+            prev_row = curr_row
+        return n
+
+class SharedBitmap(object):
+
+    '''
+    Bitmap stored in a shared-memory buffer (see Bitmap.to_shared()).
+    Unlike the bitmap itself, it's cheap to pickle.
+    '''
+
+    def __init__(self, width, height, buffer):
+        self.width = width
+        self.height = height
+        self.buffer = buffer
+
+    def release(self):
+        '''
+        Release the buffer, without reading it.
+        '''
+        shm.release(self.buffer)
+
+class MultipageWriter(object):
+
+    '''
+    Write bitmaps, one after another, into a single file:
+    either a stream of concatenated PBM images, or a multi-page TIFF.
+    '''
+
+    def __init__(self, file, format):
+        if format not in MULTIPAGE_FORMATS:
+            raise ValueError('unsupported multi-page format: {0!r}'.format(format))
+        self.file = file
+        self.format = format
+        self._tmp_file = self._tiff = None
+        if format == 'tiff-g4':
+            # TIFF pages are linked with offsets that need to be fixed up
+            # after each page is written, so they are spooled to a temporary
+            # file first.
+            self._tmp_file = temporary.file(suffix='.tiff')
+            self._tiff = PIL.TiffImagePlugin.AppendingTiffWriter(self._tmp_file)
+
+    def add(self, bitmap):
+        if self._tiff is None:
+            bitmap.write(self.file, self.format)
+        else:
+            bitmap.to_pil().save(self._tiff, 'TIFF', compression='group4')
+            self._tiff.newFrame()
+
+    def close(self):
+        if self._tiff is not None:
+            self._tiff.finalize()
+            self._tmp_file.seek(0)
+            fs.copy_file(self._tmp_file, self.file)
+            self._tmp_file.close()
+            self._tmp_file = self._tiff = None
+        self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+__all__ = [
+    'Bitmap',
+    'FORMATS',
+    'MULTIPAGE_FORMATS',
+    'MultipageWriter',
+    'SharedBitmap',
+    'guess_format',
+    'resample_indices',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,122 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''shared-memory buffers, for passing page data between processes'''
+
+import errno
+import mmap
+import os
+import tempfile
+
+from . import temporary
+
+def get_directory():
+    '''
+    Return the directory in which shared-memory files are created:
+    /dev/shm if it exists, or the usual temporary directory otherwise.
+    '''
+    directory = '/dev/shm'
+    if os.path.isdir(directory):
+        return directory
+    return tempfile.gettempdir()  # no coverage
+
+class Buffer(object):
+
+    '''
+    Memory-mapped file, which other processes can attach to.
+    Only the handle, which is small, needs to be passed to them.
+
+    The process that attaches to the buffer last should unlink it.
+    '''
+
+    def __init__(self, path, size, data):
+        self.path = path
+        self.size = size
+        self.data = data
+
+    @classmethod
+    def create(cls, size, dir=None):
+        '''
+        Create a new zero-filled buffer.
+        '''
+        if dir is None:
+            dir = get_directory()
+        path = temporary.name(prefix='didjvu.', suffix='.shm', dir=dir)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            # Empty files cannot be mapped:
+            os.ftruncate(fd, max(size, 1))
+            data = mmap.mmap(fd, max(size, 1))
+        except BaseException:
+            os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+        return cls(path, size, data)
+
+    @classmethod
+    def attach(cls, handle):
+        '''
+        Attach to the buffer with the provided handle.
+        '''
+        [path, size] = handle
+        fd = os.open(path, os.O_RDWR)
+        try:
+            data = mmap.mmap(fd, max(size, 1))
+        finally:
+            os.close(fd)
+        return cls(path, size, data)
+
+    @property
+    def handle(self):
+        return (self.path, self.size)
+
+    def read(self):
+        '''
+        Return a copy of the buffer contents.
+        '''
+        return self.data[:self.size]
+
+    def close(self):
+        self.data.close()
+
+    def unlink(self):
+        release(self.handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def release(handle):
+    '''
+    Remove the buffer with the provided handle.
+    Processes that are still attached to it are not affected.
+    '''
+    [path, size] = handle
+    try:
+        os.unlink(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise  # no coverage
+
+__all__ = [
+    'Buffer',
+    'get_directory',
+    'release',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,149 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''compression statistics'''
+
+import collections
+import contextlib
+import json
+import math
+import time
+
+class PageStats(object):
+
+    '''
+    Statistics of a single page.
+    '''
+
+    def __init__(self, filename, bytes_in):
+        self.filename = filename
+        self.width = None
+        self.height = None
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+        self.method = None
+        self.params = {}
+        self.chunks = collections.OrderedDict()
+        self.timings = collections.OrderedDict()
+
+    @property
+    def pixels(self):
+        if self.width is None or self.height is None:
+            return
+        return self.width * self.height
+
+    @contextlib.contextmanager
+    def timing(self, stage):
+        '''
+        Measure (wall-clock) time spent in the stage.
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.time() - start
+
+    def as_dict(self):
+        '''
+        Return the statistics as a JSON-serializable dictionary.
+        '''
+        bpp = bits_per_pixel(self.bytes_out, self.pixels)
+        if math.isnan(bpp):
+            bpp = None
+        filename = self.filename
+        if isinstance(filename, str):
+            # JSON strings are Unicode, but filenames are just bytes:
+            filename = filename.decode('UTF-8', 'replace')
+        return collections.OrderedDict([
+            ('filename', filename),
+            ('width', self.width),
+            ('height', self.height),
+            ('pixels', self.pixels),
+            ('bytes-in', self.bytes_in),
+            ('bytes-out', self.bytes_out),
+            ('bits-per-pixel', bpp),
+            ('method', self.method),
+            ('params', collections.OrderedDict(sorted(self.params.iteritems()))),
+            ('chunks', self.chunks),
+            ('timings', self.timings),
+        ])
+
+class DocumentStats(object):
+
+    '''
+    Statistics aggregated over pages.
+    '''
+
+    def __init__(self, pages, bytes_out=None):
+        self.pages = list(pages)
+        self.bytes_in = sum(page.bytes_in for page in self.pages)
+        if bytes_out is None:
+            bytes_out = sum(page.bytes_out for page in self.pages)
+        self.bytes_out = bytes_out
+        self.pixels = sum(page.pixels or 0 for page in self.pages)
+        self.chunks = collections.OrderedDict()
+        self.timings = collections.OrderedDict()
+        for page in self.pages:
+            for key, value in page.chunks.iteritems():
+                self.chunks[key] = self.chunks.get(key, 0) + value
+            for key, value in page.timings.iteritems():
+                self.timings[key] = self.timings.get(key, 0.0) + value
+
+def bits_per_pixel(bytes_out, pixels):
+    if not pixels:
+        return float('nan')
+    return 8.0 * bytes_out / pixels
+
+class JsonWriter(object):
+
+    '''
+    Write per-page statistics to the file, in the JSON Lines format
+    (one JSON object per line).
+    Each line is flushed as soon as it's written.
+    '''
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, page):
+        json.dump(page.as_dict(), self.file, separators=(',', ':'))
+        self.file.write('\n')
+        self.file.flush()
+
+def format_compression_info(stats):
+    bytes_in = stats.bytes_in
+    bytes_out = stats.bytes_out
+    ratio = 1.0 * bytes_in / bytes_out
+    percent_saved = (1.0 * bytes_in - bytes_out) * 100 / bytes_in
+    msg = (
+        '{bits_per_pixel:.3f} bits/pixel; '
+        '{ratio:.3f}:1, {percent_saved:.2f}% saved, '
+        '{bytes_in} bytes in, {bytes_out} bytes out'
+    ).format(
+        bits_per_pixel=bits_per_pixel(bytes_out, stats.pixels),
+        ratio=ratio, percent_saved=percent_saved,
+        bytes_in=bytes_in, bytes_out=bytes_out,
+    )
+    return msg
+
+__all__ = [
+    'DocumentStats',
+    'JsonWriter',
+    'PageStats',
+    'bits_per_pixel',
+    'format_compression_info',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,166 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''search for good layer encoding settings'''
+
+import itertools
+import math
+
+from . import cli
+from . import djvu_support as djvu
+from . import ipc
+from . import temporary
+from . import utils
+
+try:
+    import PIL.Image
+    import PIL.ImageChops
+    import PIL.ImageStat
+except ImportError as ex:  # no coverage
+    utils.enhance_import_error(ex,
+        'Pillow',
+        'python-pil',
+        'https://pypi.org/project/Pillow/'
+    )
+    raise
+
+DEFAULT_CANDIDATES = dict(
+    fg=dict(
+        slices=[[90], [100], [110]],
+        crcb=[djvu.CRCB.normal, djvu.CRCB.full],
+        subsample=[4, 6, 8],
+    ),
+    bg=dict(
+        slices=[[72, 82, 88, 95], [74, 84, 90, 97], [76, 86, 92, 99]],
+        crcb=[djvu.CRCB.half, djvu.CRCB.normal],
+        subsample=[2, 3, 4],
+    ),
+)
+
+class Candidate(object):
+
+    '''
+    Layer encoding settings, and results of trying them on the sample pages.
+    '''
+
+    def __init__(self, slices, crcb, subsample):
+        self.slices = slices
+        self.crcb = crcb
+        self.subsample = subsample
+        self.bytes_out = 0
+        self.squared_error = 0
+        self.n_samples = 0
+
+    def add_result(self, bytes_out, squared_error, n_samples):
+        self.bytes_out += bytes_out
+        self.squared_error += squared_error
+        self.n_samples += n_samples
+
+    @property
+    def psnr(self):
+        return psnr(self.squared_error, self.n_samples)
+
+    def get_options(self, layer):
+        '''
+        Return command-line options that select these settings.
+        '''
+        return [
+            '--{lr}-slices={slices}'.format(lr=layer, slices=cli.get_slice_repr(self.slices)),
+            '--{lr}-crcb={crcb}'.format(lr=layer, crcb=self.crcb),
+            '--{lr}-subsample={n}'.format(lr=layer, n=self.subsample),
+        ]
+
+def get_candidates(layer, slices=None, crcb=None, subsample=None):
+    '''
+    Return all combinations of the provided settings.
+    Settings that are not provided are taken from DEFAULT_CANDIDATES.
+    '''
+    default = DEFAULT_CANDIDATES[layer]
+    return [
+        Candidate(*settings)
+        for settings in itertools.product(
+            slices or default['slices'],
+            crcb or default['crcb'],
+            subsample or default['subsample'],
+        )
+    ]
+
+def psnr(squared_error, n_samples):
+    '''
+    Compute peak signal-to-noise ratio (in dB) of 8-bit samples.
+    '''
+    if squared_error == 0:
+        return float('inf')
+    mse = 1.0 * squared_error / n_samples
+    return 10 * math.log10(255.0 ** 2 / mse)
+
+def get_squared_error(image1, image2):
+    '''
+    Compare two RGB images of the same size.
+    Return the sum of squared differences, and the number of samples.
+    '''
+    if image1.size != image2.size:
+        raise ValueError
+    diff = PIL.ImageChops.difference(image1, image2)
+    stat = PIL.ImageStat.Stat(diff)
+    return sum(stat.sum2), sum(stat.count)
+
+def render(djvu_file):
+    '''
+    Render the (single-page) DjVu document in full resolution.
+    Return the RGB image.
+    '''
+    ppm_file = temporary.file(suffix='.ppm')
+    try:
+        args = ['ddjvu', '-format=ppm', djvu_file.name, ppm_file.name]
+        ipc.Subprocess(args).wait()
+        image = PIL.Image.open(ppm_file.name)
+        image.load()
+        return image.convert('RGB')
+    finally:
+        ppm_file.close()
+
+def pareto_front(candidates):
+    '''
+    Return candidates for which no other candidate
+    is both smaller and of higher quality; sorted by size.
+    '''
+    result = []
+    best_psnr = None
+    for candidate in sorted(candidates, key=lambda c: (c.bytes_out, -c.psnr)):
+        if best_psnr is None or candidate.psnr > best_psnr:
+            result += [candidate]
+            best_psnr = candidate.psnr
+    return result
+
+def format_candidate(candidate, layer):
+    return '{bytes_out:10d} bytes {psnr:7.2f} dB  {options}'.format(
+        bytes_out=candidate.bytes_out,
+        psnr=candidate.psnr,
+        options=str.join(' ', candidate.get_options(layer)),
+    )
+
+__all__ = [
+    'Candidate',
+    'DEFAULT_CANDIDATES',
+    'format_candidate',
+    'get_candidates',
+    'get_squared_error',
+    'pareto_front',
+    'psnr',
+    'render',
+]
+
+# vim:ts=4 sts=4 sw=4 et
@@ -38,24 +38,34 @@ class Proxy(object):
         self._wait_fn = wait_fn
         self._temporaries = temporaries
 
+    def _wait(self):
+        self._wait_fn()
+        self._wait_fn = int
+
     def __getattribute__(self, name):
         if name.startswith('_'):
             return object.__getattribute__(self, name)
-        self._wait_fn()
-        self._wait_fn = int
+        self._wait()
         return getattr(self._object, name)
 
     def __setattr__(self, name, value):
         if name.startswith('_'):
             return object.__setattr__(self, name, value)
-        self._wait_fn()
-        self._wait_fn = int
+        self._wait()
         return setattr(self._object, name, value)
 
+def wait(obj):
+    '''
+    If the object is a Proxy, wait until the proxied object is ready.
+    '''
+    if isinstance(obj, Proxy):
+        obj._wait()
+
 __all__ = [
     'Proxy',
     'enhance_import_error',
     'namespace',
+    'wait',
 ]
 
 # vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,197 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import math
+import os
+import random
+
+from .tools import (
+    SkipTest,
+    assert_equal,
+    assert_raises,
+)
+
+import PIL.Image
+
+from lib import binarization
+from lib import layers
+
+datadir = os.path.join(os.path.dirname(__file__), 'data')
+
+def setup_module():
+    if not layers.import_numpy():
+        raise SkipTest('NumPy is not available')  # no coverage
+
+def random_image(width, height, seed=42):
+    numpy = layers.numpy
+    rng = random.Random(seed)
+    data = [rng.choice([rng.randint(0, 255), rng.randint(100, 140)]) for i in xrange(width * height)]
+    return numpy.array(data, dtype=numpy.uint8).reshape((height, width))
+
+def sample_image():
+    numpy = layers.numpy
+    path = os.path.join(datadir, 'greyscale-packbits.tiff')
+    with PIL.Image.open(path) as image:
+        return numpy.array(image.convert('L'))
+
+# Straightforward implementations, modelled after the Gamera ones:
+
+def naive_local_threshold(data, region_size, lower_bound, upper_bound, get_threshold):
+    [height, width] = data.shape
+    half = region_size // 2
+    result = []
+    for y in xrange(height):
+        row = []
+        for x in xrange(width):
+            window = data[max(0, y - half):min(y + half, height - 1) + 1, max(0, x - half):min(x + half, width - 1) + 1]
+            area = window.size
+            mean = sum(float(v) for v in window.flat) / area
+            variance = sum(float(v) * float(v) for v in window.flat) / area - mean * mean
+            deviation = math.sqrt(variance) if variance >= 0 else float('NaN')
+            value = float(data[y, x])
+            if value < lower_bound:
+                black = True
+            elif value >= upper_bound:
+                black = False
+            else:
+                black = not (value > get_threshold(mean, deviation))
+            row += [black]
+        result += [row]
+    return result
+
+def naive_niblack(data, region_size=15, sensitivity=-0.2, lower_bound=20, upper_bound=150):
+    def get_threshold(mean, deviation):
+        return mean + sensitivity * deviation
+    return naive_local_threshold(data, region_size, lower_bound, upper_bound, get_threshold)
+
+def naive_sauvola(data, region_size=15, sensitivity=0.5, dynamic_range=128, lower_bound=20, upper_bound=150):
+    def get_threshold(mean, deviation):
+        return mean + (1.0 - sensitivity * (1.0 - deviation / dynamic_range))
+    return naive_local_threshold(data, region_size, lower_bound, upper_bound, get_threshold)
+
+def naive_bernsen(data, region_size=11, contrast_limit=80, doubt_to_black=False):
+    [height, width] = data.shape
+    half = region_size // 2
+    result = []
+    for y in xrange(height):
+        row = []
+        for x in xrange(width):
+            minimum = 255
+            maximum = 0
+            for dy in xrange(-half, half):
+                if not (0 <= y + dy < height):
+                    dy = -dy
+                for dx in xrange(-half, half):
+                    if not (0 <= x + dx < width):
+                        dx = -dx
+                    value = int(data[y + dy, x + dx])
+                    minimum = min(minimum, value)
+                    maximum = max(maximum, value)
+            contrast = (maximum - minimum) & 0xFF
+            if contrast < contrast_limit:
+                black = doubt_to_black
+            else:
+                black = int(data[y, x]) < (maximum + minimum) // 2
+            row += [black]
+        result += [row]
+    return result
+
+class test_local:
+
+    def _test(self, method, naive_method, params={}):
+        data = random_image(37, 23)
+        assert_equal(
+            method(data, **params).tolist(),
+            naive_method(data, **params)
+        )
+
+    def test_niblack(self):
+        t = self._test
+        yield t, binarization.niblack, naive_niblack
+        yield t, binarization.niblack, naive_niblack, dict(region_size=4, sensitivity=0.3)
+        yield t, binarization.niblack, naive_niblack, dict(region_size=23, lower_bound=0, upper_bound=255)
+
+    def test_sauvola(self):
+        t = self._test
+        yield t, binarization.sauvola, naive_sauvola
+        yield t, binarization.sauvola, naive_sauvola, dict(region_size=1)
+        yield t, binarization.sauvola, naive_sauvola, dict(region_size=20, sensitivity=0.2, dynamic_range=64)
+
+    def test_bernsen(self):
+        t = self._test
+        yield t, binarization.bernsen, naive_bernsen
+        yield t, binarization.bernsen, naive_bernsen, dict(region_size=1)
+        yield t, binarization.bernsen, naive_bernsen, dict(region_size=2, contrast_limit=0)
+        yield t, binarization.bernsen, naive_bernsen, dict(region_size=4, doubt_to_black=True)
+        yield t, binarization.bernsen, naive_bernsen, dict(region_size=23, contrast_limit=30)
+        yield t, binarization.bernsen, naive_bernsen, dict(region_size=22, contrast_limit=255)
+
+    def test_running_extreme(self):
+        numpy = layers.numpy
+        data = random_image(37, 23)
+        for length in 1, 2, 5, 23:
+            for ufunc in numpy.minimum, numpy.maximum:
+                result = binarization._running_extreme(data, length, ufunc)
+                expected = [
+                    ufunc.reduce(data[i:i + length], axis=0).tolist()
+                    for i in xrange(len(data) - length + 1)
+                ]
+                assert_equal(result.tolist(), expected)
+
+    def test_strips(self):
+        data = sample_image()
+        for method in binarization.niblack, binarization.sauvola:
+            result = method(data)
+            strip_height = binarization._strip_height
+            try:
+                binarization._strip_height = 7
+                assert_equal(method(data).tolist(), result.tolist())
+            finally:
+                binarization._strip_height = strip_height
+
+    def test_region_size(self):
+        data = random_image(37, 23)
+        for method in binarization.bernsen, binarization.niblack, binarization.sauvola:
+            with assert_raises(ValueError):
+                method(data, region_size=0)
+            with assert_raises(ValueError):
+                method(data, region_size=24)
+
+    def test_contrast_limit(self):
+        data = random_image(37, 23)
+        with assert_raises(ValueError):
+            binarization.bernsen(data, contrast_limit=-1)
+        with assert_raises(ValueError):
+            binarization.bernsen(data, contrast_limit=256)
+
+def test_global():
+    data = random_image(37, 23)
+    assert_equal(binarization.global_(data, 128).tolist(), (data <= 128).tolist())
+
+class test_otsu:
+
+    def test_bimodal(self):
+        numpy = layers.numpy
+        data = numpy.array([[10, 12, 200, 210], [11, 13, 205, 199]], dtype=numpy.uint8)
+        threshold = binarization.otsu_find_threshold(data)
+        assert_equal(threshold, 13)
+        assert_equal(binarization.otsu(data).tolist(), [[True, True, False, False]] * 2)
+
+    def test_uniform(self):
+        numpy = layers.numpy
+        data = numpy.zeros((5, 5), dtype=numpy.uint8) + 42
+        assert_equal(binarization.otsu_find_threshold(data), 127)
+
+# vim:ts=4 sts=4 sw=4 et
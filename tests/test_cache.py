@@ -0,0 +1,73 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import hashlib
+import os
+
+from .tools import (
+    assert_equal,
+    assert_is_none,
+    assert_not_equal,
+)
+
+from lib import cache
+from lib import rle
+from lib import temporary
+
+class MockMethod(object):
+    def __init__(self, name):
+        self.name = name
+
+def test_hash_file():
+    with temporary.file() as file:
+        file.write('eggs')
+        file.flush()
+        assert_equal(cache.hash_file(file.name), hashlib.sha1('eggs').hexdigest())
+
+class test_mask_cache:
+
+    def test_get_key(self):
+        with temporary.directory() as tmpdir:
+            mask_cache = cache.MaskCache(tmpdir)
+            path1 = os.path.join(tmpdir, 'eggs.png')
+            path2 = os.path.join(tmpdir, 'ham.png')
+            for path, data in (path1, 'eggs'), (path2, 'ham'):
+                with open(path, 'wb') as file:
+                    file.write(data)
+            djvu = MockMethod('djvu')
+            key = mask_cache.get_key(path1, djvu, {})
+            assert_equal(key, mask_cache.get_key(path1, MockMethod('djvu'), {}))
+            assert_not_equal(key, mask_cache.get_key(path2, djvu, {}))
+            assert_not_equal(key, mask_cache.get_key(path1, MockMethod('otsu'), {}))
+            assert_not_equal(key, mask_cache.get_key(path1, djvu, dict(eggs=37)))
+            assert_not_equal(
+                mask_cache.get_key(path1, djvu, dict(eggs=37)),
+                mask_cache.get_key(path1, djvu, dict(eggs=42)),
+            )
+
+    def test_get_put(self):
+        bitmap = rle.Bitmap(10, 3, [[(0, 3)], [], [(2, 10)]])
+        with temporary.directory() as tmpdir:
+            mask_cache = cache.MaskCache(tmpdir)
+            key = hashlib.sha1('eggs').hexdigest()
+            assert_is_none(mask_cache.get(key))
+            mask_cache.put(key, bitmap)
+            assert_equal(mask_cache.get(key), bitmap)
+            assert_equal(os.listdir(tmpdir), [key[:2]])
+            assert_equal(os.listdir(os.path.join(tmpdir, key[:2])), [key + '.pbm'])
+            mask_cache.put(key, bitmap)
+            assert_equal(mask_cache.get(key), bitmap)
+
+# vim:ts=4 sts=4 sw=4 et
@@ -30,6 +30,7 @@ from .tools import (
 )
 
 from lib import cli
+from lib import djvu_support as djvu
 
 class test_range_int:
 
@@ -179,6 +180,7 @@ class test_argument_parser:
     anames['separate'] = 1
     anames['encode'] = 1
     anames['bundle'] = 1
+    anames['tune'] = 1
 
     def test_init(self):
         cli.ArgumentParser(self.methods, 'djvu')
@@ -216,6 +218,7 @@ class test_argument_parser:
         yield t, 'separate'
         yield t, 'bundle'
         yield t, 'encode'
+        yield t, 'tune'
 
     def test_bad_action(self, action='eggs'):
         stderr = io.BytesIO()
@@ -259,6 +262,9 @@ class test_argument_parser:
         assert_equal(options.params, {})
         assert_equal(options.verbosity, 1)
         assert_is(options.xmp, False)
+        assert_is_none(options.mask_cache)
+        assert_is_none(options.manifest)
+        assert_is_none(options.jobs)
 
     def test_action_defaults(self):
         t = self._test_action_defaults
@@ -266,6 +272,99 @@ class test_argument_parser:
         yield t, 'encode'
         yield t, 'separate'
 
+    def test_pages_per_dict(self):
+        def t(value, expected):
+            options = self._test_action('bundle', '-p', value, 'eggs.png')
+            assert_equal(options.pages_per_dict, expected)
+        t('0', 1)
+        t('1', 1)
+        t('42', 42)
+        t('auto', 'auto')
+        stderr = io.BytesIO()
+        with interim(sys, argv=['didjvu', 'bundle', '-p', 'eggs', 'eggs.png'], stderr=stderr):
+            ap = cli.ArgumentParser(self.methods, 'djvu')
+            with assert_raises(SystemExit) as ecm:
+                ap.parse_args({})
+            assert_equal(ecm.exception.args, (2,))
+        assert_regex(stderr.getvalue(), "error: argument -p/--pages-per-dict: invalid pages-per-dict value: 'eggs'")
+
+    def test_tune(self):
+        options = self._test_action('tune', 'eggs.png')
+        assert_equal(options.layer, 'bg')
+        assert_is_none(options.slices)
+        assert_is_none(options.crcb)
+        assert_is_none(options.subsample)
+        options = self._test_action('tune',
+            '--layer', 'fg',
+            '--slices', '90', '--slices', '100',
+            '--crcb', 'full',
+            '--subsample', '4', '--subsample', '6',
+            'eggs.png'
+        )
+        assert_equal(options.layer, 'fg')
+        assert_equal(options.slices, [[90], [100]])
+        assert_equal(options.crcb, [djvu.CRCB.full])
+        assert_equal(options.subsample, [4, 6])
+
+    def test_manifest(self):
+        options = self._test_action('encode', '--manifest', 'eggs.tsv')
+        assert_equal(options.manifest, 'eggs.tsv')
+        assert_equal(options.input, [])
+        options = self._test_action('bundle', '--manifest', 'eggs.tsv')
+        assert_equal(options.manifest, 'eggs.tsv')
+        def t(*args):
+            stderr = io.BytesIO()
+            with interim(sys, argv=['didjvu', 'encode'] + list(args), stderr=stderr):
+                ap = cli.ArgumentParser(self.methods, 'djvu')
+                with assert_raises(SystemExit) as ecm:
+                    ap.parse_args({})
+                assert_equal(ecm.exception.args, (2,))
+            assert_regex(stderr.getvalue(), 'didjvu encode: error: --manifest cannot be used together with ')
+        t('--manifest', 'eggs.tsv', 'ham.png')
+        t('--manifest', 'eggs.tsv', '--masks', 'ham.pbm')
+
+    def test_preview(self):
+        options = self._test_action('separate', 'eggs.png')
+        assert_is_none(options.preview)
+        assert_is_none(options.preview_variants)
+        options = self._test_action('separate', '--preview', '0.25', '--try', 'djvu', '--try', 'abutaleb', 'eggs.png')
+        assert_equal(options.preview, 0.25)
+        assert_equal(
+            [(v.method, v.params) for v in options.preview_variants],
+            [(self.methods['djvu'], {}), (self.methods['abutaleb'], {})]
+        )
+        def t(*args):
+            stderr = io.BytesIO()
+            with interim(sys, argv=['didjvu', 'separate'] + list(args) + ['eggs.png'], stderr=stderr):
+                ap = cli.ArgumentParser(self.methods, 'djvu')
+                with assert_raises(SystemExit) as ecm:
+                    ap.parse_args({})
+                assert_equal(ecm.exception.args, (2,))
+            return stderr.getvalue()
+        assert_regex(t('--preview', '0'), "error: argument --preview: invalid scale value: '0'")
+        assert_regex(t('--preview', '1.5'), "error: argument --preview: invalid scale value: '1.5'")
+        assert_regex(t('--try', 'djvu'), 'error: --try requires --preview')
+        assert_regex(t('--preview', '0.5', '--try', 'eggs'), "error: invalid method: 'eggs'")
+        assert_regex(t('--preview', '0.5', '--try', 'djvu,ham=1'), "error: invalid parameter name 'ham'")
+
+    def test_jobs(self):
+        options = self._test_action('encode', '-j', '4', 'eggs.png')
+        assert_equal(options.jobs, (4, 4, 4))
+        options = self._test_action('encode', '--jobs', '1,3,2', 'eggs.png')
+        assert_equal(options.jobs, (1, 3, 2))
+        def t(value):
+            stderr = io.BytesIO()
+            with interim(sys, argv=['didjvu', 'encode', '--jobs', value, 'eggs.png'], stderr=stderr):
+                ap = cli.ArgumentParser(self.methods, 'djvu')
+                with assert_raises(SystemExit) as ecm:
+                    ap.parse_args({})
+                assert_equal(ecm.exception.args, (2,))
+            assert_regex(stderr.getvalue(), "error: argument -j/--jobs: invalid jobs value: '{0}'".format(value))
+        t('0')
+        t('1,2')
+        t('1,0,1')
+        t('eggs')
+
     def _test_help(self, action=None):
         argv = ['didjvu', action, '--help']
         argv = filter(None, argv)
@@ -283,5 +382,6 @@ class test_argument_parser:
         yield t, 'bundle'
         yield t, 'encode'
         yield t, 'separate'
+        yield t, 'tune'
 
 # vim:ts=4 sts=4 sw=4 et
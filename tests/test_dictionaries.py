@@ -0,0 +1,88 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+from .tools import (
+    assert_equal,
+    interim,
+)
+
+from lib import dictionaries
+from lib import rle
+
+def test_get_symbol_shapes():
+    bitmap = rle.Bitmap(20, 4, [
+        [(0, 2), (5, 7), (10, 14)],
+        [(0, 2), (5, 7), (10, 14)],
+        [],
+        [(18, 19)],
+    ])
+    n, shapes = dictionaries.get_symbol_shapes(bitmap)
+    # The 1-pixel component is disregarded:
+    assert_equal(n, 3)
+    assert_equal(shapes, {(1, 1, 8), (2, 1, 8)})
+
+def test_get_symbol_shapes_bands():
+    # A 2x2 square every 4 rows, and a tall bar at rows 6-9:
+    rows = [[] for y in xrange(42)]
+    for y in xrange(0, 42, 4):
+        rows[y] += [(0, 2)]
+        rows[y + 1] += [(0, 2)]
+    for y in xrange(6, 10):
+        rows[y] += [(6, 8)]
+    bitmap = rle.Bitmap(10, 42, rows)
+    with interim(dictionaries, SYMBOL_SAMPLE_BANDS=2, SYMBOL_SAMPLE_BAND_HEIGHT=8):
+        n, shapes = dictionaries.get_symbol_shapes(bitmap)
+    # Bands are rows 0-7 and 34-41.
+    # They have 4 squares and the top of the bar:
+    assert_equal(n, 5 * 42 // 16)
+    # The bar is cut off by the band, so its shape is not sampled:
+    assert_equal(shapes, {(1, 1, 8)})
+
+def split(splitter, pages):
+    result = []
+    for page in pages:
+        if splitter.split_before(*page) or not result:
+            result += [0]
+        result[-1] += 1
+    return result
+
+class test_splitter:
+
+    def test_fixed(self):
+        splitter = dictionaries.Splitter(3)
+        assert_equal(split(splitter, [()] * 8), [3, 3, 2])
+
+    def test_auto_overlap(self):
+        splitter = dictionaries.Splitter(dictionaries.AUTO)
+        pages = [
+            (3, {1, 2, 3}),
+            (3, {1, 2, 4}),
+            (3, {5, 6, 7}),
+            (0, set()),
+            (3, {5, 6, 8}),
+        ]
+        assert_equal(split(splitter, pages), [2, 3])
+
+    def test_auto_max_pages(self):
+        splitter = dictionaries.Splitter(dictionaries.AUTO)
+        with interim(dictionaries, AUTO_MAX_PAGES=2):
+            assert_equal(split(splitter, [(1, {1})] * 5), [2, 2, 1])
+
+    def test_auto_max_symbols(self):
+        splitter = dictionaries.Splitter(dictionaries.AUTO)
+        with interim(dictionaries, AUTO_MAX_SYMBOLS=10):
+            assert_equal(split(splitter, [(4, {1})] * 5), [2, 2, 1])
+
+# vim:ts=4 sts=4 sw=4 et
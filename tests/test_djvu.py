@@ -16,12 +16,14 @@
 import io
 import os
 import shutil
+import struct
 
 from .tools import (
     assert_equal,
     assert_greater,
     assert_image_sizes_equal,
     assert_images_equal,
+    assert_less_equal,
     assert_raises,
 )
 
@@ -36,8 +38,10 @@ datadir = os.path.join(os.path.dirname(__file__), 'data')
 def setup_module():
     djvu.require_cli()
 
-def ddjvu(djvu_file, fmt='ppm'):
+def ddjvu(djvu_file, fmt='ppm', page=None):
     cmdline = ['ddjvu', '-1', '-format=' + fmt]
+    if page is not None:
+        cmdline += ['-page={0}'.format(page)]
     stdio = dict(
         stdout=ipc.PIPE,
         stderr=ipc.PIPE
@@ -113,6 +117,88 @@ class test_multichunk:
                 with ddjvu(tmp_djvu_path, fmt='pbm') as out_image:
                     assert_images_equal(in_image, out_image)
 
+class test_bundle_writer:
+
+    def test_no_components(self):
+        with temporary.file() as file:
+            with assert_raises(ValueError):
+                djvu.BundleWriter(file, [])
+
+    def _test(self, writer_class):
+        paths = [
+            os.path.join(datadir, name)
+            for name in ['onebit.djvu', 'ycbcr.djvu', 'onebit.djvu']
+        ]
+        with temporary.file(suffix='.djvu') as djvu_file:
+            djvu_file.write('garbage')
+            start = djvu_file.tell()
+            writer = writer_class(djvu_file, ['p1.djvu', 'p2.djvu', 'p3.djvu'])
+            for path in paths:
+                with open(path, 'rb') as file:
+                    writer.add(file)
+            with assert_raises(ValueError):
+                with open(paths[0], 'rb') as file:
+                    writer.add(file)
+            size = writer.close()
+            assert_equal(djvu_file.tell(), start + size)
+            djvu_file.seek(start)
+            with temporary.file(suffix='.djvu') as out_file:
+                shutil.copyfileobj(djvu_file, out_file)
+                out_file.flush()
+                for n, path in enumerate(paths, 1):
+                    with ddjvu(path) as in_image:
+                        with ddjvu(out_file.name, page=n) as out_image:
+                            assert_images_equal(in_image, out_image)
+
+    def test_bundle(self):
+        self._test(djvu.BundleWriter)
+
+    def test_small_reserve(self):
+        class writer_class(djvu.BundleWriter):
+            _reserve = lambda self: 0
+        self._test(writer_class)
+
+    def test_padding(self):
+        n = 100
+        component_ids = ['p{0:04}.djvu'.format(i) for i in xrange(n)]
+        with temporary.file() as djvu_file:
+            writer = djvu.BundleWriter(djvu_file, component_ids)
+            for i in xrange(n):
+                with open(os.path.join(datadir, 'onebit.djvu'), 'rb') as file:
+                    writer.add(file)
+            writer.close()
+            djvu_file.seek(20)
+            [dirm_size] = struct.unpack('>I', djvu_file.read(4))
+            compressed_size = len(writer._encode_directory(writer._sizes))
+            padding = dirm_size - 3 - 4 * n - compressed_size
+            assert_less_equal(padding, 3 * n + 16 + 1)
+
+    def test_missing_components(self):
+        with temporary.file() as djvu_file:
+            writer = djvu.BundleWriter(djvu_file, ['p1.djvu', 'p2.djvu'])
+            with open(os.path.join(datadir, 'onebit.djvu'), 'rb') as file:
+                writer.add(file)
+            with assert_raises(ValueError):
+                writer.close()
+
+    def test_not_djvu(self):
+        with temporary.file() as djvu_file:
+            writer = djvu.BundleWriter(djvu_file, ['p1.djvu'])
+            with open(os.path.join(datadir, 'onebit.bmp'), 'rb') as file:
+                with assert_raises(ValueError):
+                    writer.add(file)
+
+def test_get_page_info():
+    path = os.path.join(datadir, 'onebit.djvu')
+    page_info = djvu.get_page_info(path)
+    assert_equal((page_info.width, page_info.height), (70, 100))
+    assert_equal(page_info.chunks.keys(), ['INFO', 'Sjbz'])
+    assert_equal(page_info.chunks['INFO'], 10)
+    path = os.path.join(datadir, 'ycbcr.djvu')
+    page_info = djvu.get_page_info(path)
+    assert_equal((page_info.width, page_info.height), (128, 80))
+    assert_equal(page_info.chunks.keys(), ['INFO', 'BG44'])
+
 class test_validate_page_id:
 
     def test_empty(self):
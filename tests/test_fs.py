@@ -13,14 +13,21 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import errno
 import io
+import os
+import stat
 
 from .tools import (
     assert_equal,
+    assert_false,
+    assert_raises,
+    assert_true,
     interim,
 )
 
 from lib import fs
+from lib import temporary
 
 def test_copy_file():
     def t(s):
@@ -35,6 +42,35 @@ def test_copy_file():
     with interim(fs, _block_size=1):
         t('eggs' + 'spam' * 42)
 
+def test_copy_file_real():
+    with temporary.file() as input_file:
+        input_file.write('eggs' + 'spam' * 42)
+        input_file.flush()
+        input_file.seek(4)
+        with temporary.file() as output_file:
+            output_file.write('ham')
+            length = fs.copy_file(input_file, output_file)
+            assert_equal(length, 4 * 42)
+            assert_equal(input_file.tell(), 4 + 4 * 42)
+            assert_equal(output_file.tell(), 3 + 4 * 42)
+            output_file.write('!')
+            output_file.seek(0)
+            assert_equal(output_file.read(), 'ham' + 'spam' * 42 + '!')
+
+def test_copy_file_append():
+    with temporary.file() as input_file:
+        input_file.write('spam')
+        input_file.flush()
+        input_file.seek(0)
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            with open(path, 'ab') as output_file:
+                output_file.write('ham')
+                length = fs.copy_file(input_file, output_file)
+            assert_equal(length, 4)
+            with open(path, 'rb') as file:
+                assert_equal(file.read(), 'hamspam')
+
 def test_replace_ext():
     r = fs.replace_ext('eggs', 'spam')
     assert_equal(r, 'eggs.spam')
@@ -43,4 +79,191 @@ def test_replace_ext():
     r = fs.replace_ext('eggs.ham', 'spam')
     assert_equal(r, 'eggs.spam')
 
+class test_file_sink:
+
+    def test_ok(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            sink = fs.FileSink(path)
+            assert_equal(sink.name, path)
+            assert_true(sink.seekable)
+            assert_equal(os.listdir(tmpdir), [])
+            with sink.open() as file:
+                file.write('ham')
+                assert_false(os.path.exists(path))
+                file.seek(0)
+                assert_equal(file.read(), 'ham')
+            assert_equal(os.listdir(tmpdir), ['eggs'])
+            with open(path, 'rb') as file:
+                assert_equal(file.read(), 'ham')
+
+    def test_error(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            with open(path, 'wb') as file:
+                file.write('spam')
+            sink = fs.FileSink(path)
+            with assert_raises(ZeroDivisionError):
+                with sink.open() as file:
+                    file.write('ham')
+                    1 // 0
+            assert_equal(os.listdir(tmpdir), ['eggs'])
+            with open(path, 'rb') as file:
+                assert_equal(file.read(), 'spam')
+
+    def test_not_atomic(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            with open(path, 'wb') as file:
+                file.write('spam')
+            sink = fs.FileSink(path)
+            with sink.open(atomic=False) as file:
+                file.write('ham')
+                file.flush()
+                assert_equal(os.listdir(tmpdir), ['eggs'])
+                with open(path, 'rb') as other_file:
+                    assert_equal(other_file.read(), 'ham')
+                file.seek(0)
+                assert_equal(file.read(), 'ham')
+            with open(path, 'rb') as file:
+                assert_equal(file.read(), 'ham')
+            with assert_raises(ZeroDivisionError):
+                with sink.open(atomic=False) as file:
+                    file.write('ham')
+                    1 // 0
+            assert_equal(os.listdir(tmpdir), [])
+
+    def test_umask(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            umask = os.umask(0o027)
+            try:
+                with fs.FileSink(path).open():
+                    pass
+            finally:
+                os.umask(umask)
+            assert_equal(stat.S_IMODE(os.stat(path).st_mode), 0o640)
+
+    def test_symlink(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            target_path = os.path.join(tmpdir, 'spam')
+            with open(target_path, 'wb') as file:
+                file.write('old')
+            os.symlink('spam', path)
+            sink = fs.FileSink(path)
+            assert_true(sink.seekable)
+            with sink.open() as file:
+                file.write('ham')
+            assert_true(os.path.islink(path))
+            assert_equal(sorted(os.listdir(tmpdir)), ['eggs', 'spam'])
+            with open(target_path, 'rb') as file:
+                assert_equal(file.read(), 'ham')
+
+    def test_fifo(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            os.mkfifo(path)
+            sink = fs.FileSink(path)
+            assert_false(sink.seekable)
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            with os.fdopen(fd, 'rb') as read_file:
+                with sink.open() as file:
+                    file.write('ham')
+                assert_equal(read_file.read(), 'ham')
+            assert_true(stat.S_ISFIFO(os.lstat(path).st_mode))
+            assert_equal(os.listdir(tmpdir), ['eggs'])
+
+    def test_write_file(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            sink = fs.FileSink(path)
+            with temporary.file(dir=tmpdir) as file:
+                file.write('ham')
+                file.flush()
+                umask = os.umask(0o027)
+                try:
+                    length = sink.write_file(file)
+                finally:
+                    os.umask(umask)
+                assert_equal(length, 3)
+                assert_true(os.path.samefile(path, file.name))
+            assert_equal(os.listdir(tmpdir), ['eggs'])
+            assert_equal(stat.S_IMODE(os.stat(path).st_mode), 0o640)
+            with open(path, 'rb') as file:
+                assert_equal(file.read(), 'ham')
+
+    def test_write_file_copy(self):
+        def link(source, target):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            sink = fs.FileSink(path)
+            with temporary.file(dir=tmpdir) as file:
+                file.write('ham')
+                file.flush()
+                with interim(os, link=link):
+                    length = sink.write_file(file)
+                assert_equal(length, 3)
+                assert_false(os.path.samefile(path, file.name))
+            assert_equal(os.listdir(tmpdir), ['eggs'])
+            with open(path, 'rb') as file:
+                assert_equal(file.read(), 'ham')
+
+    def test_write_file_symlink(self):
+        with temporary.directory() as tmpdir:
+            path = os.path.join(tmpdir, 'eggs')
+            target_path = os.path.join(tmpdir, 'spam')
+            with open(target_path, 'wb') as file:
+                file.write('old')
+            os.symlink('spam', path)
+            sink = fs.FileSink(path)
+            with temporary.file(dir=tmpdir) as file:
+                file.write('ham')
+                file.flush()
+                length = sink.write_file(file)
+                assert_equal(length, 3)
+                assert_false(os.path.samefile(path, file.name))
+            assert_true(os.path.islink(path))
+            with open(target_path, 'rb') as file:
+                assert_equal(file.read(), 'ham')
+
+def test_get_umask():
+    umask = os.umask(0o027)
+    try:
+        assert_equal(fs.get_umask(), 0o027)
+        assert_equal(fs.get_umask(), 0o027)
+    finally:
+        os.umask(umask)
+
+def test_stream_sink():
+    output_file = io.BytesIO()
+    output_file.name = '<eggs>'
+    sink = fs.StreamSink(output_file)
+    assert_equal(sink.name, '<eggs>')
+    assert_false(sink.seekable)
+    with sink.open() as file:
+        file.write('ham')
+    assert_equal(output_file.getvalue(), 'ham')
+    with temporary.file() as file:
+        file.write('spam')
+        file.flush()
+        length = sink.write_file(file)
+    assert_equal(length, 4)
+    assert_equal(output_file.getvalue(), 'hamspam')
+
+def test_stream_sink_pipe():
+    [read_fd, write_fd] = os.pipe()
+    with os.fdopen(read_fd, 'rb') as read_file:
+        with os.fdopen(write_fd, 'wb') as write_file:
+            sink = fs.StreamSink(write_file)
+            with temporary.file() as file:
+                file.write('spam')
+                file.flush()
+                with sink.open() as output_file:
+                    output_file.write('ham')
+                length = sink.write_file(file)
+        assert_equal(length, 4)
+        assert_equal(read_file.read(), 'hamspam')
+
 # vim:ts=4 sts=4 sw=4 et
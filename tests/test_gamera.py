@@ -14,20 +14,29 @@
 # for more details.
 
 import glob
+import multiprocessing
 import os
+import pickle
 import re
 
 from .tools import (
+    SkipTest,
     assert_equal,
+    assert_false,
     assert_images_equal,
+    assert_in,
     assert_is_instance,
     assert_is_none,
+    assert_true,
     fork_isolation,
+    interim,
 )
 
 import PIL.Image
 
 from lib import gamera_support as gamera
+from lib import layers
+from lib import rle
 
 datadir = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -53,6 +62,63 @@ def test_load_image():
     for path in paths:
         yield t, path
 
+def test_load_image_scale():
+    @fork_isolation
+    def t(path, scale):
+        path = os.path.join(datadir, path)
+        gamera.init()
+        image = gamera.load_image(path)
+        small_image = gamera.load_image(path, scale=scale)
+        assert_is_instance(small_image, gamera.Image)
+        assert_equal(small_image.ncols, max(1, int(round(image.ncols * scale))))
+        assert_equal(small_image.nrows, max(1, int(round(image.nrows * scale))))
+    yield t, 'ycbcr-jpeg.tiff', 0.5
+    yield t, 'greyscale-packbits.tiff', 0.25
+    yield t, 'onebit.png', 0.1
+
+def test_shared_image():
+    @fork_isolation
+    def t(path):
+        path = os.path.join(datadir, path)
+        gamera.init()
+        image = gamera.load_image(path)
+        shared = gamera.to_shared(image)
+        shared = pickle.loads(pickle.dumps(shared))
+        shared_image = gamera.from_shared(shared)
+        # It's up to the caller to release the buffer:
+        assert_true(os.path.exists(shared.buffer[0]))
+        shared.release()
+        assert_false(os.path.exists(shared.buffer[0]))
+        assert_is_instance(shared_image, gamera.Image)
+        assert_equal(shared_image.data.pixel_type, image.data.pixel_type)
+        assert_equal(shared_image.dim, image.dim)
+        assert_equal(shared_image.dpi, image.dpi)
+        assert_images_equal(gamera.to_pil_rgb(shared_image), gamera.to_pil_rgb(image))
+    yield t, 'ycbcr-jpeg.tiff'
+    yield t, 'greyscale-packbits.tiff'
+    yield t, 'onebit.png'
+
+def _shared_image_size(shared):
+    gamera.init()
+    image = gamera.from_shared(shared)
+    return image.dim
+
+@fork_isolation
+def test_shared_image_readers():
+    # Several processes can read the same shared image,
+    # like the variants in separate --preview do:
+    gamera.init()
+    image = gamera.load_image(os.path.join(datadir, 'ycbcr-jpeg.tiff'))
+    shared = gamera.to_shared(image)
+    pool = multiprocessing.Pool(2)
+    try:
+        sizes = pool.map(_shared_image_size, [shared] * 3)
+    finally:
+        pool.terminate()
+        pool.join()
+        shared.release()
+    assert_equal(sizes, [image.dim] * 3)
+
 class test_methods:
 
     @fork_isolation
@@ -83,6 +149,95 @@ class test_methods:
         for x in self._test_methods('greyscale-packbits.tiff'):
             yield x
 
+class test_numpy_methods:
+
+    @fork_isolation
+    def _test(self, path, method, args):
+        if not layers.import_numpy():
+            raise SkipTest('NumPy is not available')  # no coverage
+        path = os.path.join(datadir, path)
+        gamera.init()
+        image = gamera.load_image(path)
+        method = gamera.methods[method]
+        assert_is_instance(method, gamera.NumpyPlugin)
+        numpy_mask = layers.bitmap_from_numpy(method.binarize_numpy(image, **args))
+        gamera_mask = gamera.to_bitmap(gamera.Plugin.__call__(method, image, **args))
+        assert_equal(numpy_mask, gamera_mask)
+        # Whichever implementation is chosen, the results are the same:
+        with interim(method, benchmark_size=8):
+            assert_equal(method.binarize(image, **args), gamera_mask)
+            assert_equal(gamera.to_bitmap(method(image, **args)), gamera_mask)
+
+    def test_equivalence(self):
+        for path in 'ycbcr-jpeg.tiff', 'greyscale-packbits.tiff', 'onebit.png':
+            yield self._test, path, 'global', dict(threshold=42)
+            yield self._test, path, 'otsu', {}
+            for method in 'niblack', 'sauvola':
+                yield self._test, path, method, {}
+                yield self._test, path, method, {'region-size': 41, 'lower-bound': 0, 'upper-bound': 255}
+            yield self._test, path, 'bernsen', {}
+            yield self._test, path, 'bernsen', {'region-size': 1}
+            yield self._test, path, 'bernsen', {'region-size': 50, 'contrast-limit': 20, 'doubt-to-black': True}
+
+class test_auto_method:
+
+    @fork_isolation
+    def _test(self, path, **params):
+        path = os.path.join(datadir, path)
+        gamera.init()
+        image = gamera.load_image(path)
+        auto = gamera.methods['auto']
+        method = auto.choose(image, **params)
+        assert_in(method, auto.methods)
+
+    def test_choose(self):
+        yield self._test, 'greyscale-packbits.tiff'
+        yield self._test, 'ycbcr-jpeg.tiff', dict(scale=1.0)
+
+    @fork_isolation
+    def test_pool(self):
+        gamera.init()
+        image = gamera.load_image(os.path.join(datadir, 'ycbcr-jpeg.tiff'))
+        auto = gamera.methods['auto']
+        assert_equal(
+            auto._score_in_pool(image, False, 2),
+            auto._score_sequentially(image, False),
+        )
+
+    def test_score(self):
+        auto = gamera.methods['auto']
+        blank = rle.Bitmap(10, 10)
+        assert_equal(auto.score(blank), (1, 0))
+        bitmap = rle.Bitmap(10, 10, [[(1, 3), (5, 7)]] + [[] for i in range(9)])
+        assert_equal(auto.score(bitmap), (0, 2))
+
+class test_is_bitonal:
+
+    @fork_isolation
+    def _test(self, path, expected, greyscale=False):
+        path = os.path.join(datadir, path)
+        gamera.init()
+        image = gamera.load_image(path)
+        if greyscale:
+            image = image.to_greyscale()
+        mask = gamera.to_bitmap(image)
+        assert_equal(gamera.is_bitonal(image, mask), expected)
+        if expected:
+            mask.rows[0] = [] if mask.rows[0] else [(0, 1)]
+            assert_false(gamera.is_bitonal(image, mask))
+
+    def test_mono(self):
+        self._test('onebit.png', True)
+
+    def test_mono_grey(self):
+        self._test('onebit.png', True, greyscale=True)
+
+    def test_grey(self):
+        self._test('greyscale.pgm', False)
+
+    def test_color(self):
+        self._test('ycbcr-jpeg.tiff', False)
+
 class test_to_pil_rgb:
 
     @fork_isolation
@@ -96,6 +251,9 @@ class test_to_pil_rgb:
             gamera_image = gamera.load_image(path)
             with gamera.to_pil_rgb(gamera_image) as out_image:
                 assert_images_equal(in_image, out_image)
+            buffer = gamera.to_rgb_buffer(gamera_image)
+            with gamera.to_pil_rgb(gamera_image, buffer) as out_image:
+                assert_images_equal(in_image, out_image)
 
     def test_color(self):
         self._test('ycbcr-jpeg.tiff')
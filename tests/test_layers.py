@@ -0,0 +1,209 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+import random
+
+from .tools import (
+    SkipTest,
+    assert_equal,
+    assert_false,
+    assert_is_none,
+    assert_less_equal,
+    assert_true,
+    fork_isolation,
+    interim,
+)
+
+import PIL.Image
+import PIL.ImageChops
+import PIL.ImageStat
+
+from lib import layers
+from lib import rle
+
+datadir = os.path.join(os.path.dirname(__file__), 'data')
+
+def setup_module():
+    if not layers.import_numpy():
+        raise SkipTest('NumPy is not available')  # no coverage
+
+class test_uniform_color:
+
+    def test_uniform(self):
+        image = PIL.Image.new('RGB', (5, 5), (0x12, 0x34, 0x56))
+        mask = PIL.Image.new('L', (5, 5), 0xFF)
+        color = layers.uniform_color(image, mask, default=layers.WHITE)
+        assert_equal(color, (0x12, 0x34, 0x56))
+
+    def test_nonuniform(self):
+        image = PIL.Image.new('RGB', (5, 5), layers.WHITE)
+        image.putpixel((2, 2), layers.BLACK)
+        mask = PIL.Image.new('L', (5, 5), 0xFF)
+        color = layers.uniform_color(image, mask, default=layers.WHITE)
+        assert_is_none(color)
+
+    def test_masked_out(self):
+        image = PIL.Image.new('RGB', (5, 5), layers.WHITE)
+        image.putpixel((2, 2), layers.BLACK)
+        mask = PIL.Image.new('L', (5, 5), 0xFF)
+        mask.putpixel((2, 2), 0)
+        color = layers.uniform_color(image, mask, default=layers.BLACK)
+        assert_equal(color, layers.WHITE)
+
+    def test_all_masked_out(self):
+        image = PIL.Image.new('RGB', (5, 5), (0x12, 0x34, 0x56))
+        mask = PIL.Image.new('L', (5, 5), 0)
+        color = layers.uniform_color(image, mask, default=layers.BLACK)
+        assert_equal(color, layers.BLACK)
+
+def test_colors_close():
+    assert_true(layers.colors_close(layers.WHITE, (0xFE, 0xFF, 0xFD)))
+    assert_false(layers.colors_close(layers.WHITE, (0xFF, 0xF0, 0xFF)))
+
+def test_color_to_html():
+    assert_equal(layers.color_to_html((0x12, 0x34, 0xAB)), '#1234AB')
+
+def random_bitmap(width, height, density=0.5):
+    data = str.join('', (
+        '\0' if random.random() < density else '\xFF'
+        for i in xrange(width * height)
+    ))
+    return rle.Bitmap.from_bytes(data, width, height)
+
+def without_numpy():
+    return interim(layers, import_numpy=lambda: False)
+
+class test_bitmap_numpy:
+
+    def test_roundtrip(self):
+        for width, height in (1, 1), (7, 5), (31, 17):
+            for density in 0.0, 0.3, 0.7, 1.0:
+                bitmap = random_bitmap(width, height, density)
+                black = layers.bitmap_to_numpy(bitmap)
+                assert_equal(black.shape, (height, width))
+                assert_equal(black.dtype, bool)
+                assert_equal(black.tolist(), [
+                    [c == '\0' for c in bitmap.to_bytes()[y * width:(y + 1) * width]]
+                    for y in xrange(height)
+                ])
+                assert_equal(layers.bitmap_from_numpy(black), bitmap)
+
+class test_subsample_fg:
+
+    def test_numpy(self):
+        for width, height in (7, 5), (31, 17), (24, 24):
+            data = str(bytearray(random.randrange(0x100) for i in xrange(3 * width * height)))
+            mask = random_bitmap(width, height, 0.8)
+            for ratio in 1, 2, 3, 4, 12:
+                [image, smask] = layers.subsample_fg(data, width, height, mask, ratio)
+                with without_numpy():
+                    [ref_image, ref_smask] = layers.subsample_fg(data, width, height, mask, ratio)
+                assert_equal(smask, ref_smask)
+                assert_equal(list(image.getdata()), list(ref_image.getdata()))
+
+    def test_subsample(self):
+        mask = rle.Bitmap(4, 3, [
+            [(0, 4)],
+            [(0, 4)],
+            [],
+        ])
+        data = bytearray(3 * 4 * 3)
+        for i in xrange(0, len(data), 3):
+            data[i] = i
+        data = str(data)
+        image, smask = layers.subsample_fg(data, 4, 3, mask, 2)
+        assert_equal(image.size, (2, 2))
+        # Only the pixels of the eroded mask are taken into account:
+        assert_equal(smask.rows, [
+            [],
+            [(0, 2)],
+        ])
+        assert_equal(image.getpixel((0, 0)), (2, 0, 0))
+        assert_equal(image.getpixel((1, 0)), (8, 0, 0))
+
+class test_subsample_bg:
+
+    def test_mask(self):
+        mask = rle.Bitmap(20, 20, [[(0, 10)]] * 20)
+        smask = layers.subsample_bg_mask(mask, 2)
+        assert_equal(smask.width, 10)
+        assert_equal(smask.height, 10)
+        assert_equal(smask.rows, [[(0, 3)]] * 10)
+
+    def test_mask_numpy(self):
+        for width, height in (7, 5), (31, 17), (24, 24):
+            mask = random_bitmap(width, height, 0.3)
+            for ratio in 1, 2, 3, 4, 12:
+                smask = layers.subsample_bg_mask(mask, ratio)
+                with without_numpy():
+                    ref_smask = layers.subsample_bg_mask(mask, ratio)
+                assert_equal(smask, ref_smask)
+
+    def test_size(self):
+        image = PIL.Image.new('RGB', (11, 10))
+        for ratio in 1, 2, 3, 4, 5, 10, 12:
+            simage = layers.subsample_bg_image(image, ratio)
+            size = layers.get_subsampled_size(11, 10, ratio)
+            assert_equal(simage.size, size)
+
+    def test_average(self):
+        numpy = layers.numpy
+        data = numpy.zeros((4, 5, 3), dtype=numpy.uint8)
+        data[:, ::2] = 0xFF
+        image = PIL.Image.fromarray(data, 'RGB')
+        simage = layers.subsample_bg_image(image, 2)
+        assert_equal(list(simage.getdata()), ([(0x80, 0x80, 0x80)] * 2 + [(0xFF, 0xFF, 0xFF)]) * 2)
+
+    def test_blocks(self):
+        numpy = layers.numpy
+        data = numpy.random.randint(0, 0x100, size=(23, 37, 3)).astype(numpy.uint8)
+        image = PIL.Image.fromarray(data, 'RGB')
+        for ratio in 1, 2, 3, 4, 12:
+            simage = numpy.asarray(layers.subsample_bg_image(image, ratio), dtype=int)
+            for sy in xrange(simage.shape[0]):
+                for sx in xrange(simage.shape[1]):
+                    block = data[sy * ratio:(sy + 1) * ratio, sx * ratio:(sx + 1) * ratio]
+                    expected = block.reshape((-1, 3)).mean(axis=0)
+                    assert_less_equal(abs(simage[sy, sx] - expected).max(), 1)
+
+    @fork_isolation
+    def _test_gamera(self, path):
+        try:
+            from lib import gamera_support as gamera
+        except ImportError as exc:  # no coverage
+            raise SkipTest(exc)
+        path = os.path.join(datadir, path)
+        gamera.init()
+        image = gamera.load_image(path)
+        mask = gamera.methods['djvu'](image)
+        size = layers.get_subsampled_size(image.ncols, image.nrows, 3)
+        dim = gamera.Dim(*size)
+        gamera_mask = mask.to_greyscale().resize(dim, 0)
+        gamera_mask = gamera_mask.dilate().dilate().threshold(254)
+        gamera_mask = gamera.to_bitmap(gamera_mask)
+        rle_mask = layers.subsample_bg_mask(gamera.to_bitmap(mask), 3)
+        assert_equal(gamera_mask, rle_mask)
+        gamera_image = gamera.to_pil_rgb(image.resize(dim, 1))
+        pil_image = layers.subsample_bg_image(gamera.to_pil_rgb(image), 3)
+        assert_equal(gamera_image.size, pil_image.size)
+        diff = PIL.ImageChops.difference(gamera_image, pil_image)
+        for mean in PIL.ImageStat.Stat(diff).mean:
+            assert_less_equal(mean, 8)
+
+    def test_gamera(self):
+        self._test_gamera('ycbcr-jpeg.tiff')
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,150 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+
+from .tools import (
+    assert_equal,
+    assert_is,
+    assert_is_none,
+    assert_raises,
+    assert_regex,
+)
+
+from lib import manifest
+from lib import utils
+
+class MockArg(object):
+    def __init__(self, name, type, default=None):
+        self.name = name
+        self.type = type
+        self.min = self.max = None
+        self.has_default = default is not None
+        self.default = default
+
+class MockMethod(object):
+    def __init__(self, *args):
+        self.args = dict((arg.name, arg) for arg in args)
+
+methods = dict(
+    djvu=MockMethod(),
+    sauvola=MockMethod(
+        MockArg('window-size', int, 15),
+        MockArg('k', float, 0.5),
+    ),
+    otsu=MockMethod(
+        MockArg('bins', int),
+    ),
+)
+
+def parse_line(line):
+    return manifest.parse_line(line, methods, methods['djvu'])
+
+def test_blank():
+    assert_is_none(parse_line(''))
+    assert_is_none(parse_line('\n'))
+    assert_is_none(parse_line('# eggs.png\n'))
+
+def test_tsv():
+    page = parse_line('eggs.png\n')
+    assert_equal(page.image, 'eggs.png')
+    assert_is_none(page.mask)
+    assert_is_none(page.page_id)
+    assert_is_none(page.dpi)
+    assert_is_none(page.method)
+    assert_is_none(page.params)
+    page = parse_line('eggs.png\tham.pbm\tspam.djvu\t300\tsauvola\tk=0.25 window-size=31\n')
+    assert_equal(page.image, 'eggs.png')
+    assert_equal(page.mask, 'ham.pbm')
+    assert_equal(page.page_id, 'spam.djvu')
+    assert_equal(page.dpi, 300)
+    assert_is(page.method, methods['sauvola'])
+    assert_equal(page.params, {'k': 0.25, 'window-size': 31})
+    page = parse_line('eggs.png\t\t\t\tsauvola\n')
+    assert_is_none(page.mask)
+    assert_is(page.method, methods['sauvola'])
+    assert_equal(page.params, {})
+    with assert_raises(ValueError):
+        parse_line('eggs.png\t\t\t\t\t\tham\n')
+
+def test_json():
+    page = parse_line('{"image": "eggs.png"}\n')
+    assert_equal(page.image, 'eggs.png')
+    assert_is(type(page.image), str)
+    assert_is_none(page.mask)
+    page = parse_line('{"image": "eggs.png", "mask": "ham.pbm", "page-id": "spam.djvu", "dpi": 600}')
+    assert_equal(page.mask, 'ham.pbm')
+    assert_equal(page.page_id, 'spam.djvu')
+    assert_equal(page.dpi, 600)
+    page = parse_line('{"image": "eggs.png", "method": "sauvola", "params": {"k": 0.25}}')
+    assert_is(page.method, methods['sauvola'])
+    assert_equal(page.params, {'k': 0.25})
+    page = parse_line('{"image": "eggs.png", "method": "otsu", "params": ["37"]}')
+    assert_is(page.method, methods['otsu'])
+    assert_equal(page.params, {'bins': 37})
+
+def test_errors():
+    def t(line, regex):
+        with assert_raises(ValueError) as ecm:
+            parse_line(line)
+        assert_regex(str(ecm.exception), regex)
+    t('{"image": "eggs.png", "ham": 42}', r"\Aunknown key u'ham'\Z")
+    t('{"image": "eggs.png"', r'\AExpecting')
+    t('{"mask": "ham.pbm"}', r'\Amissing image\Z')
+    t('\tham.pbm', r'\Amissing image\Z')
+    t('eggs.png\t\t\t-1', r'\Ainvalid DPI value')
+    t('eggs.png\t\t\tham', r'\Ainvalid DPI value')
+    t('eggs.png\t\t\t\tham', r"\Ainvalid method: 'ham'\Z")
+    t('eggs.png\t\t\t\totsu', r'\Aparameter bins is not set\Z')
+    t('eggs.png\t\t\t\t\tham=42', r"\Ainvalid parameter name 'ham'\Z")
+    t('{"image": "eggs.png", "params": 42}', r'\Ainvalid parameters')
+
+def test_read():
+    file = io.BytesIO(
+        '# image\tmask\n'
+        'eggs.png\n'
+        '\n'
+        'ham.png\tham.pbm\n'
+    )
+    pages = list(manifest.read(file, methods, methods['djvu']))
+    assert_equal([page.image for page in pages], ['eggs.png', 'ham.png'])
+    assert_equal([page.mask for page in pages], [None, 'ham.pbm'])
+    file = io.BytesIO(
+        'eggs.png\n'
+        'ham.png\t\t\teggs\n'
+    )
+    file.name = 'spam.tsv'
+    pages = manifest.read(file, methods, methods['djvu'])
+    next(pages)
+    with assert_raises(ValueError) as ecm:
+        next(pages)
+    assert_regex(str(ecm.exception), r'\Aspam\.tsv:2: invalid DPI value')
+
+def test_get_options():
+    options = utils.namespace()
+    options.dpi = 300
+    options.method = methods['djvu']
+    options.params = {}
+    page = manifest.Page('eggs.png')
+    assert_is(page.get_options(options), options)
+    page = manifest.Page('eggs.png', dpi=600, method=methods['otsu'], params={'bins': 37})
+    page_options = page.get_options(options)
+    assert_equal(page_options.dpi, 600)
+    assert_is(page_options.method, methods['otsu'])
+    assert_equal(page_options.params, {'bins': 37})
+    assert_equal(options.dpi, 300)
+    assert_is(options.method, methods['djvu'])
+
+# vim:ts=4 sts=4 sw=4 et
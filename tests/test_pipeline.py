@@ -0,0 +1,176 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+import logging
+import multiprocessing
+import random
+import threading
+import time
+
+from .tools import (
+    assert_equal,
+    assert_false,
+    assert_is_none,
+    assert_less_equal,
+    assert_raises,
+)
+
+from lib import pipeline
+
+def sleepy(x):
+    time.sleep(random.random() * 0.002)
+    return x
+
+def slow_double(x):
+    time.sleep(0.05)
+    return 2 * x
+
+class test_run:
+
+    def test_order(self):
+        stages = [
+            pipeline.Stage('a', sleepy, workers=3),
+            pipeline.Stage('b', lambda x: 2 * x, workers=2),
+            pipeline.Stage('c', sleepy, workers=4, queue_size=1),
+        ]
+        result = list(pipeline.run(xrange(50), stages))
+        assert_equal(result, [2 * x for x in xrange(50)])
+        for stage in stages:
+            assert_equal(stage.n_items, 50)
+            assert_less_equal(stage.max_depth, stage.queue_size)
+
+    def test_empty(self):
+        assert_equal(list(pipeline.run([], [pipeline.Stage('a', sleepy)])), [])
+
+    def test_no_stages(self):
+        with assert_raises(ValueError):
+            list(pipeline.run([1], []))
+
+    def test_backpressure(self):
+        lock = threading.Lock()
+        fed = []
+        def items():
+            for x in xrange(100):
+                with lock:
+                    fed.append(x)
+                yield x
+        stage = pipeline.Stage('a', sleepy, workers=2, queue_size=3)
+        results = pipeline.run(items(), [stage])
+        assert_equal(next(results), 0)
+        time.sleep(0.05)
+        # Only so many items can be in flight:
+        assert_less_equal(len(fed), stage.workers + stage.queue_size + 1)
+        assert_equal(list(results), range(1, 100))
+
+    def test_stage_error(self):
+        def f(x):
+            if x == 7:
+                raise ZeroDivisionError
+            return x
+        results = pipeline.run(xrange(20), [pipeline.Stage('a', f, workers=3)])
+        for x in xrange(7):
+            assert_equal(next(results), x)
+        with assert_raises(ZeroDivisionError):
+            next(results)
+
+    def test_items_error(self):
+        def items():
+            yield 1
+            yield 2
+            raise KeyError
+        results = pipeline.run(items(), [pipeline.Stage('a', sleepy)])
+        assert_equal(next(results), 1)
+        assert_equal(next(results), 2)
+        with assert_raises(KeyError):
+            next(results)
+
+    def test_close(self):
+        n_threads = threading.active_count()
+        results = pipeline.run(xrange(1000), [pipeline.Stage('a', sleepy, workers=2)])
+        assert_equal(next(results), 0)
+        results.close()
+        assert_equal(threading.active_count(), n_threads)
+
+    def test_label(self):
+        def f(x):
+            return (x, pipeline.get_label())
+        stages = [pipeline.Stage('a', sleepy), pipeline.Stage('b', f, workers=2)]
+        result = list(pipeline.run(xrange(5), stages, label=str))
+        assert_equal(result, [(x, str(x)) for x in xrange(5)])
+        assert_is_none(pipeline.get_label())
+
+class test_apply:
+
+    def setup(self):
+        self.pool = multiprocessing.Pool(2)
+
+    def teardown(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def test_result(self):
+        assert_equal(pipeline.apply(self.pool, slow_double, (21,)), 42)
+
+    def test_consumer_error(self):
+        pool = self.pool
+        def f(x):
+            return pipeline.apply(pool, slow_double, (x,))
+        def consume():
+            jobs = pipeline.run(xrange(100), [pipeline.Stage('a', f, workers=2)])
+            try:
+                for x in jobs:
+                    if x > 0:
+                        raise IOError
+            except IOError:
+                # The stage threads may be waiting for the pool,
+                # which won't ever return their results:
+                pool.terminate()
+            jobs.close()
+        thread = threading.Thread(target=consume)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        assert_false(thread.is_alive())
+
+def test_stage():
+    with assert_raises(ValueError):
+        pipeline.Stage('a', sleepy, workers=0)
+    with assert_raises(ValueError):
+        pipeline.Stage('a', sleepy, queue_size=0)
+    stage = pipeline.Stage('a', sleepy, workers=2)
+    assert_equal(stage.queue_size, 4)
+    assert_equal(stage.mean_depth, 0.0)
+    assert_equal(
+        stage.format_metrics(),
+        'a: 2 worker(s), 0 item(s), 0.00 s busy, queue depth: 0.0 mean, 0 max (of 4)'
+    )
+
+def test_label_filter():
+    stream = io.BytesIO()
+    logger = logging.getLogger('didjvu.test-pipeline')
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(label)s%(message)s'))
+    handler.addFilter(pipeline.LabelFilter())
+    logger.addHandler(handler)
+    try:
+        logger.warning('eggs')
+        with pipeline.labelled('spam.png'):
+            logger.warning('ham')
+    finally:
+        logger.removeHandler(handler)
+    assert_equal(stream.getvalue(), 'eggs\nspam.png: ham\n')
+
+# vim:ts=4 sts=4 sw=4 et
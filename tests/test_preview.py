@@ -0,0 +1,71 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+from .tools import (
+    assert_equal,
+    assert_raises,
+)
+
+from lib import preview
+from lib import rle
+
+class MockArg(object):
+    def __init__(self, name, has_default):
+        self.name = name
+        self.has_default = has_default
+
+class MockMethod(object):
+    def __init__(self, name, *args):
+        self.name = name
+        self.args = dict((arg.name, arg) for arg in args)
+
+def test_variant_label():
+    method = MockMethod('sauvola')
+    variant = preview.Variant(method, {})
+    assert_equal(variant.label, 'sauvola')
+    variant = preview.Variant(method, {'window-size': 31, 'k': 0.25})
+    assert_equal(variant.label, 'sauvola k=0.25 window-size=31')
+
+def test_get_default_variants():
+    methods = dict(
+        auto=MockMethod('auto'),
+        djvu=MockMethod('djvu'),
+        sauvola=MockMethod('sauvola', MockArg('k', True)),
+        otsu=MockMethod('otsu', MockArg('bins', False)),
+    )
+    variants = preview.get_default_variants(methods)
+    assert_equal([v.method.name for v in variants], ['djvu', 'sauvola'])
+    assert_equal([v.params for v in variants], [{}, {}])
+
+def test_contact_sheet():
+    masks = [
+        rle.Bitmap(10, 3, [[(0, 3)], [], [(2, 10)]]),
+        rle.Bitmap(7, 2, [[], [(1, 7)]]),
+        rle.Bitmap(5, 5),
+    ]
+    sheet = preview.contact_sheet(masks, ['eggs', 'ham', 'spam'])
+    assert_equal(sheet.mode, 'L')
+    tile_width = 10 + preview._padding
+    tile_height = 5 + preview._label_height + preview._padding
+    assert_equal(sheet.size, (2 * tile_width + preview._padding, 2 * tile_height + preview._padding))
+    x = y = preview._padding
+    assert_equal(sheet.getpixel((x, y)), 0)
+    assert_equal(sheet.getpixel((x + 3, y)), 0xFF)
+    with assert_raises(ValueError):
+        preview.contact_sheet(masks, ['eggs'])
+    with assert_raises(ValueError):
+        preview.contact_sheet([], [])
+
+# vim:ts=4 sts=4 sw=4 et
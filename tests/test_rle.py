@@ -0,0 +1,308 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+import os
+import pickle
+
+from .tools import (
+    assert_equal,
+    assert_false,
+    assert_images_equal,
+    assert_raises,
+    assert_true,
+)
+
+import PIL.Image
+
+from lib import rle
+from lib import temporary
+
+datadir = os.path.join(os.path.dirname(__file__), 'data')
+
+def test_guess_format():
+    assert_equal(rle.guess_format('eggs.pbm'), 'pbm')
+    assert_equal(rle.guess_format('eggs.PNG'), 'png')
+    assert_equal(rle.guess_format('eggs.tif'), 'tiff-g4')
+    assert_equal(rle.guess_format('eggs.tiff'), 'tiff-g4')
+    assert_equal(rle.guess_format('eggs.jpeg'), 'png')
+    assert_equal(rle.guess_format('<stdout>', default='pbm'), 'pbm')
+
+class test_multipage_writer:
+
+    bitmaps = [
+        rle.Bitmap(10, 3, [[(0, 3)], [], [(2, 10)]]),
+        rle.Bitmap(7, 2, [[], [(1, 7)]]),
+    ]
+
+    def test_pbm(self):
+        file = io.BytesIO()
+        with rle.MultipageWriter(file, 'pbm') as writer:
+            for bitmap in self.bitmaps:
+                writer.add(bitmap)
+        assert_equal(
+            file.getvalue(),
+            str.join('', (bitmap.to_pbm() for bitmap in self.bitmaps))
+        )
+
+    def test_tiff(self):
+        file = io.BytesIO()
+        with rle.MultipageWriter(file, 'tiff-g4') as writer:
+            for bitmap in self.bitmaps:
+                writer.add(bitmap)
+        file.seek(0)
+        with PIL.Image.open(file) as image:
+            assert_equal(image.n_frames, len(self.bitmaps))
+            for n, bitmap in enumerate(self.bitmaps):
+                image.seek(n)
+                assert_equal(image.info['compression'], 'group4')
+                assert_equal(rle.Bitmap.from_pil(image), bitmap)
+
+    def test_png(self):
+        with assert_raises(ValueError):
+            rle.MultipageWriter(io.BytesIO(), 'png')
+
+def parse_bitmap(s):
+    lines = s.split()
+    data = str.join('', lines)
+    data = data.replace('#', '\0').replace('.', '\xFF')
+    return rle.Bitmap.from_bytes(data, len(lines[0]), len(lines))
+
+class test_bitmap:
+
+    def test_from_bytes(self):
+        bitmap = parse_bitmap('''
+            #..##
+            .....
+            #####
+        ''')
+        assert_equal(bitmap.width, 5)
+        assert_equal(bitmap.height, 3)
+        assert_equal(bitmap.rows, [
+            [(0, 1), (3, 5)],
+            [],
+            [(0, 5)],
+        ])
+
+    def test_bad_size(self):
+        with assert_raises(ValueError):
+            rle.Bitmap.from_bytes('\0' * 5, 2, 2)
+        with assert_raises(ValueError):
+            rle.Bitmap(2, 2, [[]])
+
+    def test_from_pil(self):
+        path = os.path.join(datadir, 'onebit.png')
+        with PIL.Image.open(path) as image:
+            bitmap = rle.Bitmap.from_pil(image)
+            [width, height] = image.size
+            assert_equal(bitmap.width, width)
+            assert_equal(bitmap.height, height)
+            n_black = sum(end - start for row in bitmap.rows for start, end in row)
+            assert_equal(n_black, image.convert('L').histogram()[0])
+
+    def test_to_bytes(self):
+        bitmap = parse_bitmap('''
+            #..##
+            .....
+            .###.
+        ''')
+        assert_equal(bitmap.to_bytes(), '\0\xFF\xFF\0\0' + '\xFF' * 5 + '\xFF\0\0\0\xFF')
+
+    def test_to_pbm(self):
+        bitmap = parse_bitmap('''
+            #.........
+            .........#
+        ''')
+        assert_equal(bitmap.to_pbm(), 'P4\n10 2\n\x80\x00\x00\x40')
+        bitmap = rle.Bitmap(0, 2)
+        assert_equal(bitmap.to_pbm(), 'P4\n0 2\n')
+
+    def test_to_pbm_pil(self):
+        for width in xrange(1, 20):
+            data = str.join('', ('\0' if (x * x + 3 * x) % 7 < 3 else '\xFF' for x in xrange(width * 3)))
+            bitmap = rle.Bitmap.from_bytes(data, width, 3)
+            file = io.BytesIO(bitmap.to_pbm())
+            with PIL.Image.open(file) as image:
+                assert_equal(image.size, (width, 3))
+                assert_equal(image.convert('L').tobytes(), bitmap.to_bytes())
+
+    def test_save(self):
+        path = os.path.join(datadir, 'onebit.png')
+        with PIL.Image.open(path) as image:
+            bitmap = rle.Bitmap.from_pil(image)
+            with temporary.file(suffix='.pbm') as file:
+                bitmap.save(file.name)
+                with PIL.Image.open(file.name) as pbm_image:
+                    assert_images_equal(image.convert('1'), pbm_image)
+
+    def test_write(self):
+        path = os.path.join(datadir, 'onebit.png')
+        with PIL.Image.open(path) as image:
+            bitmap = rle.Bitmap.from_pil(image)
+            for format in rle.FORMATS:
+                file = io.BytesIO()
+                bitmap.write(file, format)
+                file.seek(0)
+                with PIL.Image.open(file) as out_image:
+                    assert_images_equal(image.convert('1'), out_image.convert('1'))
+            with assert_raises(ValueError):
+                bitmap.write(io.BytesIO(), 'eggs')
+
+    def test_load(self):
+        path = os.path.join(datadir, 'onebit.png')
+        with PIL.Image.open(path) as image:
+            bitmap = rle.Bitmap.from_pil(image)
+        with temporary.file(suffix='.pbm') as file:
+            bitmap.save(file.name)
+            loaded_bitmap = rle.Bitmap.load(file.name)
+        assert_equal(loaded_bitmap, bitmap)
+
+    def test_eq(self):
+        bitmap1 = parse_bitmap('#. .#')
+        bitmap2 = parse_bitmap('#. .#')
+        bitmap3 = parse_bitmap('#. ##')
+        assert_true(bitmap1 == bitmap2)
+        assert_false(bitmap1 != bitmap2)
+        assert_false(bitmap1 == bitmap3)
+        assert_true(bitmap1 != bitmap3)
+
+    def test_dilate(self):
+        bitmap = parse_bitmap('''
+            ......
+            ......
+            ....#.
+            #.....
+        ''')
+        assert_equal(bitmap.dilate().rows, parse_bitmap('''
+            ......
+            ...###
+            ##.###
+            ##.###
+        ''').rows)
+
+    def test_erode(self):
+        bitmap = parse_bitmap('''
+            #####.
+            #####.
+            ####..
+            #.....
+        ''')
+        assert_equal(bitmap.erode().rows, parse_bitmap('''
+            ####..
+            ###...
+            ......
+            ......
+        ''').rows)
+
+    def test_resample(self):
+        bitmap = parse_bitmap('''
+            ##....
+            ##....
+            ....##
+            ....##
+        ''')
+        assert_equal(bitmap.resample(3, 2).rows, parse_bitmap('''
+            #..
+            ..#
+        ''').rows)
+
+    def test_n_black(self):
+        bitmap = parse_bitmap('''
+            #..##
+            .....
+            .###.
+        ''')
+        assert_equal(bitmap.n_black(), 6)
+
+    def test_shared(self):
+        bitmap = parse_bitmap('''
+            #..##
+            .....
+            .###.
+            #.#.#
+        ''')
+        shared = bitmap.to_shared()
+        shared = pickle.loads(pickle.dumps(shared))
+        assert_true(os.path.exists(shared.buffer[0]))
+        assert_equal(rle.Bitmap.from_shared(shared), bitmap)
+        assert_false(os.path.exists(shared.buffer[0]))
+
+    def test_shared_empty(self):
+        bitmap = rle.Bitmap(3, 0)
+        assert_equal(rle.Bitmap.from_shared(bitmap.to_shared()), bitmap)
+
+class test_connected_components:
+
+    def t(self, s, n):
+        bitmap = parse_bitmap(s)
+        assert_equal(bitmap.count_connected_components(), n)
+        assert_equal(len(bitmap.connected_components()), n)
+
+    def test_empty(self):
+        self.t('''
+            ....
+            ....
+        ''', 0)
+
+    def test_separate(self):
+        self.t('''
+            #.#.
+            ....
+            ##.#
+        ''', 4)
+
+    def test_diagonal(self):
+        self.t('''
+            #...
+            .#..
+            ..#.
+            #..#
+        ''', 2)
+
+    def test_u_shape(self):
+        self.t('''
+            #.#.#
+            #.#.#
+            #####
+        ''', 1)
+
+    def test_spiral(self):
+        self.t('''
+            #######
+            #.....#
+            #.###.#
+            #.#.#.#
+            #...#.#
+            #####.#
+        ''', 1)
+
+    def test_bounding_boxes(self):
+        bitmap = parse_bitmap('''
+            #.....
+            .#..##
+            ....#.
+        ''')
+        assert_equal(sorted(bitmap.connected_components()), [
+            (0, 0, 2, 2, 2),
+            (4, 1, 6, 3, 3),
+        ])
+
+    def test_bridge(self):
+        self.t('''
+            #.#.#.#
+            .#...#.
+        ''', 2)
+
+# vim:ts=4 sts=4 sw=4 et
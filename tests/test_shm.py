@@ -0,0 +1,69 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import multiprocessing
+import os
+
+from .tools import (
+    assert_equal,
+    assert_false,
+    assert_true,
+)
+
+from lib import shm
+
+def fill(handle, data):
+    with shm.Buffer.attach(handle) as buffer:
+        buffer.data.write(data)
+
+class test_buffer:
+
+    def test_create(self):
+        buffer = shm.Buffer.create(5)
+        try:
+            with buffer:
+                assert_equal(buffer.read(), '\0' * 5)
+            assert_true(os.path.exists(buffer.path))
+            assert_equal(os.path.dirname(buffer.path), shm.get_directory())
+        finally:
+            buffer.unlink()
+        assert_false(os.path.exists(buffer.path))
+
+    def test_empty(self):
+        with shm.Buffer.create(0) as buffer:
+            assert_equal(buffer.read(), '')
+        with shm.Buffer.attach(buffer.handle) as buffer:
+            assert_equal(buffer.read(), '')
+        buffer.unlink()
+
+    def test_other_process(self):
+        with shm.Buffer.create(5) as buffer:
+            pass
+        process = multiprocessing.Process(target=fill, args=(buffer.handle, 'eggs!'))
+        process.start()
+        process.join()
+        assert_equal(process.exitcode, 0)
+        with shm.Buffer.attach(buffer.handle) as buffer:
+            assert_equal(buffer.read(), 'eggs!')
+        buffer.unlink()
+
+def test_release():
+    with shm.Buffer.create(5) as buffer:
+        pass
+    shm.release(buffer.handle)
+    assert_false(os.path.exists(buffer.path))
+    shm.release(buffer.handle)
+
+# vim:ts=4 sts=4 sw=4 et
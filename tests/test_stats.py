@@ -0,0 +1,117 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+import json
+import math
+
+from .tools import (
+    assert_equal,
+    assert_less_equal,
+    assert_true,
+)
+
+from lib import stats
+
+def make_page(filename, width, height, bytes_in, bytes_out):
+    page = stats.PageStats(filename, bytes_in)
+    page.width = width
+    page.height = height
+    page.bytes_out = bytes_out
+    return page
+
+class test_page_stats:
+
+    def test_pixels(self):
+        page = stats.PageStats('a.png', 1000)
+        assert_equal(page.pixels, None)
+        page.width = 20
+        page.height = 10
+        assert_equal(page.pixels, 200)
+
+    def test_timing(self):
+        page = stats.PageStats('a.png', 1000)
+        with page.timing('read'):
+            pass
+        with page.timing('read'):
+            pass
+        assert_equal(page.timings.keys(), ['read'])
+        assert_less_equal(0.0, page.timings['read'])
+
+class test_document_stats:
+
+    def test_aggregate(self):
+        page1 = make_page('a.png', 20, 10, 1000, 100)
+        page1.chunks.update(INFO=10, Sjbz=50)
+        page2 = make_page('b.png', 30, 10, 2000, 300)
+        page2.chunks.update(INFO=10, BG44=200)
+        doc = stats.DocumentStats([page1, page2])
+        assert_equal(doc.bytes_in, 3000)
+        assert_equal(doc.bytes_out, 400)
+        assert_equal(doc.pixels, 500)
+        assert_equal(dict(doc.chunks), dict(INFO=20, Sjbz=50, BG44=200))
+
+    def test_bytes_out(self):
+        page = make_page('a.png', 20, 10, 1000, 100)
+        doc = stats.DocumentStats([page], bytes_out=150)
+        assert_equal(doc.bytes_out, 150)
+
+def test_bits_per_pixel():
+    assert_equal(stats.bits_per_pixel(100, 200), 4.0)
+    assert_true(math.isnan(stats.bits_per_pixel(100, 0)))
+
+def test_write_json():
+    page1 = make_page('a.png', 20, 10, 1000, 100)
+    page1.method = 'djvu'
+    page1.chunks.update(INFO=10)
+    with page1.timing('read'):
+        pass
+    page2 = make_page('b.djvu', None, None, 500, 500)
+    file = io.BytesIO()
+    writer = stats.JsonWriter(file)
+    writer.write(page1)
+    assert_equal(file.getvalue().count('\n'), 1)
+    writer.write(page2)
+    lines = file.getvalue().splitlines()
+    assert_equal(len(lines), 2)
+    record = json.loads(lines[0])
+    assert_equal(record['filename'], 'a.png')
+    assert_equal(record['pixels'], 200)
+    assert_equal(record['bytes-in'], 1000)
+    assert_equal(record['bytes-out'], 100)
+    assert_equal(record['bits-per-pixel'], 4.0)
+    assert_equal(record['method'], 'djvu')
+    assert_equal(record['params'], {})
+    assert_equal(record['chunks'], dict(INFO=10))
+    assert_equal(record['timings'].keys(), ['read'])
+    record = json.loads(lines[1])
+    assert_equal(record['pixels'], None)
+    assert_equal(record['bits-per-pixel'], None)
+
+def test_write_json_filename():
+    page = make_page('\xe2\x82\xac-\xff.png', 20, 10, 1000, 100)
+    file = io.BytesIO()
+    stats.JsonWriter(file).write(page)
+    record = json.loads(file.getvalue())
+    assert_equal(record['filename'], u'\u20AC-\uFFFD.png')
+
+def test_format_compression_info():
+    page = make_page('a.png', 20, 10, 1000, 100)
+    assert_equal(
+        stats.format_compression_info(page),
+        '4.000 bits/pixel; 10.000:1, 90.00% saved, 1000 bytes in, 100 bytes out'
+    )
+
+# vim:ts=4 sts=4 sw=4 et
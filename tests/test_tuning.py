@@ -0,0 +1,75 @@
+# encoding=UTF-8
+
+# Copyright © 2026 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of didjvu.
+#
+# didjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# didjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+from .tools import (
+    assert_almost_equal,
+    assert_equal,
+    assert_raises,
+)
+
+import PIL.Image
+
+from lib import djvu_support as djvu
+from lib import tuning
+
+def make_candidate(bytes_out, squared_error, n_samples=100):
+    candidate = tuning.Candidate([74, 84], djvu.CRCB.normal, 3)
+    candidate.add_result(bytes_out, squared_error, n_samples)
+    return candidate
+
+def test_get_candidates():
+    candidates = tuning.get_candidates('bg', slices=[[74], [80]], subsample=[2, 3])
+    assert_equal(
+        [(c.slices, c.crcb, c.subsample) for c in candidates],
+        [
+            (slices, crcb, subsample)
+            for slices in ([74], [80])
+            for crcb in tuning.DEFAULT_CANDIDATES['bg']['crcb']
+            for subsample in (2, 3)
+        ]
+    )
+
+def test_psnr():
+    assert_equal(tuning.psnr(0, 100), float('inf'))
+    assert_almost_equal(tuning.psnr(100, 100), 48.13, places=2)
+    assert_almost_equal(tuning.psnr(65025 * 100, 100), 0.0)
+
+def test_get_squared_error():
+    image1 = PIL.Image.new('RGB', (4, 5), (10, 20, 30))
+    image2 = PIL.Image.new('RGB', (4, 5), (13, 20, 26))
+    [squared_error, n_samples] = tuning.get_squared_error(image1, image2)
+    assert_equal(n_samples, 3 * 4 * 5)
+    assert_equal(squared_error, (9 + 16) * 4 * 5)
+    image3 = PIL.Image.new('RGB', (5, 4))
+    with assert_raises(ValueError):
+        tuning.get_squared_error(image1, image3)
+
+def test_pareto_front():
+    c1 = make_candidate(1000, 500)
+    c2 = make_candidate(2000, 100)
+    c3 = make_candidate(2500, 200)  # dominated by c2
+    c4 = make_candidate(3000, 0)
+    c5 = make_candidate(1000, 600)  # dominated by c1
+    front = tuning.pareto_front([c5, c4, c3, c2, c1])
+    assert_equal(front, [c1, c2, c4])
+
+def test_format_candidate():
+    candidate = make_candidate(12345, 100)
+    assert_equal(
+        tuning.format_candidate(candidate, 'bg'),
+        '     12345 bytes   48.13 dB  --bg-slices=74+10 --bg-crcb=normal --bg-subsample=3'
+    )
+
+# vim:ts=4 sts=4 sw=4 et
@@ -91,4 +91,15 @@ def test_proxy():
     gc.collect()
     assert_false(Del.ok)
 
+def test_wait():
+    def wait():
+        wait.n += 1
+    wait.n = 0
+    proxy = utils.Proxy(object(), wait, [])
+    utils.wait(proxy)
+    assert_equal(wait.n, 1)
+    utils.wait(proxy)
+    assert_equal(wait.n, 1)
+    utils.wait(object())
+
 # vim:ts=4 sts=4 sw=4 et
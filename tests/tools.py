@@ -21,13 +21,16 @@ import traceback
 
 from nose import SkipTest
 from nose.tools import (
+    assert_almost_equal,
     assert_equal,
     assert_false,
     assert_greater,
+    assert_in,
     assert_is,
     assert_is_instance,
     assert_is_none,
     assert_is_not_none,
+    assert_less_equal,
     assert_multi_line_equal,
     assert_not_equal,
     assert_raises,
@@ -168,15 +171,18 @@ if 'coverage' in sys.modules:
 
 __all__ = [
     'SkipTest',
+    'assert_almost_equal',
     'assert_equal',
     'assert_false',
     'assert_greater',
+    'assert_in',
     'assert_image_sizes_equal',
     'assert_images_equal',
     'assert_is',
     'assert_is_instance',
     'assert_is_none',
     'assert_is_not_none',
+    'assert_less_equal',
     'assert_multi_line_equal',
     'assert_not_equal',
     'assert_raises',